@@ -1,10 +1,10 @@
 import os
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify
 from markupsafe import escape
-from io import BytesIO
 
 from .storage.git_adapter import GitAdapter
-from .storage.errors import Conflict
+from .storage.errors import Conflict, UploadTooLarge
+from .downloads import send_storage_file
 
 app = Flask(__name__)
 
@@ -13,7 +13,12 @@ BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
 STORAGE_ROOT = os.path.join(BASE_DIR, 'data', 'storage')
 os.makedirs(STORAGE_ROOT, exist_ok=True)
 
-storage = GitAdapter(STORAGE_ROOT)
+MAX_UPLOAD_SIZE = int(os.environ['BHV_MAX_UPLOAD_SIZE']) if os.environ.get('BHV_MAX_UPLOAD_SIZE') else None
+if MAX_UPLOAD_SIZE is not None:
+    # reject oversized request bodies while they arrive (413), leaving room for the form fields
+    app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE + 64 * 1024
+
+storage = GitAdapter(STORAGE_ROOT, max_file_size=MAX_UPLOAD_SIZE)
 
 
 @app.route('/upload', methods=['POST'])
@@ -29,12 +34,13 @@ def upload():
 
     filename = f.filename
     relative_path = os.path.join(patient_id, filename)
-    data = f.read()
     try:
-        commit = storage.save_with_parent(relative_path, data, user_id=user_id, action=action, parent=parent)
+        commit = storage.save_with_parent(relative_path, f.stream, user_id=user_id, action=action, parent=parent)
     except Conflict as e:
         # handled by errorhandler, but return structure for clarity
-        return jsonify({'error': str(e)}), 409
+        return jsonify({'error': str(e), 'head': e.head}), 409
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
 
     current_head = storage.head(relative_path)
     return jsonify({'status': 'ok', 'commit': commit, 'head': current_head})
@@ -51,42 +57,36 @@ def history(patient_id, filename):
 def get_file(patient_id, filename):
     version = request.args.get('version')
     relative_path = os.path.join(patient_id, filename)
-    data = storage.get(relative_path, version=version)
-    return send_file(BytesIO(data), download_name=filename)
+    try:
+        return send_storage_file(storage, relative_path, version=version, download_name=filename)
+    except FileNotFoundError:
+        return jsonify({'error': 'not found'}), 404
 
 
 @app.route('/diff/<patient_id>/<path:filename>', methods=['GET'])
 def diff_versions(patient_id, filename):
-    """Return a unified diff between two versions. Query args: a, b (commit hexshas). If b omitted, compare a..HEAD."""
+    """Return a unified diff between two versions. Query args: a, b (commit hexshas). If b omitted, compare a..HEAD.
+    With format=json the structured diff (binary, stats, hunks, text) is returned; stat=1 omits hunks and text."""
     a = request.args.get('a')
     b = request.args.get('b')
     relative_path = os.path.join(patient_id, filename)
-    # use repo git diff
-    parts = relative_path.split(os.sep)
-    repo = storage._ensure_repo(parts[0])
-    rel = os.path.join(*parts[1:])
     if not a and not b:
         return jsonify({'error': 'provide at least one of a or b'}), 400
-    # if only a provided, compare a..HEAD
-    if a and not b:
-        range_spec = f"{a}..HEAD"
-    elif a and b:
-        range_spec = f"{a}..{b}"
-    else:
-        # only b provided -> HEAD..b
-        range_spec = f"HEAD..{b}"
+    stat_only = request.args.get('stat') in ('1', 'true')
 
     try:
-        diff_text = repo.git.diff(range_spec, '--', rel)
+        result = storage.diff(relative_path, a or 'HEAD', b or 'HEAD', stat_only=stat_only)
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
-    return (diff_text, 200, {'Content-Type': 'text/plain; charset=utf-8'})
+    if stat_only or request.args.get('format') == 'json':
+        return jsonify(result)
+    return (result['text'], 200, {'Content-Type': 'text/plain; charset=utf-8'})
 
 
 @app.errorhandler(Conflict)
 def handle_conflict(e):
-    return jsonify({'error': str(e)}), 409
+    return jsonify({'error': str(e), 'head': e.head}), 409
 
 
 @app.route('/admin/history/<patient_id>/<path:filename>', methods=['GET'])
@@ -0,0 +1,204 @@
+"""Fingerprinted, precompressed static assets.
+
+``build`` (run via ``python scripts/write_css.py --build``) copies everything
+under ``static/`` into ``static/dist/`` with a content hash in each file
+name, minifying CSS/JS and writing ``.gz`` (and ``.br`` when the brotli
+package is installed) next to text assets. Large raster images also get
+WebP renditions at a few widths for ``srcset`` (needs Pillow). The mapping
+from source path to built files is written to ``manifest.json``, which
+``AssetManifest`` reads to resolve URLs in templates. Hashed names change
+whenever the content does, so they are served with far-future caching.
+Without a build the helpers fall back to plain ``/static`` URLs.
+"""
+import gzip
+import hashlib
+import io
+import json
+import os
+import re
+import shutil
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # .br variants are skipped
+    brotli = None
+
+try:
+    from PIL import Image
+except ImportError:  # images are fingerprinted but not resized
+    Image = None
+
+MANIFEST_NAME = 'manifest.json'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.json', '.txt')
+RASTER = ('.png', '.jpg', '.jpeg')
+# widths of the WebP renditions made for raster images larger than the smallest one
+RESPONSIVE_WIDTHS = (480, 960, 1600)
+WEBP_QUALITY = 80
+HASH_LENGTH = 12
+
+
+def minify_css(text: str) -> str:
+    """Strip comments and insignificant whitespace. Spaces before ':' and around
+    '+'/'-' are kept, since they matter in selectors and calc()."""
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    text = re.sub(r':\s+', ':', text)
+    text = text.replace(';}', '}')
+    return text.strip()
+
+
+def minify_js(text: str) -> str:
+    """Conservative: drop comment-only lines, block comments that start a line,
+    indentation and blank lines. Code and string contents are left alone."""
+    out = []
+    in_block = False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if in_block:
+            if '*/' in stripped:
+                in_block = False
+            continue
+        if stripped.startswith('/*'):
+            in_block = '*/' not in stripped
+            continue
+        if not stripped or stripped.startswith('//'):
+            continue
+        out.append(stripped)
+    return '\n'.join(out) + '\n'
+
+
+def _hashed_name(rel_path: str, data: bytes, suffix: str = '') -> str:
+    stem, ext = os.path.splitext(rel_path)
+    digest = hashlib.sha256(data).hexdigest()[:HASH_LENGTH]
+    return f'{stem}{suffix}.{digest}{ext}'
+
+
+def _write(out_dir: str, rel_path: str, data: bytes) -> None:
+    target = os.path.join(out_dir, *rel_path.split('/'))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(data)
+    if rel_path.endswith(COMPRESSIBLE):
+        with open(target + '.gz', 'wb') as f:
+            # mtime=0 keeps the output byte-identical between builds
+            with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=9, mtime=0) as gz:
+                gz.write(data)
+        if brotli is not None:
+            with open(target + '.br', 'wb') as f:
+                f.write(brotli.compress(data, quality=11))
+
+
+def _renditions(data: bytes) -> List[Tuple[int, bytes]]:
+    if Image is None:
+        return []
+    result = []
+    with Image.open(io.BytesIO(data)) as img:
+        img.load()
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+        for width in RESPONSIVE_WIDTHS:
+            if width >= img.width:
+                break
+            height = round(img.height * width / img.width)
+            out = io.BytesIO()
+            img.resize((width, height), Image.LANCZOS).save(out, 'WEBP', quality=WEBP_QUALITY, method=6)
+            result.append((width, out.getvalue()))
+        out = io.BytesIO()
+        img.save(out, 'WEBP', quality=WEBP_QUALITY, method=6)
+        result.append((img.width, out.getvalue()))
+    return result
+
+
+def build(static_dir: str, out_dir: Optional[str] = None) -> Dict:
+    """Build every asset under ``static_dir`` into ``out_dir`` (default
+    ``static_dir/dist``), replacing a previous build; returns the manifest."""
+    out_dir = out_dir or os.path.join(static_dir, 'dist')
+    if os.path.isdir(out_dir):
+        shutil.rmtree(out_dir)
+    manifest = {'files': {}, 'srcset': {}}
+    for directory, dirs, files in os.walk(static_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.join(directory, d) != out_dir and not d.startswith('.'))
+        for name in sorted(files):
+            if name.startswith('.'):
+                continue
+            rel_path = os.path.relpath(os.path.join(directory, name), static_dir).replace(os.sep, '/')
+            with open(os.path.join(directory, name), 'rb') as f:
+                data = f.read()
+            if name.endswith('.css'):
+                data = minify_css(data.decode('utf-8')).encode('utf-8')
+            elif name.endswith('.js'):
+                data = minify_js(data.decode('utf-8')).encode('utf-8')
+            hashed = _hashed_name(rel_path, data)
+            _write(out_dir, hashed, data)
+            manifest['files'][rel_path] = hashed
+            if name.lower().endswith(RASTER):
+                variants = []
+                for width, webp in _renditions(data):
+                    variant = _hashed_name(os.path.splitext(rel_path)[0] + '.webp', webp, suffix=f'-{width}')
+                    _write(out_dir, variant, webp)
+                    variants.append([width, variant])
+                if variants:
+                    manifest['srcset'][rel_path] = variants
+    with open(os.path.join(out_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    return manifest
+
+
+class AssetManifest:
+    """Resolves source asset paths to built, fingerprinted file names.
+
+    ``auto_reload`` re-reads the manifest when it changes on disk (for
+    development); otherwise it is read once.
+    """
+
+    def __init__(self, dist_dir: str, auto_reload: bool = False):
+        self.dist_dir = dist_dir
+        self.auto_reload = auto_reload
+        self._files: Dict[str, str] = {}
+        self._srcset: Dict[str, List[List]] = {}
+        self._mtime = None
+        self.reload()
+
+    def reload(self) -> None:
+        path = os.path.join(self.dist_dir, MANIFEST_NAME)
+        try:
+            mtime = os.path.getmtime(path)
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            mtime, data = None, {}
+        self._files = data.get('files', {})
+        self._srcset = data.get('srcset', {})
+        self._mtime = mtime
+
+    def _check(self) -> None:
+        if self.auto_reload:
+            try:
+                mtime = os.path.getmtime(os.path.join(self.dist_dir, MANIFEST_NAME))
+            except OSError:
+                mtime = None
+            if mtime != self._mtime:
+                self.reload()
+
+    @property
+    def built(self) -> bool:
+        self._check()
+        return bool(self._files)
+
+    def lookup(self, rel_path: str, width: Optional[int] = None) -> Optional[str]:
+        """Built file name for ``rel_path``, or None if it was not built. With
+        ``width``, the smallest WebP rendition at least that wide, else the largest."""
+        self._check()
+        variants = self._srcset.get(rel_path) if width is not None else None
+        if variants:
+            for variant_width, name in variants:
+                if variant_width >= width:
+                    return name
+            return variants[-1][1]
+        return self._files.get(rel_path)
+
+    def srcset(self, rel_path: str) -> List[Tuple[int, str]]:
+        self._check()
+        return [(w, name) for w, name in self._srcset.get(rel_path, [])]
@@ -1,9 +1,50 @@
+import base64
+import json
 import os
 from datetime import datetime
 
 MONGO_URI = os.environ.get('MONGO_URI')
+# Embedded backend used when MONGO_URI is not set: 'sqlite' (default) or 'tinydb'
+DB_BACKEND = 'mongo' if MONGO_URI else os.environ.get('BHV_DB_BACKEND', 'sqlite').strip().lower()
+DATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'data')
+TINYDB_PATH = os.path.join(DATA_DIR, 'db.json')
 
-if MONGO_URI:
+# Orderings accepted by list_entries(); value is True for descending
+ENTRY_SORTS = {'timestamp desc': True, '-timestamp': True, 'timestamp asc': False, 'timestamp': False}
+
+
+def _parse_sort(sort):
+    key = ' '.join(str(sort).lower().split())
+    if key not in ENTRY_SORTS:
+        raise ValueError(f"unsupported sort {sort!r}; expected one of {sorted(ENTRY_SORTS)}")
+    return ENTRY_SORTS[key]
+
+
+def _parse_offset(offset):
+    offset = int(offset or 0)
+    if offset < 0:
+        raise ValueError(f"offset must not be negative, got {offset}")
+    return offset
+
+
+def encode_cursor(timestamp, entry_id):
+    """Opaque keyset cursor for list_entries(): the (timestamp, id) of the last row returned."""
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.isoformat()
+    raw = json.dumps([timestamp, entry_id if isinstance(entry_id, int) else str(entry_id)])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor(); raises ValueError for malformed cursors."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, entry_id = json.loads(raw)
+    except Exception:
+        raise ValueError('invalid cursor')
+    return timestamp, entry_id
+
+if DB_BACKEND == 'mongo':
     from pymongo import MongoClient
     client = MongoClient(MONGO_URI)
     db = client.get_default_database()
@@ -12,6 +53,9 @@ if MONGO_URI:
         # Ensure indexes
         db.users.create_index('email', unique=True)
         db.entries.create_index('patient_id')
+        # keyset pagination for list_entries(), per patient and system-wide
+        db.entries.create_index([('patient_id', 1), ('timestamp', -1), ('_id', -1)])
+        db.entries.create_index([('timestamp', -1), ('_id', -1)])
 
     def create_user(email, password_hash, role='patient'):
         user = {'email': email, 'password': password_hash, 'role': role}
@@ -21,17 +65,54 @@ if MONGO_URI:
     def get_user_by_email(email):
         return db.users.find_one({'email': email})
 
+    def set_user_role(email, role):
+        return db.users.update_one({'email': email}, {'$set': {'role': role}}).matched_count > 0
+
     def create_entry(patient_id, filename, narrative, timestamp=None):
         doc = {'patient_id': patient_id, 'filename': filename, 'narrative': narrative, 'timestamp': timestamp or datetime.utcnow()}
         res = db.entries.insert_one(doc)
         return str(res.inserted_id)
 
+    def create_entries(rows):
+        """Insert many (patient_id, filename, narrative, timestamp) rows with one
+        insert_many; returns their ids in order."""
+        docs = [{'patient_id': p, 'filename': f, 'narrative': n, 'timestamp': t or datetime.utcnow()}
+                for p, f, n, t in rows]
+        if not docs:
+            return []
+        return [str(i) for i in db.entries.insert_many(docs, ordered=True).inserted_ids]
+
     def list_entries_for_patient(patient_id):
         return list(db.entries.find({'patient_id': patient_id}))
 
     def list_all_entries():
         return list(db.entries.find())
 
+    def list_entries(patient_id=None, limit=50, cursor=None, offset=None, sort='timestamp desc'):
+        """Return (entries, next_cursor) for one page ordered by timestamp then _id.
+        Pass the returned cursor back to get the following page; offset is only
+        used when no cursor is given."""
+        from bson import ObjectId
+        descending = _parse_sort(sort)
+        offset = _parse_offset(offset)
+        direction = -1 if descending else 1
+        query = {} if patient_id is None else {'patient_id': patient_id}
+        if cursor:
+            ts, last_id = decode_cursor(cursor)
+            ts = datetime.fromisoformat(ts)
+            last_id = ObjectId(last_id)
+            op = '$lt' if descending else '$gt'
+            query['$or'] = [{'timestamp': {op: ts}}, {'timestamp': ts, '_id': {op: last_id}}]
+        found = db.entries.find(query).sort([('timestamp', direction), ('_id', direction)])
+        if offset and not cursor:
+            found = found.skip(offset)
+        docs = list(found.limit(limit + 1))
+        next_cursor = encode_cursor(docs[limit - 1]['timestamp'], docs[limit - 1]['_id']) if len(docs) > limit else None
+        return docs[:limit], next_cursor
+
+    def count_entries(patient_id=None):
+        return db.entries.count_documents({} if patient_id is None else {'patient_id': patient_id})
+
     def get_entry(entry_id):
         from bson import ObjectId
         return db.entries.find_one({'_id': ObjectId(entry_id)})
@@ -44,12 +125,29 @@ if MONGO_URI:
         from bson import ObjectId
         db.entries.update_one({'_id': ObjectId(entry_id)}, {'$set': kwargs})
 
-else:
+elif DB_BACKEND == 'tinydb':
     # TinyDB fallback
+    import threading
     from tinydb import TinyDB, Query
-    DB_PATH = os.path.join(os.path.dirname(__file__), '..', 'data', 'db.json')
+    DB_PATH = TINYDB_PATH
     os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-    tdb = TinyDB(DB_PATH)
+    # TinyDB is not thread-safe; serialise access from threaded servers
+    _lock = threading.RLock()
+    write_behind = None
+    if str(os.environ.get('BHV_TINYDB_WRITE_BEHIND', '')).lower() in ('1', 'true', 'yes'):
+        # Opt-in: keep tables in memory and flush them atomically in the
+        # background (see bhv.tinydb_cache); writes made after the last flush
+        # are lost if the process is killed.
+        from .tinydb_cache import AtomicJSONStorage, WriteBehindMiddleware
+        write_behind = WriteBehindMiddleware(
+            AtomicJSONStorage,
+            flush_interval=float(os.environ.get('BHV_TINYDB_FLUSH_INTERVAL', 1.0)),
+            flush_writes=int(os.environ.get('BHV_TINYDB_FLUSH_WRITES', 100)),
+            lock=_lock,
+        )
+        tdb = TinyDB(DB_PATH, storage=write_behind)
+    else:
+        tdb = TinyDB(DB_PATH)
     users = tdb.table('users')
     entries = tdb.table('entries')
     UserQ = Query()
@@ -59,27 +157,376 @@ else:
 
     def create_user(email, password_hash, role='patient'):
         user = {'email': email, 'password': password_hash, 'role': role}
-        return users.insert(user)
+        with _lock:
+            return users.insert(user)
 
     def get_user_by_email(email):
-        res = users.search(UserQ.email == email)
+        with _lock:
+            res = users.search(UserQ.email == email)
         return res[0] if res else None
 
+    def set_user_role(email, role):
+        with _lock:
+            return bool(users.update({'role': role}, UserQ.email == email))
+
     def create_entry(patient_id, filename, narrative, timestamp=None):
         doc = {'patient_id': patient_id, 'filename': filename, 'narrative': narrative, 'timestamp': (timestamp or datetime.utcnow()).isoformat()}
-        return entries.insert(doc)
+        with _lock:
+            return entries.insert(doc)
+
+    def create_entries(rows):
+        """Insert many (patient_id, filename, narrative, timestamp) rows in one write; returns their ids."""
+        docs = [{'patient_id': p, 'filename': f, 'narrative': n, 'timestamp': (t or datetime.utcnow()).isoformat()}
+                for p, f, n, t in rows]
+        with _lock:
+            return entries.insert_multiple(docs)
+
+    def list_entries_for_patient(patient_id):
+        with _lock:
+            return entries.search(Query().patient_id == patient_id)
+
+    def list_all_entries():
+        with _lock:
+            return entries.all()
+
+    def list_entries(patient_id=None, limit=50, cursor=None, offset=None, sort='timestamp desc'):
+        """Return (entries, next_cursor); see the Mongo implementation. TinyDB
+        keeps everything in memory, so this sorts and slices the matches."""
+        descending = _parse_sort(sort)
+        offset = _parse_offset(offset)
+        with _lock:
+            docs = entries.all() if patient_id is None else entries.search(Query().patient_id == patient_id)
+        key = lambda d: (d.get('timestamp') or '', d.doc_id)
+        docs.sort(key=key, reverse=descending)
+        if cursor:
+            ts, last_id = decode_cursor(cursor)
+            last = (ts or '', int(last_id))
+            docs = [d for d in docs if (key(d) < last if descending else key(d) > last)]
+        elif offset:
+            docs = docs[offset:]
+        next_cursor = encode_cursor(docs[limit - 1].get('timestamp'), docs[limit - 1].doc_id) if len(docs) > limit else None
+        return docs[:limit], next_cursor
+
+    def count_entries(patient_id=None):
+        with _lock:
+            return len(entries) if patient_id is None else entries.count(Query().patient_id == patient_id)
+
+    def get_entry(entry_id):
+        with _lock:
+            return entries.get(doc_id=int(entry_id))
+
+    def delete_entry(entry_id):
+        with _lock:
+            entries.remove(doc_ids=[int(entry_id)])
+
+    def update_entry(entry_id, **kwargs):
+        with _lock:
+            entries.update(kwargs, doc_ids=[int(entry_id)])
+
+    def flush_db():
+        """Write any cached TinyDB changes to disk now (no-op without write-behind)."""
+        if write_behind is not None:
+            write_behind.flush()
+
+    def db_stats():
+        """Flush latency and pending-write counters of the write-behind cache."""
+        return write_behind.stats() if write_behind is not None else {}
+
+elif DB_BACKEND == 'sqlite':
+    # Embedded SQLite store (stdlib, WAL mode) with indexes on users.email and
+    # entries.patient_id; rows come back as dicts shaped like Mongo documents
+    # (the row id is exposed as '_id').
+    import sqlite3
+    import threading
+
+    DB_PATH = os.environ.get('BHV_SQLITE_PATH') or os.path.join(DATA_DIR, 'bhv.sqlite3')
+    os.makedirs(os.path.dirname(os.path.abspath(DB_PATH)), exist_ok=True)
+    _ENTRY_COLUMNS = ('patient_id', 'filename', 'narrative', 'timestamp')
+    _local = threading.local()
+
+    def _conn():
+        # sqlite3 connections cannot be shared between threads
+        conn = getattr(_local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(DB_PATH, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA foreign_keys=ON')
+            _local.conn = conn
+        return conn
+
+    def _user_doc(row):
+        return {'_id': row['id'], 'email': row['email'], 'password': row['password'], 'role': row['role']}
+
+    def _entry_doc(row):
+        doc = {'_id': row['id']}
+        doc.update(json.loads(row['extra']) if row['extra'] else {})
+        for col in _ENTRY_COLUMNS:
+            doc[col] = row[col]
+        return doc
+
+    def init_db():
+        conn = _conn()
+        with conn:
+            conn.executescript('''
+                CREATE TABLE IF NOT EXISTS users (
+                    id INTEGER PRIMARY KEY,
+                    email TEXT NOT NULL UNIQUE,
+                    password TEXT,
+                    role TEXT
+                );
+                CREATE TABLE IF NOT EXISTS entries (
+                    id INTEGER PRIMARY KEY,
+                    patient_id TEXT,
+                    filename TEXT,
+                    narrative TEXT,
+                    timestamp TEXT,
+                    extra TEXT
+                );
+                DROP INDEX IF EXISTS entries_patient_id;
+                CREATE INDEX IF NOT EXISTS entries_patient_ts ON entries(patient_id, timestamp, id);
+                CREATE INDEX IF NOT EXISTS entries_ts ON entries(timestamp, id);
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            ''')
+        migrated = conn.execute("SELECT value FROM meta WHERE key = 'tinydb_migrated'").fetchone()
+        if migrated is None:
+            # one-shot import of an existing TinyDB store so switching the
+            # default backend does not hide earlier records
+            if os.path.exists(TINYDB_PATH):
+                migrate_from_tinydb(TINYDB_PATH)
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('tinydb_migrated', ?)",
+                             (datetime.utcnow().isoformat(),))
+
+    def migrate_from_tinydb(json_path=TINYDB_PATH):
+        """Copy users and entries from a TinyDB JSON file, keeping their ids.
+        Rows that already exist (same id, or same email for users) are skipped.
+        Returns {'users': n, 'entries': n} with the number of rows inserted."""
+        with open(json_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        conn = _conn()
+        counts = {'users': 0, 'entries': 0}
+        with conn:
+            for doc_id, user in (data.get('users') or {}).items():
+                cur = conn.execute('INSERT OR IGNORE INTO users (id, email, password, role) VALUES (?, ?, ?, ?)',
+                                   (int(doc_id), user.get('email'), user.get('password'), user.get('role', 'patient')))
+                counts['users'] += cur.rowcount
+            for doc_id, entry in (data.get('entries') or {}).items():
+                extra = {k: v for k, v in entry.items() if k not in _ENTRY_COLUMNS}
+                cur = conn.execute('INSERT OR IGNORE INTO entries (id, patient_id, filename, narrative, timestamp, extra) '
+                                   'VALUES (?, ?, ?, ?, ?, ?)',
+                                   (int(doc_id), entry.get('patient_id'), entry.get('filename'), entry.get('narrative'),
+                                    entry.get('timestamp') or '', json.dumps(extra) if extra else None))
+                counts['entries'] += cur.rowcount
+        return counts
+
+    def create_user(email, password_hash, role='patient'):
+        conn = _conn()
+        with conn:
+            cur = conn.execute('INSERT INTO users (email, password, role) VALUES (?, ?, ?)', (email, password_hash, role))
+        return cur.lastrowid
+
+    def get_user_by_email(email):
+        row = _conn().execute('SELECT * FROM users WHERE email = ?', (email,)).fetchone()
+        return _user_doc(row) if row else None
+
+    def set_user_role(email, role):
+        conn = _conn()
+        with conn:
+            cur = conn.execute('UPDATE users SET role = ? WHERE email = ?', (role, email))
+        return cur.rowcount > 0
+
+    def create_entry(patient_id, filename, narrative, timestamp=None):
+        conn = _conn()
+        with conn:
+            cur = conn.execute('INSERT INTO entries (patient_id, filename, narrative, timestamp) VALUES (?, ?, ?, ?)',
+                               (patient_id, filename, narrative, (timestamp or datetime.utcnow()).isoformat()))
+        return cur.lastrowid
+
+    def create_entries(rows):
+        """Insert many (patient_id, filename, narrative, timestamp) rows in a single
+        transaction; returns their ids in order."""
+        conn = _conn()
+        ids = []
+        with conn:
+            for patient_id, filename, narrative, timestamp in rows:
+                cur = conn.execute('INSERT INTO entries (patient_id, filename, narrative, timestamp) VALUES (?, ?, ?, ?)',
+                                   (patient_id, filename, narrative, (timestamp or datetime.utcnow()).isoformat()))
+                ids.append(cur.lastrowid)
+        return ids
 
     def list_entries_for_patient(patient_id):
-        return entries.search(Query().patient_id == patient_id)
+        rows = _conn().execute('SELECT * FROM entries WHERE patient_id = ? ORDER BY id', (patient_id,))
+        return [_entry_doc(r) for r in rows]
 
     def list_all_entries():
-        return entries.all()
+        return [_entry_doc(r) for r in _conn().execute('SELECT * FROM entries ORDER BY id')]
+
+    def list_entries(patient_id=None, limit=50, cursor=None, offset=None, sort='timestamp desc'):
+        """Return (entries, next_cursor); see the Mongo implementation. Uses the
+        (patient_id, timestamp, id) / (timestamp, id) indexes for keyset paging."""
+        descending = _parse_sort(sort)
+        offset = _parse_offset(offset)
+        where, params = [], []
+        if patient_id is not None:
+            where.append('patient_id = ?')
+            params.append(patient_id)
+        if cursor:
+            ts, last_id = decode_cursor(cursor)
+            where.append(f"(timestamp, id) {'<' if descending else '>'} (?, ?)")
+            params.extend([ts or '', int(last_id)])
+        order = 'DESC' if descending else 'ASC'
+        sql = 'SELECT * FROM entries'
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f' ORDER BY timestamp {order}, id {order} LIMIT ?'
+        params.append(limit + 1)
+        if offset and not cursor:
+            sql += ' OFFSET ?'
+            params.append(offset)
+        docs = [_entry_doc(r) for r in _conn().execute(sql, params)]
+        next_cursor = encode_cursor(docs[limit - 1]['timestamp'], docs[limit - 1]['_id']) if len(docs) > limit else None
+        return docs[:limit], next_cursor
+
+    def count_entries(patient_id=None):
+        if patient_id is None:
+            return _conn().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+        return _conn().execute('SELECT COUNT(*) FROM entries WHERE patient_id = ?', (patient_id,)).fetchone()[0]
 
     def get_entry(entry_id):
-        return entries.get(doc_id=int(entry_id))
+        row = _conn().execute('SELECT * FROM entries WHERE id = ?', (int(entry_id),)).fetchone()
+        return _entry_doc(row) if row else None
 
     def delete_entry(entry_id):
-        entries.remove(doc_ids=[int(entry_id)])
+        conn = _conn()
+        with conn:
+            conn.execute('DELETE FROM entries WHERE id = ?', (int(entry_id),))
 
     def update_entry(entry_id, **kwargs):
-        entries.update(kwargs, doc_ids=[int(entry_id)])
+        conn = _conn()
+        with conn:
+            row = conn.execute('SELECT extra FROM entries WHERE id = ?', (int(entry_id),)).fetchone()
+            if row is None:
+                return
+            columns = {k: v for k, v in kwargs.items() if k in _ENTRY_COLUMNS}
+            extra_fields = {k: v for k, v in kwargs.items() if k not in _ENTRY_COLUMNS}
+            if extra_fields:
+                extra = json.loads(row['extra']) if row['extra'] else {}
+                extra.update(extra_fields)
+                columns['extra'] = json.dumps(extra)
+            if columns:
+                assignments = ', '.join(f'{col} = ?' for col in columns)
+                conn.execute(f'UPDATE entries SET {assignments} WHERE id = ?', (*columns.values(), int(entry_id)))
+
+else:
+    raise ValueError(f"Unknown BHV_DB_BACKEND {DB_BACKEND!r}; expected 'sqlite' or 'tinydb'")
+
+
+# -- full-text search ---------------------------------------------------------
+# The backends above only store entries; narratives and filenames are also
+# kept in an in-memory inverted index (bhv.search) so /ask_me keyword queries
+# do not scan the entries table. The index is built on first search and kept
+# current by the create/update/delete wrappers below; writes made by other
+# processes are caught by a row count check before each search and a rebuild
+# every BHV_SEARCH_REFRESH_SECONDS (0 = never).
+from .search import SearchIndex
+
+search_index = SearchIndex(refresh_interval=float(os.environ.get('BHV_SEARCH_REFRESH_SECONDS', 60)) or None)
+
+
+def entry_id_of(entry):
+    """Backend-neutral id of an entry document, as a string."""
+    doc_id = getattr(entry, 'doc_id', None)
+    if doc_id is None:
+        doc_id = entry.get('_id')
+    return str(doc_id) if doc_id is not None else None
+
+
+def _search_documents():
+    for e in list_all_entries():
+        yield entry_id_of(e), e.get('patient_id'), e.get('narrative'), e.get('filename')
+
+
+def search_entries(query, patient_id=None, k=10):
+    """Return up to k entries whose narrative or filename match ``query``, best
+    match first (BM25). With patient_id only that patient's entries are searched."""
+    search_index.ensure_built(_search_documents, count_entries)
+    results = []
+    for doc_id, _score in search_index.search(query, patient_id=patient_id, k=k):
+        entry = get_entry(doc_id)
+        if entry is not None:
+            results.append(entry)
+    return results
+
+
+_backend_create_entry = create_entry
+_backend_create_entries = create_entries
+_backend_update_entry = update_entry
+_backend_delete_entry = delete_entry
+
+
+def create_entry(patient_id, filename, narrative, timestamp=None):
+    entry_id = _backend_create_entry(patient_id, filename, narrative, timestamp)
+    search_index.add(entry_id, patient_id, narrative, filename)
+    return entry_id
+
+
+def create_entries(rows):
+    """Bulk version of create_entry for (patient_id, filename, narrative, timestamp) rows."""
+    rows = list(rows)
+    ids = _backend_create_entries(rows)
+    for entry_id, (patient_id, filename, narrative, _timestamp) in zip(ids, rows):
+        search_index.add(entry_id, patient_id, narrative, filename)
+    return ids
+
+
+def update_entry(entry_id, **kwargs):
+    _backend_update_entry(entry_id, **kwargs)
+    if search_index.built and ('narrative' in kwargs or 'filename' in kwargs or 'patient_id' in kwargs):
+        entry = get_entry(entry_id)
+        if entry is not None:
+            search_index.add(entry_id, entry.get('patient_id'), entry.get('narrative'), entry.get('filename'))
+
+
+def delete_entry(entry_id):
+    _backend_delete_entry(entry_id)
+    search_index.remove(entry_id)
+
+
+# -- user cache ---------------------------------------------------------------
+# Every authenticated request resolves the session's user by email. Records
+# are cached per process for BHV_USER_CACHE_TTL seconds (0 disables) and
+# dropped when this process creates the user or changes its role; other
+# workers see such changes once the TTL runs out.
+from .cache import TTLCache
+
+user_cache = TTLCache(maxsize=int(os.environ.get('BHV_USER_CACHE_SIZE', '1024')),
+                      ttl=float(os.environ.get('BHV_USER_CACHE_TTL', '30')))
+
+_backend_create_user = create_user
+_backend_get_user_by_email = get_user_by_email
+_backend_set_user_role = set_user_role
+
+
+def create_user(email, password_hash, role='patient'):
+    try:
+        return _backend_create_user(email, password_hash, role)
+    finally:
+        user_cache.invalidate(email)
+
+
+def get_user_by_email(email):
+    return user_cache.get_or_load(email, lambda: _backend_get_user_by_email(email))
+
+
+def set_user_role(email, role):
+    """Change a user's role; returns False if there is no such user."""
+    try:
+        return _backend_set_user_role(email, role)
+    finally:
+        user_cache.invalidate(email)
+
+
+def user_cache_stats():
+    return user_cache.stats()
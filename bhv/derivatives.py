@@ -0,0 +1,158 @@
+"""Thumbnails and web-sized previews of uploaded images.
+
+Renditions are cached on disk keyed by the source file's blob id, so every
+commit (and every patient) holding the same bytes shares one set of files,
+and a cached rendition never changes. Pillow is optional: without it
+``DerivativeStore.enabled`` is False and callers keep linking to originals.
+"""
+import io
+import os
+import re
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow not installed: derivatives are disabled
+    Image = None
+
+# kind -> bounding box in pixels; aspect ratio is kept
+SIZES: Dict[str, Tuple[int, int]] = {'thumb': (320, 320), 'preview': (1280, 1280)}
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff')
+JPEG_QUALITY = 82
+
+_BLOB_ID_RE = re.compile(r'[0-9a-f]{40}|[0-9a-f]{64}')
+
+
+def is_image(filename: str) -> bool:
+    return filename.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def valid_blob_id(blob: str) -> bool:
+    return bool(blob) and _BLOB_ID_RE.fullmatch(blob) is not None
+
+
+def render(data: bytes, size: Tuple[int, int], quality: int = JPEG_QUALITY) -> bytes:
+    """Downscale an image to fit ``size`` and encode it as a progressive JPEG."""
+    with Image.open(io.BytesIO(data)) as img:
+        # let the JPEG decoder skip detail we are about to throw away
+        img.draft('RGB', (size[0] * 2, size[1] * 2))
+        img = ImageOps.exif_transpose(img)
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img = img.convert('RGBA')
+            background = Image.new('RGB', img.size, (255, 255, 255))
+            background.paste(img, mask=img.getchannel('A'))
+            img = background
+        elif img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.thumbnail(size, Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, 'JPEG', quality=quality, optimize=True, progressive=True)
+        return out.getvalue()
+
+
+class DerivativeStore:
+    """On-disk cache of image renditions, filled by a small worker pool.
+
+    Files live at ``<root>/<kind>/<aa>/<blob id>.jpg``. ``submit`` queues
+    generation after an upload or edit so list pages find renditions ready;
+    ``path`` generates a missing one on demand (for historical versions, or
+    before the queued job has run). Sources larger than
+    ``max_source_bytes`` are skipped, as are files that are not images.
+    """
+
+    def __init__(self, root: str, sizes: Optional[Dict[str, Tuple[int, int]]] = None, workers: int = 2,
+                 max_source_bytes: int = 50 * 1024 * 1024, wait_timeout: float = 30.0):
+        self.root = root
+        self.sizes = dict(sizes or SIZES)
+        self.max_source_bytes = max_source_bytes
+        self.wait_timeout = wait_timeout
+        self.enabled = Image is not None
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bhv-derivatives') if workers else None
+        self._inflight: Dict[str, threading.Event] = {}  # blob id -> set when rendered
+        self._mutex = threading.Lock()
+        self.generated = 0
+        self.failed = 0
+
+    def file(self, kind: str, blob: str) -> str:
+        return os.path.join(self.root, kind, blob[:2], blob + '.jpg')
+
+    def submit(self, storage, relative_path: str, version: Optional[str] = 'HEAD') -> None:
+        """Generate every rendition of ``relative_path`` in the background."""
+        if not self.enabled or not is_image(relative_path):
+            return
+        if self._pool is None:
+            self._generate_all(storage, relative_path, version)
+        else:
+            self._pool.submit(self._generate_all, storage, relative_path, version)
+
+    def path(self, storage, kind: str, relative_path: str, blob: str, version: Optional[str] = 'HEAD') -> Optional[str]:
+        """Cached rendition of the file, generating it from ``version`` if needed.
+        Returns None if it cannot be produced or ``blob`` is not the file's blob at
+        ``version`` (so a blob id alone never grants access to another file's rendition)."""
+        if not self.enabled or kind not in self.sizes or not valid_blob_id(blob) or not is_image(relative_path):
+            return None
+        try:
+            if storage.blob_id(relative_path, version) != blob:
+                return None
+        except FileNotFoundError:
+            return None
+        target = self.file(kind, blob)
+        if os.path.exists(target):
+            return target
+        self._generate(storage, relative_path, version, blob)
+        return target if os.path.exists(target) else None
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._mutex:
+            return {'generated': self.generated, 'failed': self.failed, 'in_flight': len(self._inflight)}
+
+    def _generate_all(self, storage, relative_path: str, version: Optional[str]) -> None:
+        try:
+            blob = storage.blob_id(relative_path, version)
+        except FileNotFoundError:
+            return
+        if blob:
+            self._generate(storage, relative_path, version, blob)
+
+    def _generate(self, storage, relative_path: str, version: Optional[str], blob: str) -> None:
+        """Render every missing size of ``blob``; decoding the source dominates the cost."""
+        with self._mutex:
+            # one rendering per blob at a time; concurrent callers wait for it
+            event = self._inflight.get(blob)
+            owner = event is None
+            if owner:
+                event = self._inflight[blob] = threading.Event()
+        if not owner:
+            event.wait(self.wait_timeout)
+            return
+        try:
+            missing = [k for k in self.sizes if not os.path.exists(self.file(k, blob))]
+            if not missing or storage.size(relative_path, version) > self.max_source_bytes:
+                return
+            data = b''.join(storage.get_stream(relative_path, version))
+            for kind in missing:
+                rendition = render(data, self.sizes[kind])
+                target = self.file(kind, blob)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(target))
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(rendition)
+                os.replace(tmp, target)
+                with self._mutex:
+                    self.generated += 1
+        except Exception as e:
+            # not decodable as an image, or the file vanished
+            with self._mutex:
+                self.failed += 1
+            print('Derivative generation failed for', relative_path, e)
+        finally:
+            with self._mutex:
+                del self._inflight[blob]
+            event.set()
@@ -0,0 +1,181 @@
+"""Structured diffs between two versions of a stored file.
+
+``StorageAdapter.diff`` returns a dict with ``binary``, ``stats``
+(``additions``/``deletions``), ``hunks`` and the unified ``text``.
+GitAdapter produces it with git's own diff; other adapters fall back to
+``python_diff`` here, which never decodes binary files (a NUL byte in the
+first 8000 bytes, git's heuristic, marks a file binary) and, above
+``max_bytes`` of text, replaces difflib with a linear-time diff that trims
+the common leading and trailing lines and shows the rest as one block.
+Sizes are checked before anything is read: versions together larger than
+``max_load_bytes`` are never loaded and get a size summary instead.
+
+``render_diff`` is what the /diff view uses: it summarises binary files by
+size and blob id and caches results by the file path and the pair of
+blob ids, since versions are immutable. Cached results never name the
+commits they were computed for; the binary summary is filled in per call.
+"""
+import difflib
+import os
+import re
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from .cache import TTLCache
+
+BINARY_SNIFF_BYTES = 8000
+DEFAULT_MAX_DIFF_BYTES = 2 * 1024 * 1024
+DEFAULT_MAX_LOAD_BYTES = 64 * 1024 * 1024
+
+_HUNK_RE = re.compile(r'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+def is_binary(head: bytes) -> bool:
+    return b'\0' in head[:BINARY_SNIFF_BYTES]
+
+
+def _decode_lines(data: bytes) -> List[str]:
+    try:
+        return data.decode('utf-8').splitlines()
+    except UnicodeDecodeError:
+        return data.decode('latin-1', errors='ignore').splitlines()
+
+
+def _sniff(storage, relative_path: str, version: Optional[str]) -> bytes:
+    stream = storage.get_stream(relative_path, version, chunk_size=BINARY_SNIFF_BYTES)
+    try:
+        return next(iter(stream), b'')
+    finally:
+        close = getattr(stream, 'close', None)
+        if close is not None:
+            close()
+
+
+def fast_unified_diff(a: List[str], b: List[str], fromfile: str = '', tofile: str = '', n: int = 3) -> Iterator[str]:
+    """Unified diff in O(len(a) + len(b)): everything between the common
+    prefix and the common suffix is reported as a single changed block."""
+    if a == b:
+        return
+    start = 0
+    limit = min(len(a), len(b))
+    while start < limit and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < limit - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    ctx_start = max(start - n, 0)
+    a_stop, b_stop = len(a) - end, len(b) - end
+    a_ctx_stop, b_ctx_stop = min(a_stop + n, len(a)), min(b_stop + n, len(b))
+
+    def _range(first, stop):
+        length = stop - first
+        return f'{first + 1 if length else first},{length}'
+
+    yield f'--- {fromfile}'
+    yield f'+++ {tofile}'
+    yield f'@@ -{_range(ctx_start, a_ctx_stop)} +{_range(ctx_start, b_ctx_stop)} @@'
+    for line in a[ctx_start:start]:
+        yield ' ' + line
+    for line in a[start:a_stop]:
+        yield '-' + line
+    for line in b[start:b_stop]:
+        yield '+' + line
+    for line in islice(a, a_stop, a_ctx_stop):
+        yield ' ' + line
+
+
+def parse_hunks(lines: Iterable[str]) -> List[Dict]:
+    """Split unified diff lines into hunks; file headers before the first hunk are skipped."""
+    hunks = []
+    current = None
+    for line in lines:
+        m = _HUNK_RE.match(line)
+        if m:
+            current = {
+                'header': line,
+                'old_start': int(m.group(1)), 'old_lines': int(m.group(2) or 1),
+                'new_start': int(m.group(3)), 'new_lines': int(m.group(4) or 1),
+                'lines': [],
+            }
+            hunks.append(current)
+        elif current is not None and line[:1] in (' ', '-', '+', '\\'):
+            current['lines'].append(line)
+    return hunks
+
+
+def make_result(binary: bool = False, hunks: Optional[List[Dict]] = None, text: str = '',
+                additions: Optional[int] = None, deletions: Optional[int] = None) -> Dict:
+    hunks = hunks or []
+    if additions is None:
+        additions = sum(1 for h in hunks for line in h['lines'] if line.startswith('+'))
+    if deletions is None:
+        deletions = sum(1 for h in hunks for line in h['lines'] if line.startswith('-'))
+    return {'binary': binary, 'stats': {'additions': additions, 'deletions': deletions}, 'hunks': hunks, 'text': text}
+
+
+def python_diff(storage, relative_path: str, old: str, new: str, stat_only: bool = False,
+                max_bytes: int = DEFAULT_MAX_DIFF_BYTES, max_load_bytes: int = DEFAULT_MAX_LOAD_BYTES) -> Dict:
+    """Diff two versions read through ``storage`` (see the module docstring).
+    A result for files too large to load has ``stats`` None."""
+    if is_binary(_sniff(storage, relative_path, old)) or is_binary(_sniff(storage, relative_path, new)):
+        return make_result(binary=True)
+    old_size, new_size = storage.size(relative_path, old), storage.size(relative_path, new)
+    if old_size + new_size > max_load_bytes:
+        result = make_result(text=f'Files too large to diff ({old_size} and {new_size} bytes)')
+        result['stats'] = None
+        return result
+    # labelled like git's diff, so the text does not depend on which commits were compared
+    path = '/'.join(relative_path.split(os.sep)[1:]) or relative_path
+    fromfile, tofile = f'a/{path}', f'b/{path}'
+    old_lines = _decode_lines(storage.get(relative_path, old))
+    new_lines = _decode_lines(storage.get(relative_path, new))
+    if old_size + new_size > max_bytes:
+        lines = list(fast_unified_diff(old_lines, new_lines, fromfile=fromfile, tofile=tofile))
+    else:
+        lines = list(difflib.unified_diff(old_lines, new_lines, fromfile=fromfile, tofile=tofile, lineterm=''))
+    result = make_result(hunks=parse_hunks(lines), text='\n'.join(lines))
+    if stat_only:
+        result.update(hunks=[], text='')
+    return result
+
+
+def binary_summary(old: str, new: str, old_size: int, new_size: int,
+                   old_id: Optional[str] = None, new_id: Optional[str] = None) -> str:
+    def _side(marker, version, size, blob):
+        blob_note = f', blob {blob[:12]}' if blob else ''
+        return f'{marker} {version} ({size} bytes{blob_note})'
+    return '\n'.join(['Binary files differ', _side('---', old, old_size, old_id), _side('+++', new, new_size, new_id)])
+
+
+class DiffCache(TTLCache):
+    """Rendered diffs keyed by (relative path, old blob id, new blob id). They never go stale.
+    Values are (result, sizes): sizes is (old, new) in bytes for binary files, else None."""
+
+    def __init__(self, maxsize: int = 256):
+        super().__init__(maxsize=maxsize, ttl=None)
+
+
+def render_diff(storage, relative_path: str, old: str, new: str, max_bytes: int = DEFAULT_MAX_DIFF_BYTES,
+                cache: Optional[DiffCache] = None) -> Dict:
+    """Return ``storage.diff`` between two versions; for binary files ``text``
+    is a size/blob-id summary. Diffs whose text exceeds max_bytes are not cached."""
+    old_id = storage.blob_id(relative_path, old)
+    new_id = storage.blob_id(relative_path, new)
+    # the rendered text names the file, so equal blobs in another file or vault need their own entry
+    key = (relative_path, old_id, new_id) if old_id and new_id else None
+    if key is not None and old_id == new_id:
+        return make_result()
+    cached = cache.get(key) if cache is not None and key is not None else None
+    if cached is not None:
+        result, sizes = cached
+    else:
+        result = storage.diff(relative_path, old, new)
+        sizes = None
+        if result['binary']:
+            sizes = (storage.size(relative_path, old), storage.size(relative_path, new))
+        if cache is not None and key is not None and len(result['text']) <= max_bytes:
+            cache.set(key, (result, sizes))
+    if sizes is not None:
+        # names the commits asked for, which may differ from those the entry was cached for
+        return dict(result, text=binary_summary(old, new, sizes[0], sizes[1], old_id, new_id))
+    return result
@@ -0,0 +1,97 @@
+"""Helpers for sending files held by a StorageAdapter to HTTP clients."""
+import mimetypes
+import re
+from typing import BinaryIO, Iterator, Optional, Tuple
+
+from flask import Response, request
+from werkzeug.datastructures import ContentRange
+
+# Versions pinned to a full commit id never change, so clients may cache them for good.
+_PINNED_RE = re.compile(r'[0-9a-f]{40}|[0-9a-f]{64}')
+IMMUTABLE = 'private, max-age=31536000, immutable'
+REVALIDATE = 'private, no-cache'
+
+
+def is_pinned(version: Optional[str]) -> bool:
+    return bool(version) and _PINNED_RE.fullmatch(version) is not None
+
+
+def _iter_slice(reader: BinaryIO, length: int, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    try:
+        while length > 0:
+            chunk = reader.read(min(chunk_size, length))
+            if not chunk:
+                return
+            length -= len(chunk)
+            yield chunk
+    finally:
+        reader.close()
+
+
+def _requested_range(etag: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """(start, stop) of the single byte range to send, None to send the whole file,
+    or (0, 0) if the range cannot be satisfied."""
+    rng = request.range
+    if rng is None or rng.units != 'bytes' or len(rng.ranges) != 1:
+        # multipart/byteranges is not supported; the whole file is a valid answer
+        return None
+    if 'If-Range' in request.headers:
+        # only a strong ETag can be compared; without one (or for a date) send everything
+        if_range = request.if_range
+        if etag is None or if_range.etag != etag:
+            return None
+    found = rng.range_for_length(size)
+    return found if found is not None else (0, 0)
+
+
+def send_storage_file(storage, relative_path: str, version: Optional[str] = None, download_name: Optional[str] = None,
+                      as_attachment: bool = False, mimetype: Optional[str] = None) -> Response:
+    """Stream a stored file (optionally a historical version) with Content-Length set.
+
+    The body is produced chunk by chunk from ``storage.get_stream`` so large
+    scans are never held in worker memory. The blob id (``storage.blob_id``)
+    is sent as a strong ETag and a matching ``If-None-Match`` is answered
+    with 304 before the file is opened. Versions pinned to a full commit id
+    are marked immutable; anything else must be revalidated.
+
+    A single ``Range`` (honouring ``If-Range`` against the ETag) is answered
+    with 206 and only that slice, read through ``storage.open_reader``.
+    Multiple ranges get the whole file. Raises FileNotFoundError if the file
+    or version does not exist.
+    """
+    download_name = download_name or relative_path.replace('\\', '/').rsplit('/', 1)[-1]
+    etag = storage.blob_id(relative_path, version)
+    cache_control = IMMUTABLE if is_pinned(version) else REVALIDATE
+    if etag is not None and request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = cache_control
+        return response
+    size = storage.size(relative_path, version)
+    if mimetype is None:
+        mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    byte_range = _requested_range(etag, size)
+    if byte_range == (0, 0):
+        response = Response(status=416)
+        response.headers['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range is None:
+        response = Response(storage.get_stream(relative_path, version), mimetype=mimetype)
+        response.content_length = size
+    else:
+        start, stop = byte_range
+        reader = storage.open_reader(relative_path, version)
+        try:
+            reader.seek(start)
+        except BaseException:
+            reader.close()
+            raise
+        response = Response(_iter_slice(reader, stop - start), status=206, mimetype=mimetype)
+        response.content_length = stop - start
+        response.content_range = ContentRange('bytes', start, stop, size)
+    response.headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline', filename=download_name)
+    response.headers['Accept-Ranges'] = 'bytes'
+    if etag is not None:
+        response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
@@ -0,0 +1,206 @@
+"""Streaming export of patient vaults as zip or tar archives.
+
+``stream_archive`` produces an archive as a sequence of byte chunks while
+it reads the files out of storage. Nothing is staged on disk or collected
+in memory beyond one chunk, so ``/export/<patient_id>`` can send a vault of
+any size as it is read. Files are read at the patient's HEAD when the
+export starts, so commits made while it runs do not tear the archive.
+
+Archive layout, for each exported patient:
+
+- ``<patient_id>/files/<path>``: the current files
+- ``<patient_id>/history/<commit>/<path>``: every stored version (optional)
+- ``<patient_id>/entries.jsonl``: the patient's database entries (optional)
+
+``export_all`` writes one archive per patient with a process pool, for
+full-system backups (``python scripts/export_vault.py --all``).
+"""
+import json
+import os
+import tarfile
+import time
+import zipfile
+import zlib
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+FORMATS = {'zip': 'application/zip', 'tar': 'application/x-tar', 'tar.gz': 'application/gzip'}
+# already compressed; deflating them again costs CPU for nothing
+STORED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.zip', '.gz', '.bz2', '.xz', '.7z',
+                     '.mp3', '.mp4', '.mov', '.pdf', '.docx', '.xlsx', '.pptx')
+CHUNK_SIZE = 64 * 1024
+_TAR_BLOCK = 512
+_TAR_RECORD = 20 * _TAR_BLOCK
+
+# chunks() opens the member's content only when the archive reaches it
+Member = namedtuple('Member', 'name size mtime chunks')
+
+
+def _timestamp(value: str) -> float:
+    return datetime.fromisoformat(value).timestamp()
+
+
+def entry_records(entries: Iterable) -> List[Dict]:
+    """Database entries as JSON-ready dicts, with a backend-neutral 'id'."""
+    from .db import entry_id_of
+    return [dict({k: v for k, v in dict(e).items() if k != '_id'}, id=entry_id_of(e)) for e in entries]
+
+
+def patient_members(storage, patient_id: str, history: bool = False,
+                    entries: Optional[List[Dict]] = None) -> Iterator[Member]:
+    """Archive members for one patient; ``entries`` (see entry_records) adds entries.jsonl."""
+    now = time.time()
+    head = storage.head(os.path.join(patient_id, ''))
+
+    def member(name: str, rel: str, version: str, mtime: float) -> Member:
+        return Member(name, storage.size(rel, version), mtime,
+                      lambda: storage.get_stream(rel, version, chunk_size=CHUNK_SIZE))
+
+    def archive_path(rel: str) -> str:
+        return '/'.join(rel.split(os.sep)[1:])
+
+    if head is not None:
+        for rel in storage.list_files(patient_id, head):
+            yield member(f'{patient_id}/files/{archive_path(rel)}', rel, head, now)
+        if history:
+            for version in storage.file_versions(patient_id, head):
+                yield member(f"{patient_id}/history/{version['hexsha']}/{archive_path(version['path'])}",
+                             version['path'], version['hexsha'], _timestamp(version['datetime']))
+    if entries is not None:
+        data = b''.join(json.dumps(e, default=str, sort_keys=True).encode('utf-8') + b'\n' for e in entries)
+        yield Member(f'{patient_id}/entries.jsonl', len(data), now, lambda: iter([data]))
+
+
+def stream_archive(members: Iterable[Member], fmt: str = 'zip') -> Iterator[bytes]:
+    """Yield the bytes of a ``fmt`` archive (see FORMATS) of ``members``."""
+    if fmt == 'zip':
+        return _zip_stream(members)
+    if fmt == 'tar':
+        return _tar_stream(members)
+    if fmt == 'tar.gz':
+        return _gzip(_tar_stream(members))
+    raise ValueError(f"unknown archive format {fmt!r}")
+
+
+def _checked(member: Member) -> Iterator[bytes]:
+    # header sizes were written up front, so a short or long read would corrupt the archive
+    written = 0
+    for chunk in member.chunks():
+        written += len(chunk)
+        yield chunk
+    if written != member.size:
+        raise IOError(f"{member.name} changed size while being exported")
+
+
+class _Sink:
+    """Write-only target for ZipFile. It has no tell(), so zipfile writes
+    sizes in data descriptors instead of seeking back to the headers."""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data, self._parts = b''.join(self._parts), []
+        return data
+
+
+def _zip_stream(members: Iterable[Member]) -> Iterator[bytes]:
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w') as zf:
+        for member in members:
+            info = zipfile.ZipInfo(member.name, date_time=time.localtime(max(member.mtime, 315532800))[:6])
+            info.compress_type = zipfile.ZIP_STORED if member.name.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+            # a known size lets zipfile pick zip64 only for members that need it
+            info.file_size = member.size
+            with zf.open(info, 'w') as dest:
+                for chunk in _checked(member):
+                    dest.write(chunk)
+                    data = sink.drain()
+                    if data:
+                        yield data
+            yield sink.drain()
+    yield sink.drain()
+
+
+def _tar_stream(members: Iterable[Member]) -> Iterator[bytes]:
+    offset = 0
+    for member in members:
+        info = tarfile.TarInfo(member.name)
+        info.size = member.size
+        info.mtime = int(member.mtime)
+        info.mode = 0o644
+        # PAX headers carry long and non-ASCII names
+        header = info.tobuf(format=tarfile.PAX_FORMAT)
+        yield header
+        yield from _checked(member)
+        padding = -member.size % _TAR_BLOCK
+        if padding:
+            yield b'\0' * padding
+        offset += len(header) + member.size + padding
+    # two empty blocks end the archive; tar pads it to a whole record
+    offset += 2 * _TAR_BLOCK
+    yield b'\0' * (2 * _TAR_BLOCK + (-offset % _TAR_RECORD))
+
+
+def _gzip(chunks: Iterator[bytes], level: int = 6) -> Iterator[bytes]:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_patient(root: str, adapter_options: Dict, patient_id: str, target: str, fmt: str = 'zip',
+                   history: bool = False, entries: Optional[List[Dict]] = None) -> str:
+    """Write one patient's archive to ``target`` (via a temporary file, so a
+    failed export never leaves a truncated archive); runs in a worker process."""
+    from .storage.git_adapter import GitAdapter
+    adapter = GitAdapter(root, **adapter_options)
+    tmp = target + '.tmp'
+    try:
+        with open(tmp, 'wb') as f:
+            for chunk in stream_archive(patient_members(adapter, patient_id, history, entries), fmt):
+                f.write(chunk)
+        os.replace(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    finally:
+        adapter.close()
+    return target
+
+
+def export_all(root: str, out_dir: str, patients: List[str], fmt: str = 'zip', history: bool = False,
+               entries: Optional[Dict[str, List[Dict]]] = None, workers: int = 4,
+               adapter_options: Optional[Dict] = None, log: Callable[[str], None] = print) -> List[str]:
+    """Export each patient to ``<out_dir>/<patient_id>.<fmt>`` in parallel and
+    return the archive paths. ``entries`` maps patient ids to entry_records()."""
+    adapter_options = adapter_options or {}
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(patient_id, os.path.join(out_dir, f'{patient_id}.{fmt}'),
+             entries.get(patient_id, []) if entries is not None else None) for patient_id in patients]
+    written = []
+    if workers <= 1:
+        for patient_id, target, patient_entries in jobs:
+            written.append(export_patient(root, adapter_options, patient_id, target, fmt, history, patient_entries))
+            log(f"{patient_id}: {target}")
+        return written
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(export_patient, root, adapter_options, patient_id, target, fmt, history,
+                               patient_entries): patient_id
+                   for patient_id, target, patient_entries in jobs}
+        for future in as_completed(futures):
+            written.append(future.result())
+            log(f"{futures[future]}: {written[-1]}")
+    return sorted(written)
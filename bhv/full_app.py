@@ -1,19 +1,34 @@
+import mimetypes
 import os
 import re
-from flask import Flask, render_template, request, redirect, url_for, session, send_from_directory, flash, Response
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, abort, g, jsonify, send_file
 from flask_wtf.csrf import CSRFProtect
 from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 from google.oauth2 import id_token
 from google.auth.transport import requests as google_requests
 
-from .db import init_db, create_user, get_user_by_email, create_entry, list_entries_for_patient, list_all_entries, get_entry, delete_entry, update_entry
+from .db import init_db, create_user, get_user_by_email, create_entry, list_entries_for_patient, list_all_entries, get_entry, delete_entry, update_entry, list_entries, count_entries, search_entries
 from .storage.git_adapter import GitAdapter
-import difflib
+from .storage.errors import UploadTooLarge
+from .downloads import send_storage_file
+from .assets import AssetManifest
+from .derivatives import DerivativeStore, is_image
+from .diffing import DiffCache, render_diff
+from .jobs import JobQueue
+from .export import FORMATS as EXPORT_FORMATS, entry_records, patient_members, stream_archive
 
 UPLOAD_FOLDER = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Entry listings (/admin, /my, /profile) are paginated with ?limit=&cursor=
+PAGE_SIZE = 24
+MAX_PAGE_SIZE = 200
+# Keyword searches in /ask_me return at most this many ranked entries
+SEARCH_TOP_K = 20
+# Room for multipart headers and the other form fields on top of BHV_MAX_UPLOAD_SIZE
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
 
 def is_valid_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
@@ -83,7 +98,90 @@ def create_app(testing: bool = False, upload_folder: str = None):
     init_db()
 
     # storage adapter (use GitAdapter under uploads)
-    storage = GitAdapter(app.config['UPLOAD_FOLDER'])
+    app.config['REPO_CACHE_SIZE'] = int(os.environ.get('BHV_REPO_CACHE_SIZE', 128))
+    app.config['REPO_IDLE_TIMEOUT'] = float(os.environ.get('BHV_REPO_IDLE_TIMEOUT', 300))
+    # Seconds during which concurrent uploads to one patient share a commit (0 = off)
+    app.config['GROUP_COMMIT_WINDOW'] = float(os.environ.get('BHV_GROUP_COMMIT_WINDOW', 0))
+    # Largest accepted file in bytes, enforced while the upload is copied to disk
+    max_upload = os.environ.get('BHV_MAX_UPLOAD_SIZE')
+    app.config['MAX_UPLOAD_SIZE'] = int(max_upload) if max_upload else None
+    if app.config['MAX_UPLOAD_SIZE'] is not None:
+        # werkzeug answers 413 as soon as a larger body is announced or exceeded,
+        # before the upload is spooled to a temp file
+        app.config['MAX_CONTENT_LENGTH'] = app.config['MAX_UPLOAD_SIZE'] + UPLOAD_FORM_OVERHEAD
+    # Long-running `git cat-file --batch` workers for history reads, across all patients
+    app.config['CATFILE_WORKERS'] = int(os.environ.get('BHV_CATFILE_WORKERS', 16))
+    app.config['CATFILE_IDLE_TIMEOUT'] = float(os.environ.get('BHV_CATFILE_IDLE_TIMEOUT', 60))
+    # Store each distinct file once in uploads/.objects and commit pointers to it
+    app.config['DEDUP_BLOBS'] = os.environ.get('BHV_DEDUP_BLOBS', '0') == '1'
+    # Hash-prefix fan-out directories for patient repos (0 = flat uploads/<patient_id>)
+    app.config['SHARD_LEVELS'] = int(os.environ.get('BHV_SHARD_LEVELS', 0))
+    app.config['SHARD_WIDTH'] = int(os.environ.get('BHV_SHARD_WIDTH', 2))
+    # flock-based patient locks so several worker processes can share UPLOAD_FOLDER
+    app.config['PROCESS_LOCKS'] = os.environ.get('BHV_PROCESS_LOCKS', '1') == '1'
+    storage = GitAdapter(app.config['UPLOAD_FOLDER'],
+                         repo_cache_size=app.config['REPO_CACHE_SIZE'],
+                         repo_idle_timeout=app.config['REPO_IDLE_TIMEOUT'],
+                         group_commit_window=app.config['GROUP_COMMIT_WINDOW'],
+                         max_file_size=app.config['MAX_UPLOAD_SIZE'],
+                         catfile_workers=app.config['CATFILE_WORKERS'],
+                         catfile_idle_timeout=app.config['CATFILE_IDLE_TIMEOUT'],
+                         dedup=app.config['DEDUP_BLOBS'],
+                         shard_levels=app.config['SHARD_LEVELS'],
+                         shard_width=app.config['SHARD_WIDTH'],
+                         process_locks=app.config['PROCESS_LOCKS'])
+    app.extensions['bhv_storage'] = storage
+
+    # Background git repack/commit-graph/prune of repos with many new commits (off by default)
+    app.config['REPO_MAINTENANCE'] = os.environ.get('BHV_MAINTENANCE', '0') == '1'
+    if app.config['REPO_MAINTENANCE'] and not testing:
+        storage.enable_maintenance(
+            write_threshold=int(os.environ.get('BHV_MAINTENANCE_WRITES', 200)),
+            min_interval=float(os.environ.get('BHV_MAINTENANCE_INTERVAL', 3600)),
+            pause=float(os.environ.get('BHV_MAINTENANCE_PAUSE', 5)),
+        )
+
+    # /diff results are cached by blob ids; diffs with more than MAX_DIFF_BYTES of text are not cached
+    app.config['DIFF_CACHE_SIZE'] = int(os.environ.get('BHV_DIFF_CACHE_SIZE', 256))
+    app.config['MAX_DIFF_BYTES'] = int(os.environ.get('BHV_MAX_DIFF_BYTES', 2 * 1024 * 1024))
+    diff_cache = DiffCache(maxsize=app.config['DIFF_CACHE_SIZE'])
+
+    # Image thumbnails/previews cached by blob id; rendered by a worker pool after uploads
+    app.config['DERIVATIVE_DIR'] = os.environ.get('BHV_DERIVATIVE_DIR') or os.path.join(chosen_upload, '.derivatives')
+    app.config['DERIVATIVE_WORKERS'] = int(os.environ.get('BHV_DERIVATIVE_WORKERS', 0 if testing else 2))
+    derivatives = DerivativeStore(app.config['DERIVATIVE_DIR'], workers=app.config['DERIVATIVE_WORKERS'])
+    app.extensions['bhv_derivatives'] = derivatives
+
+    # Opt-in async uploads: /upload stages the file and returns a job id at once,
+    # and a worker pool does the git commit and the DB insert (with retries)
+    app.config['ASYNC_UPLOADS'] = os.environ.get('BHV_ASYNC_UPLOADS', '0') == '1'
+    app.config['JOB_DIR'] = os.environ.get('BHV_JOB_DIR') or os.path.join(chosen_upload, '.jobs')
+    app.config['UPLOAD_WORKERS'] = int(os.environ.get('BHV_UPLOAD_WORKERS', 2))
+    app.config['JOB_MAX_ATTEMPTS'] = int(os.environ.get('BHV_JOB_MAX_ATTEMPTS', 5))
+    app.config['JOB_RETRY_DELAY'] = float(os.environ.get('BHV_JOB_RETRY_DELAY', 2))
+
+    def _process_upload(payload, data_path, progress):
+        # each finished step is recorded in progress so a retry does not repeat it
+        if 'commit' not in progress:
+            with open(data_path, 'rb') as f:
+                progress['commit'] = storage.save(os.path.join(payload['patient_id'], payload['filename']), f,
+                                                  user_id=payload['user_id'], action='upload')
+        if 'entry_id' not in progress:
+            progress['entry_id'] = create_entry(payload['patient_id'], payload['filename'], payload['narrative'])
+            derivatives.submit(storage, os.path.join(payload['patient_id'], payload['filename']))
+        return {'commit': progress['commit'], 'entry_id': progress['entry_id']}
+
+    jobs = None
+    if app.config['ASYNC_UPLOADS']:
+        jobs = JobQueue(app.config['JOB_DIR'], _process_upload, workers=app.config['UPLOAD_WORKERS'],
+                        max_attempts=app.config['JOB_MAX_ATTEMPTS'], retry_delay=app.config['JOB_RETRY_DELAY'])
+        app.extensions['bhv_jobs'] = jobs
+        if not testing:
+            jobs.start()
+
+    # Fingerprinted assets built by `python scripts/write_css.py --build`; plain /static URLs until then
+    app.config['ASSET_DIR'] = os.environ.get('BHV_ASSET_DIR') or os.path.join(app.static_folder, 'dist')
+    assets = AssetManifest(app.config['ASSET_DIR'], auto_reload=app.debug)
 
     # Inject current year into all templates for footer
     from datetime import datetime as _dt, timezone as _tz
@@ -91,12 +189,63 @@ def create_app(testing: bool = False, upload_folder: str = None):
     def inject_year():
         return {'current_year': _dt.now(_tz.utc).year}
 
+    @app.context_processor
+    def inject_assets():
+        def asset_url(path, width=None):
+            name = assets.lookup(path, width)
+            if name is None:
+                return url_for('static', filename=path)
+            return url_for('asset', filename=name)
+
+        def asset_srcset(path):
+            return ', '.join(f"{url_for('asset', filename=name)} {w}w" for w, name in assets.srcset(path))
+        return {'asset_url': asset_url, 'asset_srcset': asset_srcset}
+
+    @app.context_processor
+    def inject_thumb_url():
+        def thumb_url(patient_id, filename, kind='thumb'):
+            # the blob id in the URL makes the rendition cacheable forever; the
+            # current file's id comes from the git index, without a git process
+            if not derivatives.enabled or not patient_id or not is_image(filename):
+                return None
+            try:
+                blob = storage.blob_id(os.path.join(patient_id, filename))
+            except FileNotFoundError:
+                return None
+            return url_for('derivative', kind=kind, patient_id=patient_id, filename=filename, v=blob)
+        return {'thumb_url': thumb_url}
+
 
     def current_user():
+        # resolved once per request; get_user_by_email is itself cached per process
         uid = session.get('user_email')
         if not uid:
             return None
-        return get_user_by_email(uid)
+        cached = g.get('bhv_user')
+        if cached is None or cached.get('email') != uid:
+            cached = g.bhv_user = get_user_by_email(uid)
+        return cached
+
+
+    @app.route('/assets/<path:filename>')
+    def asset(filename):
+        """Serve a built asset, preferring a precompressed variant the client accepts.
+        Names carry a content hash, so responses may be cached forever."""
+        path = safe_join(app.config['ASSET_DIR'], filename)
+        if path is None or filename.endswith(('.gz', '.br')) or not os.path.isfile(path):
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        encoding = None
+        for name, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[name] and os.path.isfile(path + suffix):
+                path, encoding = path + suffix, name
+                break
+        response = send_file(path, mimetype=mimetype, max_age=31536000, conditional=True)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+        response.vary.add('Accept-Encoding')
+        return response
 
 
     @app.route('/')
@@ -139,8 +288,8 @@ def create_app(testing: bool = False, upload_folder: str = None):
         user = current_user()
         if not user:
             return redirect(url_for('login'))
-        entries = _normalize_entries(list_entries_for_patient(user.get('email')))
-        return render_template('profile.html', user=user, entries=entries)
+        page = _entries_page(user.get('email'))
+        return render_template('profile.html', user=user, total=count_entries(user.get('email')), **page)
 
 
     @app.route('/ask_me', methods=['GET', 'POST'])
@@ -157,25 +306,27 @@ def create_app(testing: bool = False, upload_folder: str = None):
         if request.method == 'POST':
             question = request.form.get('question', '').strip()
             if question:
-                # Get user's entries
+                # Scope: patients see their own vault, admins the whole system
                 patient_id = user.get('email') if user.get('role') == 'patient' else None
-                if patient_id:
-                    entries = list_entries_for_patient(patient_id)
-                elif user.get('role') == 'admin':
-                    entries = list_all_entries()
-                else:
-                    entries = []
-                
+                allowed = bool(patient_id) or user.get('role') == 'admin'
+                total = count_entries(patient_id) if allowed else 0
+
                 # Simple keyword-based search and response
                 q_lower = question.lower()
                 
                 # Count queries
                 if any(word in q_lower for word in ['how many', 'count', 'total']):
-                    answer = f"You have {len(entries)} entries in your vault."
-                    results = entries[:5]  # Show first 5
+                    answer = f"You have {total} entries in your vault."
+                    results = _oldest_entries(patient_id, 5) if allowed else []  # Show first 5
                 
                 # List all queries
                 elif any(word in q_lower for word in ['show all', 'list all', 'all entries', 'all uploaded']):
+                    if patient_id:
+                        entries = list_entries_for_patient(patient_id)
+                    elif allowed:
+                        entries = list_all_entries()
+                    else:
+                        entries = []
                     answer = f"Here are all {len(entries)} entries from your vault:"
                     results = entries
                 
@@ -190,15 +341,13 @@ def create_app(testing: bool = False, upload_folder: str = None):
                             keywords.extend([w.strip('\"\\\',.;:!?') for w in remaining.split() if len(w) > 3])
                     
                     if keywords:
-                        matching = []
-                        for e in entries:
-                            narrative = (e.get('narrative') or '').lower()
-                            filename = (e.get('filename') or '').lower()
-                            if any(kw.lower() in narrative or kw.lower() in filename for kw in keywords):
-                                matching.append(e)
+                        # ranked lookup in the inverted index instead of scanning every entry
+                        matching = search_entries(' '.join(keywords), patient_id=patient_id, k=SEARCH_TOP_K) if allowed else []
                         
                         if matching:
                             answer = f"Found {len(matching)} entries matching your query."
+                            if len(matching) == SEARCH_TOP_K:
+                                answer = f"Showing the {SEARCH_TOP_K} best matches for your query."
                             results = matching
                         else:
                             answer = f"No entries found matching '{', '.join(keywords)}'."
@@ -207,22 +356,23 @@ def create_app(testing: bool = False, upload_folder: str = None):
                 
                 # Summary
                 elif 'summar' in q_lower or 'overview' in q_lower:
-                    answer = f"Recovery Journey Summary:\\n\\nTotal Entries: {len(entries)}\\n"
-                    if entries:
-                        recent = entries[-5:] if len(entries) >= 5 else entries
+                    answer = f"Recovery Journey Summary:\\n\\nTotal Entries: {total}\\n"
+                    latest = list(reversed(list_entries(patient_id, limit=10)[0])) if allowed else []
+                    if latest:
+                        recent = latest[-5:]
                         answer += f"\\nMost Recent Uploads:\\n"
                         for e in reversed(recent):
                             answer += f"• {e.get('filename')} - {e.get('narrative', 'No description')[:50]}...\\n"
-                    results = entries[-10:]  # Show last 10
+                    results = latest  # Show last 10
                 
                 # Default response
                 else:
-                    answer = f"I found {len(entries)} entries in your vault. Try asking:\\n"
+                    answer = f"I found {total} entries in your vault. Try asking:\\n"
                     answer += "• 'Show me all my entries'\\n"
                     answer += "• 'Find entries mentioning [keyword]'\\n"
                     answer += "• 'How many entries do I have?'\\n"
                     answer += "• 'Summarize my recovery journey'"
-                    results = entries[:5]
+                    results = _oldest_entries(patient_id, 5) if allowed else []
                 
                 # Normalize results for template
                 normalized_results = []
@@ -306,6 +456,30 @@ def create_app(testing: bool = False, upload_folder: str = None):
 
 
 
+    def _oldest_entries(patient_id, n):
+        return list_entries(patient_id, limit=n, sort='timestamp asc')[0]
+
+
+    def _entries_page(patient_id):
+        """Fetch one page of entries for the listing views from the request's
+        ?limit=, ?cursor= (or ?offset=) and ?sort= arguments. Returns the
+        template context: entries, next_cursor, cursor and page_args."""
+        limit = max(1, min(request.args.get('limit', PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+        cursor = request.args.get('cursor') or None
+        sort = request.args.get('sort', 'timestamp desc')
+        try:
+            raw, next_cursor = list_entries(patient_id, limit=limit, cursor=cursor,
+                                            offset=request.args.get('offset', type=int), sort=sort)
+        except ValueError:
+            abort(400)
+        page_args = {'limit': limit}
+        if sort != 'timestamp desc':
+            page_args['sort'] = sort
+        if request.args.get('patient_id'):
+            page_args['patient_id'] = request.args.get('patient_id')
+        return {'entries': _normalize_entries(raw), 'next_cursor': next_cursor, 'cursor': cursor, 'page_args': page_args}
+
+
     def _normalize_entries(raw_entries):
         """Normalize DB results (TinyDB dicts or Mongo docs) into objects
         with consistent attributes: .id, .filename, .narrative, .timestamp, .patient_id"""
@@ -355,26 +529,59 @@ def create_app(testing: bool = False, upload_folder: str = None):
                 return redirect(url_for('upload'))
             filename = secure_filename(f.filename)
             patient_id = user.get('email') if user.get('role')=='patient' else request.form.get('patient_id')
+            if jobs is not None:
+                try:
+                    job_id = jobs.submit({'patient_id': patient_id, 'filename': filename, 'narrative': narrative,
+                                          'user_id': user.get('email')},
+                                         f.stream, max_size=app.config['MAX_UPLOAD_SIZE'])
+                except UploadTooLarge as e:
+                    flash(f'File too large: {e}')
+                    return redirect(url_for('upload'))
+                status_url = url_for('job_status', job_id=job_id)
+                if request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json':
+                    return jsonify({'job_id': job_id, 'status_url': status_url}), 202, {'Location': status_url}
+                flash('Upload received; it will appear in your entries shortly')
+                return redirect(url_for('my_entries'))
             rel_path = os.path.join(patient_id, filename)
-            data = f.read()
-            # use storage adapter to save (creates commit)
-            storage.save(rel_path, data, user_id=user.get('email'), action='upload')
+            # use storage adapter to save (creates commit); the upload is
+            # copied in chunks rather than read into memory
+            try:
+                storage.save(rel_path, f.stream, user_id=user.get('email'), action='upload')
+            except UploadTooLarge as e:
+                flash(f'File too large: {e}')
+                return redirect(url_for('upload'))
             # record in DB
             create_entry(patient_id, filename, narrative)
+            derivatives.submit(storage, rel_path)
             flash('Uploaded')
             return redirect(url_for('my_entries'))
         is_admin = user.get('role') == 'admin'
         return render_template('upload.html', is_admin=is_admin)
 
 
+    @app.route('/jobs/<job_id>')
+    def job_status(job_id):
+        user = current_user()
+        if not user:
+            return redirect(url_for('login'))
+        job = jobs.status(job_id) if jobs is not None else None
+        # other users' jobs are reported as missing, like other users' files
+        if job is None or (user.get('role') != 'admin' and job['payload'].get('user_id') != user.get('email')):
+            abort(404)
+        return jsonify({'job_id': job['id'], 'status': job['status'], 'attempts': job['attempts'],
+                        'error': job['error'], 'result': job['result']})
+
+
     @app.route('/my')
     def my_entries():
         user = current_user()
         if not user:
             return redirect(url_for('login'))
         patient_id = user.get('email') if user.get('role')=='patient' else request.args.get('patient_id')
-        entries = _normalize_entries(list_entries_for_patient(patient_id))
-        return render_template('patient.html', entries=entries, patient_id=patient_id)
+        if not patient_id:
+            # admins must pick a patient; never fall through to the whole system
+            return render_template('patient.html', entries=[], patient_id=patient_id, next_cursor=None, cursor=None, page_args={})
+        return render_template('patient.html', patient_id=patient_id, **_entries_page(patient_id))
 
 
     @app.route('/admin')
@@ -382,13 +589,19 @@ def create_app(testing: bool = False, upload_folder: str = None):
         user = current_user()
         if not user or user.get('role')!='admin':
             return redirect(url_for('login'))
-        entries = _normalize_entries(list_all_entries())
-        return render_template('admin.html', entries=entries)
+        return render_template('admin.html', total=count_entries(), **_entries_page(None))
 
 
     @app.route('/uploads/<path:filename>')
     def uploads(filename):
-        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+        # served through storage so deduplicated files resolve to their content
+        parts = [p for p in filename.split('/') if p]
+        if len(parts) < 2 or safe_join(app.config['UPLOAD_FOLDER'], *parts) is None or any(p.startswith('.') for p in parts):
+            abort(404)
+        try:
+            return send_storage_file(storage, os.path.join(*parts), download_name=parts[-1])
+        except (FileNotFoundError, IsADirectoryError):
+            abort(404)
 
 
     @app.route('/entry/<entry_id>/delete', methods=['POST'])
@@ -433,9 +646,13 @@ def create_app(testing: bool = False, upload_folder: str = None):
             if f and f.filename:
                 new_filename = secure_filename(f.filename)
                 rel_path = os.path.join(entry.patient_id, new_filename)
-                data = f.read()
-                storage.save(rel_path, data, user_id=user.get('email'), action='edit')
+                try:
+                    storage.save(rel_path, f.stream, user_id=user.get('email'), action='edit')
+                except UploadTooLarge as e:
+                    flash(f'File too large: {e}')
+                    return redirect(url_for('entry_edit', entry_id=entry_id))
                 update_fields['filename'] = new_filename
+                derivatives.submit(storage, rel_path)
 
             update_entry(entry_id, **update_fields)
             flash('Entry updated')
@@ -467,19 +684,29 @@ def create_app(testing: bool = False, upload_folder: str = None):
             flash('Forbidden')
             return redirect(url_for('index'))
         rel = os.path.join(patient_id, filename)
-        old_bytes = storage.get(rel, old_sha)
-        new_bytes = storage.get(rel, new_sha)
-        try:
-            old_text = old_bytes.decode('utf-8').splitlines()
-        except Exception:
-            old_text = old_bytes.decode('latin-1', errors='ignore').splitlines()
         try:
-            new_text = new_bytes.decode('utf-8').splitlines()
-        except Exception:
-            new_text = new_bytes.decode('latin-1', errors='ignore').splitlines()
-        ud = difflib.unified_diff(old_text, new_text, fromfile=old_sha, tofile=new_sha, lineterm='')
-        diff_text = '\n'.join(list(ud))
-        return render_template('diff.html', diff=diff_text, patient_id=patient_id, filename=filename, old=old_sha, new=new_sha)
+            result = render_diff(storage, rel, old_sha, new_sha, max_bytes=app.config['MAX_DIFF_BYTES'], cache=diff_cache)
+        except FileNotFoundError:
+            abort(404)
+        return render_template('diff.html', diff=result['text'], stats=result['stats'], binary=result['binary'], patient_id=patient_id, filename=filename, old=old_sha, new=new_sha)
+
+
+    @app.route('/derivative/<kind>/<patient_id>/<filename>')
+    def derivative(kind, patient_id, filename):
+        """A thumbnail or preview of an image. ?v= is the source blob id (from
+        thumb_url); ?version= picks a historical commit instead of the current file."""
+        user = current_user()
+        if not user:
+            return redirect(url_for('login'))
+        if user.get('role') != 'admin' and user.get('email') != patient_id:
+            abort(404)
+        path = derivatives.path(storage, kind, os.path.join(patient_id, filename), request.args.get('v', ''),
+                                request.args.get('version') or None)
+        if path is None:
+            abort(404)
+        response = send_file(path, mimetype='image/jpeg', max_age=31536000, conditional=True)
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
 
 
     @app.route('/file/<patient_id>/<filename>')
@@ -492,8 +719,32 @@ def create_app(testing: bool = False, upload_folder: str = None):
             flash('Forbidden')
             return redirect(url_for('index'))
         rel = os.path.join(patient_id, filename)
-        data = storage.get(rel, version)
-        return Response(data, mimetype='application/octet-stream', headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+        try:
+            return send_storage_file(storage, rel, version, download_name=filename, as_attachment=True,
+                                     mimetype='application/octet-stream')
+        except FileNotFoundError:
+            abort(404)
+
+
+    @app.route('/export/<patient_id>')
+    def export(patient_id):
+        """Download a patient's vault as an archive built while it is sent.
+        ?format=zip|tar|tar.gz, ?history=1 adds every stored version and
+        ?metadata=1 adds the database entries as entries.jsonl."""
+        user = current_user()
+        if not user:
+            return redirect(url_for('login'))
+        if user.get('role') != 'admin' and user.get('email') != patient_id:
+            abort(404)
+        fmt = request.args.get('format', 'zip')
+        if fmt not in EXPORT_FORMATS or patient_id.startswith('.') or '/' in patient_id:
+            abort(400)
+        entries = entry_records(list_entries_for_patient(patient_id)) if request.args.get('metadata') == '1' else None
+        members = patient_members(storage, patient_id, history=request.args.get('history') == '1', entries=entries)
+        response = Response(stream_archive(members, fmt), mimetype=EXPORT_FORMATS[fmt])
+        response.headers['Content-Disposition'] = f'attachment; filename="{secure_filename(patient_id)}-export.{fmt}"'
+        response.headers['Cache-Control'] = 'private, no-store'
+        return response
 
 
     return app
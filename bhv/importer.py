@@ -0,0 +1,239 @@
+"""Bulk import of existing patient archives.
+
+Items come from a manifest (CSV with a header row, or JSONL) with the
+fields ``patient_id``, ``path``, ``narrative`` and ``timestamp`` (ISO 8601,
+optional), or from a directory tree laid out as ``<root>/<patient_id>/...``.
+In a tree, a file's narrative is read from a ``<file>.narrative.txt`` next to
+it, if present.
+
+Each patient's files are committed through ``GitAdapter`` in batches of
+``batch_size`` (one commit per batch), with patients spread over a process
+pool. The entries are then bulk-inserted through ``bhv.db.create_entries``
+by the parent process, so the embedded stores are written from one process.
+Progress goes to a JSONL journal: one line when a batch is committed, and
+one before and one after its entries are inserted. Re-running the same
+import skips finished work, so an interrupted import can simply be started
+again. Entries without a timestamp get their batch's commit time, so a
+batch whose insert was interrupted is re-inserted without the rows that
+already made it into the database.
+
+Files are stored under their base name, as ``/upload`` stores them; two
+items that would land on the same name for one patient are rejected before
+anything is written (give them distinct ``filename`` columns in a manifest).
+"""
+import csv
+import json
+import os
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from werkzeug.utils import secure_filename
+
+NARRATIVE_SUFFIX = '.narrative.txt'
+
+# filename is the name the file is stored under, as /upload would store it
+ImportItem = namedtuple('ImportItem', 'patient_id path filename narrative timestamp')
+
+
+def _item(patient_id: str, path: str, narrative: str = '', timestamp: Optional[str] = None,
+          filename: Optional[str] = None) -> ImportItem:
+    name = secure_filename(filename or os.path.basename(path))
+    if not patient_id or not name:
+        raise ValueError(f"import item needs a patient_id and a file name: {patient_id!r}, {path!r}")
+    return ImportItem(patient_id, path, name, narrative or '', timestamp or None)
+
+
+def read_manifest(manifest_path: str) -> Iterator[ImportItem]:
+    """Items listed in a .csv or .jsonl manifest; relative paths are resolved
+    against the manifest's directory."""
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path, 'r', encoding='utf-8', newline='') as f:
+        if manifest_path.lower().endswith('.csv'):
+            rows = csv.DictReader(f)
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+        for row in rows:
+            path = row.get('path') or row.get('file')
+            if not path:
+                raise ValueError(f"manifest row without a path: {row!r}")
+            yield _item(row.get('patient_id'), os.path.join(base, path), row.get('narrative'),
+                        row.get('timestamp'), row.get('filename'))
+
+
+def scan_tree(root: str) -> Iterator[ImportItem]:
+    """Items for every file under ``<root>/<patient_id>/``, in sorted order."""
+    for patient_id in sorted(os.listdir(root)):
+        patient_dir = os.path.join(root, patient_id)
+        if patient_id.startswith('.') or not os.path.isdir(patient_dir):
+            continue
+        for directory, dirs, files in os.walk(patient_dir):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for name in sorted(files):
+                if name.startswith('.') or name.endswith(NARRATIVE_SUFFIX):
+                    continue
+                path = os.path.join(directory, name)
+                narrative = ''
+                if os.path.exists(path + NARRATIVE_SUFFIX):
+                    with open(path + NARRATIVE_SUFFIX, 'r', encoding='utf-8') as f:
+                        narrative = f.read().strip()
+                yield _item(patient_id, path, narrative)
+
+
+def group_batches(items: Iterable[ImportItem], batch_size: int = 0) -> "OrderedDict[str, List[List[ImportItem]]]":
+    """patient_id -> list of batches (in input order); batch_size 0 means one batch per patient."""
+    patients: "OrderedDict[str, List[ImportItem]]" = OrderedDict()
+    for item in items:
+        patients.setdefault(item.patient_id, []).append(item)
+    result = OrderedDict()
+    for patient_id, patient_items in patients.items():
+        size = batch_size or len(patient_items)
+        result[patient_id] = [patient_items[i:i + size] for i in range(0, len(patient_items), size)]
+    return result
+
+
+class Journal:
+    """Append-only JSONL record of finished work. Lines are short and written
+    with O_APPEND, so worker processes can share one journal."""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def record(self, **fields) -> None:
+        line = (json.dumps(fields, sort_keys=True) + '\n').encode('utf-8')
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def load(self) -> Tuple[Dict[Tuple[str, int], Dict], Set[Tuple[str, int]], Set[Tuple[str, int]]]:
+        """({(patient, batch): git record} committed, {(patient, batch)} whose
+        insert started, {(patient, batch)} inserted)."""
+        committed, started, inserted = {}, set(), set()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        rec = json.loads(line)
+                    except ValueError:
+                        continue  # torn last line after a crash
+                    key = (rec['patient_id'], rec['batch'])
+                    if rec['stage'] == 'git':
+                        committed[key] = rec
+                    elif rec['stage'] == 'db-start':
+                        started.add(key)
+                    elif rec['stage'] == 'db':
+                        inserted.add(key)
+        except FileNotFoundError:
+            pass
+        return committed, started, inserted
+
+
+def commit_patient(root: str, adapter_options: Dict, journal_path: str, patient_id: str,
+                   batches: List[List[ImportItem]], skip: Set[int]) -> List[Dict]:
+    """Commit a patient's batches (except those in ``skip``); runs in a worker process.
+    Returns the journal records of the batches it committed."""
+    from .storage.git_adapter import GitAdapter
+    adapter = GitAdapter(root, **adapter_options)
+    journal = Journal(journal_path)
+    done = []
+    try:
+        for index, batch in enumerate(batches):
+            if index in skip:
+                continue
+            with adapter.batch(patient_id, message=f"import of {len(batch)} files") as result:
+                for item in batch:
+                    with open(item.path, 'rb') as f:
+                        adapter.save(os.path.join(patient_id, item.filename), f, user_id='import', action='import')
+            record = {'stage': 'git', 'patient_id': patient_id, 'batch': index, 'commit': result['hexsha'],
+                      'time': datetime.utcnow().isoformat(timespec='seconds')}
+            journal.record(**record)
+            done.append(record)
+    finally:
+        adapter.close()
+    return done
+
+
+def _timestamp(value: Optional[str]) -> Optional[datetime]:
+    """Naive UTC, as the database stores timestamps; values without an offset are taken as UTC."""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+def _same_instant(value) -> str:
+    # Mongo keeps datetimes, TinyDB/SQLite ISO strings (and Mongo drops microseconds)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return str(value or '')[:19]
+
+
+def run_import(items: Iterable[ImportItem], root: str, journal_path: str, workers: int = 4, batch_size: int = 0,
+               adapter_options: Optional[Dict] = None, log=print) -> Dict[str, int]:
+    """Import ``items`` into the repos under ``root`` and the configured database.
+    Returns counts of patients, files committed and entries inserted by this run."""
+    from . import db
+
+    adapter_options = adapter_options or {}
+    journal = Journal(journal_path)
+    committed, started, inserted = journal.load()
+    plan = group_batches(items, batch_size)
+    # fail before writing anything
+    for patient_id, batches in plan.items():
+        seen = {}
+        for batch in batches:
+            for item in batch:
+                if not os.path.isfile(item.path):
+                    raise FileNotFoundError(item.path)
+                _timestamp(item.timestamp)
+                if item.filename in seen:
+                    raise ValueError(f"{seen[item.filename]} and {item.path} would both be stored as "
+                                     f"{patient_id}/{item.filename}; give them distinct file names")
+                seen[item.filename] = item.path
+    counts = {'patients': len(plan), 'files': 0, 'entries': 0}
+
+    def insert(patient_id: str, index: int) -> None:
+        key = (patient_id, index)
+        commit_time = datetime.fromisoformat(committed[key]['time'])
+        rows = [(i.patient_id, i.filename, i.narrative, _timestamp(i.timestamp) or commit_time)
+                for i in plan[patient_id][index]]
+        if key in started:
+            # an earlier run died during this insert: skip the rows it wrote
+            existing = {(e.get('filename'), _same_instant(e.get('timestamp')))
+                        for e in db.list_entries_for_patient(patient_id)}
+            rows = [r for r in rows if (r[1], _same_instant(r[3])) not in existing]
+        journal.record(stage='db-start', patient_id=patient_id, batch=index)
+        db.create_entries(rows)
+        journal.record(stage='db', patient_id=patient_id, batch=index)
+        inserted.add(key)
+        counts['entries'] += len(rows)
+
+    def finished(patient_id: str, done: List[Dict]) -> None:
+        for record in done:
+            committed[(patient_id, record['batch'])] = record
+            counts['files'] += len(plan[patient_id][record['batch']])
+        for index in range(len(plan[patient_id])):
+            if (patient_id, index) in committed and (patient_id, index) not in inserted:
+                insert(patient_id, index)
+        log(f"{patient_id}: {sum(len(b) for b in plan[patient_id])} files")
+
+    pending = {pid: {i for i in range(len(batches)) if (pid, i) in committed}
+               for pid, batches in plan.items()}
+    if workers <= 1:
+        for patient_id, batches in plan.items():
+            finished(patient_id, commit_patient(root, adapter_options, journal_path, patient_id,
+                                                batches, pending[patient_id]))
+        return counts
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(commit_patient, root, adapter_options, journal_path, patient_id,
+                               batches, pending[patient_id]): patient_id
+                   for patient_id, batches in plan.items()}
+        for future in as_completed(futures):
+            finished(futures[future], future.result())
+    return counts
@@ -0,0 +1,266 @@
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from .storage.base import Source, iter_chunks
+from .storage.errors import UploadTooLarge
+
+# time-ordered, so pending jobs sort oldest first; also safe to use as a file name
+_JOB_ID_RE = re.compile(r'[0-9]{19,20}-[0-9a-f]{12}')
+
+# handler(payload, data_path, progress) -> result dict stored with the finished job
+Handler = Callable[[Dict, Optional[str], Dict], Optional[Dict]]
+
+
+class _Progress(dict):
+    """The handler's progress dict; every assignment is saved to the job record
+    at once, so a worker that dies right after a step does not redo it."""
+
+    def __init__(self, data: Dict, save: Callable[[], None]):
+        super().__init__(data)
+        self._save = save
+
+    def __setitem__(self, key, value) -> None:
+        super().__setitem__(key, value)
+        self._save()
+
+
+class JobQueue:
+    """A small persistent job queue kept in a directory, used for async uploads.
+
+    Each job is one JSON file that moves between ``pending/``, ``running/``,
+    ``done/`` and ``dead/``. Its payload bytes (the upload) are staged under
+    ``staging/`` when it is submitted. Workers claim a job by renaming it
+    from pending to running. The rename is atomic, so several threads, or
+    several processes sharing the directory, never run the same job twice.
+
+    A failed job goes back to pending, with its file's mtime set to the
+    earliest time it may run again (``retry_delay`` doubled per attempt).
+    After ``max_attempts`` failures it moves to ``dead/`` and keeps its
+    staged data for inspection. The handler gets a ``progress`` dict that is
+    written to the job record on every assignment and kept across attempts.
+    It records each finished step there, so a retry (even after the worker
+    process died mid-job) does not commit or insert twice. A job left in
+    running/ by a crashed process is requeued once it is older than
+    ``lease_timeout``.
+    """
+
+    STATES = ('pending', 'running', 'done', 'dead')
+    SWEEP_INTERVAL = 60.0
+
+    def __init__(self, root: str, handler: Handler, workers: int = 2, max_attempts: int = 5,
+                 retry_delay: float = 2.0, lease_timeout: float = 600.0, keep_done: float = 86400.0,
+                 poll_interval: float = 1.0):
+        self.root = root
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_timeout = lease_timeout
+        self.keep_done = keep_done
+        self.poll_interval = poll_interval
+        for name in self.STATES + ('staging', 'tmp'):
+            os.makedirs(os.path.join(root, name), exist_ok=True)
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        self._last_sweep = float('-inf')
+
+    # -- submitting and polling ----------------------------------------------
+
+    def submit(self, payload: Dict, data: Optional[Source] = None, max_size: Optional[int] = None) -> str:
+        """Stage ``data`` (bytes, file-like or chunks), queue a job and return its id.
+        Raises UploadTooLarge, staging nothing, if data exceeds ``max_size``."""
+        job_id = '%d-%s' % (time.time_ns(), uuid.uuid4().hex[:12])
+        if data is not None:
+            self._stage(job_id, data, max_size)
+        now = time.time()
+        self._write('pending', {'id': job_id, 'payload': payload, 'attempts': 0, 'error': None,
+                                'progress': {}, 'result': None, 'created': now, 'updated': now})
+        self._wake.set()
+        return job_id
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        """The job's record with its ``status`` (one of STATES), or None if unknown."""
+        if not _JOB_ID_RE.fullmatch(job_id or ''):
+            return None
+        # a job may move on between two reads, so look again in the later states
+        for _ in range(2):
+            for state in self.STATES:
+                job = self._read(state, job_id)
+                if job is not None:
+                    job['status'] = state
+                    return job
+        return None
+
+    def counts(self) -> Dict[str, int]:
+        return {state: len(self._ids(state)) for state in self.STATES}
+
+    def data_path(self, job_id: str) -> str:
+        return os.path.join(self.root, 'staging', job_id)
+
+    # -- running ---------------------------------------------------------------
+
+    def run_next(self) -> bool:
+        """Claim and run one due job; returns False if none was waiting."""
+        now = time.time()
+        for job_id in self._ids('pending'):
+            src = self._path('pending', job_id)
+            try:
+                if os.path.getmtime(src) > now:
+                    continue  # waiting to be retried
+                os.rename(src, self._path('running', job_id))
+            except OSError:
+                continue  # claimed by another worker
+            # mark the lease start for crash recovery
+            os.utime(self._path('running', job_id))
+            self._run(job_id)
+            return True
+        return False
+
+    def run_pending(self) -> int:
+        """Run every due job in this thread; returns how many were run."""
+        done = 0
+        while self.run_next():
+            done += 1
+        return done
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._loop, name=f'bhv-jobs-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def sweep(self) -> None:
+        """Requeue jobs whose worker died and drop done jobs older than ``keep_done``."""
+        now = time.time()
+        for job_id in self._ids('running'):
+            path = self._path('running', job_id)
+            try:
+                if now - os.path.getmtime(path) > self.lease_timeout:
+                    os.rename(path, self._path('pending', job_id))
+            except OSError:
+                pass
+        for job_id in self._ids('done'):
+            path = self._path('done', job_id)
+            try:
+                if now - os.path.getmtime(path) > self.keep_done:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    # -- internals -------------------------------------------------------------
+
+    def _loop(self) -> None:
+        while not self._stop.is_set():
+            if time.monotonic() - self._last_sweep > self.SWEEP_INTERVAL:
+                self._last_sweep = time.monotonic()
+                self.sweep()
+            try:
+                ran = self.run_next()
+            except Exception as e:
+                print('Job queue worker failed:', e)
+                ran = False
+            if not ran:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def _run(self, job_id: str) -> None:
+        job = self._read('running', job_id)
+        if job is None:
+            return
+        data_path = self.data_path(job_id)
+        if not os.path.exists(data_path):
+            data_path = None
+        job['attempts'] += 1
+        job['progress'] = _Progress(job['progress'], lambda: self._checkpoint(job))
+        try:
+            job['result'] = self.handler(job['payload'], data_path, job['progress'])
+        except Exception as e:
+            job['error'] = f'{type(e).__name__}: {e}'
+            job['updated'] = time.time()
+            if job['attempts'] >= self.max_attempts:
+                self._finish(job, 'dead')
+            else:
+                delay = self.retry_delay * 2 ** (job['attempts'] - 1)
+                self._finish(job, 'pending', not_before=time.time() + delay)
+            return
+        job['error'] = None
+        job['updated'] = time.time()
+        self._finish(job, 'done')
+        if data_path is not None:
+            self._remove(data_path)
+
+    def _checkpoint(self, job: Dict) -> None:
+        # also renews the lease (the running file's mtime)
+        job['updated'] = time.time()
+        if os.path.exists(self._path('running', job['id'])):
+            self._write('running', job)
+
+    def _finish(self, job: Dict, state: str, not_before: Optional[float] = None) -> None:
+        # rewrite the running record, then move it: the job is always in exactly one state
+        self._write('running', job, not_before)
+        os.rename(self._path('running', job['id']), self._path(state, job['id']))
+
+    def _stage(self, job_id: str, data: Source, max_size: Optional[int]) -> None:
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'))
+        written = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter_chunks(data):
+                    written += len(chunk)
+                    if max_size is not None and written > max_size:
+                        raise UploadTooLarge(max_size)
+                    f.write(chunk)
+            os.replace(tmp, self.data_path(job_id))
+        except BaseException:
+            self._remove(tmp)
+            raise
+
+    def _path(self, state: str, job_id: str) -> str:
+        return os.path.join(self.root, state, job_id + '.json')
+
+    def _ids(self, state: str) -> List[str]:
+        try:
+            names = os.listdir(os.path.join(self.root, state))
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-5] for name in names if name.endswith('.json'))
+
+    def _read(self, state: str, job_id: str) -> Optional[Dict]:
+        try:
+            with open(self._path(state, job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write(self, state: str, job: Dict, not_before: Optional[float] = None) -> None:
+        # write-then-rename so readers never see a partial record
+        fd, tmp = tempfile.mkstemp(dir=os.path.join(self.root, 'tmp'))
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(job, f, default=str)
+        if not_before is not None:
+            os.utime(tmp, (not_before, not_before))
+        os.replace(tmp, self._path(state, job['id']))
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,170 @@
+"""In-memory inverted index over entry narratives and filenames.
+
+``SearchIndex`` keeps one set of postings per patient plus one for the whole
+system, so a patient-scoped query only touches that patient's postings and
+an admin query only touches the postings of its terms; neither scans the
+entries table. Results are ranked with Okapi BM25 and cut to the top k.
+
+The index lives in process memory. bhv.db builds it lazily from the
+database on first use and keeps it current on create/update/delete; with
+several worker processes (or a bulk import) each one holds its own copy.
+Before each query it compares its document count with the database's and
+rebuilds if they differ, which catches entries added or deleted elsewhere;
+edits made elsewhere are picked up by the periodic rebuild
+(``refresh_interval``).
+"""
+import bisect
+import heapq
+import math
+import re
+import threading
+import time
+from collections import Counter
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+_TOKEN_RE = re.compile(r'[a-z0-9]+')
+# at most this many vocabulary terms are searched for one query prefix
+MAX_PREFIX_EXPANSION = 50
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return _TOKEN_RE.findall((text or '').lower())
+
+
+class _Shard:
+    """Postings and length statistics for one set of documents."""
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.terms: List[str] = []  # sorted vocabulary, for prefix lookups
+        self.doc_len: Dict[str, int] = {}
+        self.total_len = 0
+
+    def add(self, doc_id: str, counts: Counter, length: int) -> None:
+        for term, tf in counts.items():
+            docs = self.postings.get(term)
+            if docs is None:
+                docs = self.postings[term] = {}
+                bisect.insort(self.terms, term)
+            docs[doc_id] = tf
+        self.doc_len[doc_id] = length
+        self.total_len += length
+
+    def remove(self, doc_id: str, counts: Counter) -> None:
+        for term in counts:
+            docs = self.postings.get(term)
+            if docs is None:
+                continue
+            docs.pop(doc_id, None)
+            if not docs:
+                del self.postings[term]
+                i = bisect.bisect_left(self.terms, term)
+                if i < len(self.terms) and self.terms[i] == term:
+                    del self.terms[i]
+        self.total_len -= self.doc_len.pop(doc_id, 0)
+
+    def expand(self, term: str) -> List[str]:
+        """The term itself if indexed, else vocabulary terms it is a prefix of."""
+        if term in self.postings:
+            return [term]
+        start = bisect.bisect_left(self.terms, term)
+        matches = []
+        for candidate in self.terms[start:start + MAX_PREFIX_EXPANSION]:
+            if not candidate.startswith(term):
+                break
+            matches.append(candidate)
+        return matches
+
+
+class SearchIndex:
+    def __init__(self, k1: float = 1.2, b: float = 0.75, refresh_interval: Optional[float] = None):
+        self.k1 = k1
+        self.b = b
+        self.refresh_interval = refresh_interval
+        self._lock = threading.RLock()
+        self._built_at: Optional[float] = None
+        self._clear()
+
+    def _clear(self) -> None:
+        self._all = _Shard()
+        self._patients: Dict[str, _Shard] = {}
+        self._docs: Dict[str, Tuple[Optional[str], Counter]] = {}  # doc_id -> (patient_id, term counts)
+
+    @property
+    def built(self) -> bool:
+        return self._built_at is not None
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def build(self, documents: Iterable[Tuple[str, Optional[str], Optional[str], Optional[str]]]) -> None:
+        """(Re)build from (doc_id, patient_id, narrative, filename) tuples."""
+        with self._lock:
+            self._clear()
+            for doc_id, patient_id, narrative, filename in documents:
+                self._add(str(doc_id), patient_id, narrative, filename)
+            self._built_at = time.monotonic()
+
+    def ensure_built(self, loader: Callable[[], Iterable[Tuple]], count: Optional[Callable[[], int]] = None) -> None:
+        """Build from ``loader`` if not built yet, older than refresh_interval,
+        or holding a different number of documents than ``count()`` reports."""
+        # counted outside the lock so a slow database does not hold up searches
+        expected = count() if count is not None and self.built else None
+        with self._lock:
+            stale = (self.refresh_interval and self._built_at is not None
+                     and time.monotonic() - self._built_at > self.refresh_interval)
+            if expected is not None and expected != len(self._docs):
+                stale = True
+            if not self.built or stale:
+                self.build(loader())
+
+    def add(self, doc_id, patient_id: Optional[str], narrative: Optional[str], filename: Optional[str]) -> None:
+        """Index (or re-index) a document. Ignored until the index has been built,
+        since the build will read it from the database anyway."""
+        with self._lock:
+            if self.built:
+                self._remove(str(doc_id))
+                self._add(str(doc_id), patient_id, narrative, filename)
+
+    def remove(self, doc_id) -> None:
+        with self._lock:
+            if self.built:
+                self._remove(str(doc_id))
+
+    def search(self, query: str, patient_id: Optional[str] = None, k: int = 10) -> List[Tuple[str, float]]:
+        """Return up to k (doc_id, score) pairs, best first. With patient_id
+        only that patient's documents are considered."""
+        with self._lock:
+            shard = self._all if patient_id is None else self._patients.get(patient_id)
+            if shard is None or not shard.doc_len:
+                return []
+            n = len(shard.doc_len)
+            avgdl = shard.total_len / n or 1.0
+            scores: Dict[str, float] = {}
+            for term in set(tokenize(query)):
+                for match in shard.expand(term):
+                    docs = shard.postings[match]
+                    idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                    for doc_id, tf in docs.items():
+                        norm = self.k1 * (1 - self.b + self.b * shard.doc_len[doc_id] / avgdl)
+                        scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def _add(self, doc_id: str, patient_id: Optional[str], narrative: Optional[str], filename: Optional[str]) -> None:
+        tokens = tokenize(narrative) + tokenize(filename)
+        counts = Counter(tokens)
+        self._docs[doc_id] = (patient_id, counts)
+        self._all.add(doc_id, counts, len(tokens))
+        self._patients.setdefault(patient_id, _Shard()).add(doc_id, counts, len(tokens))
+
+    def _remove(self, doc_id: str) -> None:
+        found = self._docs.pop(doc_id, None)
+        if found is None:
+            return
+        patient_id, counts = found
+        self._all.remove(doc_id, counts)
+        shard = self._patients.get(patient_id)
+        if shard is not None:
+            shard.remove(doc_id, counts)
+            if not shard.doc_len:
+                del self._patients[patient_id]
@@ -1,23 +1,134 @@
 from abc import ABC, abstractmethod
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Iterator, Iterable, BinaryIO, Union
+
+# What save() accepts: raw bytes, a binary file-like object (e.g. an upload's
+# stream) or an iterable of byte chunks.
+Source = Union[bytes, BinaryIO, Iterable[bytes]]
+
+
+def iter_chunks(data: Source, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """Yield a save() source as byte chunks without reading it all at once."""
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data)
+        for i in range(0, len(data), chunk_size):
+            yield data[i:i + chunk_size]
+    elif hasattr(data, 'read'):
+        while True:
+            chunk = data.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+    else:
+        for chunk in data:
+            if chunk:
+                yield chunk
+
+
+class StreamReader:
+    """Read-only file-like view of a chunk iterator.
+
+    Seeking forward reads and discards the skipped bytes; seeking backwards
+    is not supported. Closing the reader closes the iterator, so a git
+    process behind it is stopped rather than drained.
+    """
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buffer = b''
+        self._pos = 0
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, b'')
+            if not chunk:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        target = offset if whence == 0 else self._pos + offset if whence == 1 else None
+        if target is None or target < self._pos:
+            raise OSError("StreamReader can only seek forwards from the start or current position")
+        while self._pos < target:
+            if not self.read(min(target - self._pos, 64 * 1024)):
+                break
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+    def close(self) -> None:
+        close = getattr(self._chunks, 'close', None)
+        if close is not None:
+            close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
 
 class StorageAdapter(ABC):
     @abstractmethod
-    def save(self, relative_path: str, data: bytes, user_id: str, action: str, message: Optional[str] = None) -> str:
-        """Save bytes into storage and return a version id / commit hash."""
+    def save(self, relative_path: str, data: Source, user_id: str, action: str, message: Optional[str] = None) -> str:
+        """Save bytes (or a file-like / chunk iterator, see iter_chunks) into storage and return a version id / commit hash."""
 
-    def save_with_parent(self, relative_path: str, data: bytes, user_id: str, action: str, parent: Optional[str] = None, message: Optional[str] = None) -> str:
-        """Save bytes with optimistic locking using a parent commit hash. If parent is provided, the adapter should verify
+    def save_with_parent(self, relative_path: str, data: Source, user_id: str, action: str, parent: Optional[str] = None, message: Optional[str] = None) -> str:
+        """Save data with optimistic locking using a parent commit hash. If parent is provided, the adapter should verify
         that the repository HEAD matches parent before committing. Returns new commit hash."""
 
     @abstractmethod
     def get(self, relative_path: str, version: Optional[str] = None) -> bytes:
         """Retrieve file bytes. If version is None, return latest."""
 
+    def get_stream(self, relative_path: str, version: Optional[str] = None, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """Return an iterator over the file's bytes in chunks of at most chunk_size. Adapters that can
+        read incrementally should override this; the default loads the file with get()."""
+        data = self.get(relative_path, version)
+        return iter([data[i:i + chunk_size] for i in range(0, len(data), chunk_size)])
+
+    def open_reader(self, relative_path: str, version: Optional[str] = None) -> BinaryIO:
+        """Return a binary file-like object over the file supporting read(), seek() and close().
+        Adapters that can seek cheaply should override this; the default wraps get_stream
+        in a StreamReader, which seeks by reading forward."""
+        return StreamReader(self.get_stream(relative_path, version))
+
+    def size(self, relative_path: str, version: Optional[str] = None) -> int:
+        """Return the file's size in bytes without necessarily reading it."""
+        return len(self.get(relative_path, version))
+
+    def blob_id(self, relative_path: str, version: Optional[str] = None) -> Optional[str]:
+        """Return an id that names the file's content at ``version`` (equal ids mean equal bytes),
+        or None if the adapter cannot provide one without reading the file."""
+        return None
+
+    def diff(self, relative_path: str, a: str, b: str, stat_only: bool = False) -> Dict:
+        """Diff the file between versions a and b. Returns a dict with 'binary', 'stats'
+        ({'additions', 'deletions'}), 'hunks' and the unified 'text'; with stat_only the
+        hunks and text may be left empty. The default reads both versions and diffs them
+        in Python (bhv.diffing.python_diff)."""
+        from ..diffing import python_diff
+        return python_diff(self, relative_path, a, b, stat_only=stat_only)
+
     @abstractmethod
     def history(self, relative_path: str) -> List[Dict]:
         """Return chronological list of versions/commits for the given path."""
 
     def head(self, relative_path: str) -> Optional[str]:
         """Return the current HEAD commit hexsha for the path's repository, or None if none exists."""
+
+    @abstractmethod
+    def list_files(self, patient_id: str, version: Optional[str] = None) -> List[str]:
+        """Return the '<patient_id>/...' paths of every file in the patient's vault at ``version``
+        (default: the latest commit), sorted."""
+
+    @abstractmethod
+    def file_versions(self, patient_id: str, version: Optional[str] = None) -> List[Dict]:
+        """Return every version of every file up to ``version``, oldest first, as dicts with
+        'path' ('<patient_id>/...'), 'hexsha' and 'datetime'. Deletions are not listed."""
@@ -0,0 +1,69 @@
+import os
+import re
+import threading
+from typing import BinaryIO, Dict, Optional, Tuple
+
+# Content of a file committed in dedup mode: it names the real bytes in the BlobStore.
+_POINTER_RE = re.compile(rb'bhv-blob v1 sha256:([0-9a-f]{64}) size:(\d+)\n')
+POINTER_MAX_SIZE = 128
+
+
+def make_pointer(sha256: str, size: int) -> bytes:
+    return b'bhv-blob v1 sha256:%s size:%d\n' % (sha256.encode('ascii'), size)
+
+
+def parse_pointer(data: bytes) -> Optional[Tuple[str, int]]:
+    """Return (sha256, size) if ``data`` is a pointer file, else None."""
+    if len(data) > POINTER_MAX_SIZE:
+        return None
+    m = _POINTER_RE.fullmatch(data)
+    return (m.group(1).decode('ascii'), int(m.group(2))) if m else None
+
+
+class BlobStore:
+    """Content-addressed file store shared by every patient repository.
+
+    Objects live at ``<root>/.objects/<aa>/<bb>/<sha256>`` and are written
+    once: storing content that is already present just drops the new copy.
+    In dedup mode GitAdapter commits a small pointer file (``make_pointer``)
+    in place of the content, so identical uploads to many vaults cost one
+    copy on disk and a few bytes per repository. Objects are never deleted
+    here, since any number of commits may refer to them.
+    """
+
+    DIRNAME = '.objects'
+
+    def __init__(self, root_dir: str):
+        self.root = os.path.join(root_dir, self.DIRNAME)
+        self._mutex = threading.Lock()
+        self.stored = 0
+        self.deduplicated = 0
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.exists(self.path(sha256))
+
+    def put_file(self, tmp_path: str, sha256: str) -> bool:
+        """Move ``tmp_path`` (whose SHA-256 is ``sha256``) into the store.
+        Returns False, and removes tmp_path, if the content was already stored."""
+        target = self.path(sha256)
+        if os.path.exists(target):
+            os.remove(tmp_path)
+            with self._mutex:
+                self.deduplicated += 1
+            return False
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # identical concurrent uploads just replace each other with the same bytes
+        os.replace(tmp_path, target)
+        with self._mutex:
+            self.stored += 1
+        return True
+
+    def open(self, sha256: str) -> BinaryIO:
+        return open(self.path(sha256), 'rb')
+
+    def stats(self) -> Dict[str, int]:
+        with self._mutex:
+            return {'stored': self.stored, 'deduplicated': self.deduplicated}
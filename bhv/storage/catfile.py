@@ -0,0 +1,264 @@
+import re
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Tuple
+
+# (object id, object type, size in bytes) as reported by git cat-file
+ObjectInfo = Tuple[str, str, int]
+
+_HEADER_RE = re.compile(rb'([0-9a-f]{40}|[0-9a-f]{64}) ([a-z]+) ([0-9]+)')
+
+
+def parse_header(line: bytes) -> Optional[ObjectInfo]:
+    """Parse a cat-file response header, or return None for "<spec> missing" /
+    "<spec> ambiguous" (whose spec may itself contain spaces)."""
+    match = _HEADER_RE.fullmatch(line.rstrip(b'\n'))
+    if match is None:
+        return None
+    return match.group(1).decode('ascii'), match.group(2).decode('ascii'), int(match.group(3))
+
+
+class CatFileWorker:
+    """A long-running ``git cat-file --batch`` process for one repository.
+
+    Each lookup is one request line and one response on the pipe, so reading
+    a historical blob costs no process start-up. Size/type lookups go to a
+    ``--batch-check`` companion that is started on first use. Callers must
+    hold ``lock`` around every call; a stream keeps holding it until it is
+    exhausted or closed.
+    """
+
+    def __init__(self, cwd: str):
+        self.cwd = cwd
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.requests = 0
+        self.retired = False  # removed from its pool; closed by whoever holds the lock last
+        self._procs: Dict[str, subprocess.Popen] = {}
+
+    def _proc(self, mode: str) -> subprocess.Popen:
+        proc = self._procs.get(mode)
+        if proc is None or proc.poll() is not None:
+            proc = subprocess.Popen(['git', 'cat-file', mode], cwd=self.cwd, stdin=subprocess.PIPE,
+                                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            self._procs[mode] = proc
+        return proc
+
+    def _request(self, mode: str, spec: str) -> Tuple[subprocess.Popen, Optional[ObjectInfo]]:
+        if '\n' in spec:
+            return self._procs.get(mode), None
+        self.requests += 1
+        self.last_used = time.monotonic()
+        proc = self._proc(mode)
+        try:
+            proc.stdin.write(spec.encode('utf-8') + b'\n')
+            proc.stdin.flush()
+            header = proc.stdout.readline()
+        except (BrokenPipeError, OSError):
+            header = b''
+        if not header:
+            self._kill(mode)
+            raise RuntimeError(f'git cat-file {mode} exited unexpectedly in {self.cwd}')
+        return proc, parse_header(header)
+
+    def info(self, spec: str) -> Optional[ObjectInfo]:
+        return self._request('--batch-check', spec)[1]
+
+    def read(self, spec: str) -> Optional[Tuple[ObjectInfo, bytes]]:
+        proc, info = self._request('--batch', spec)
+        if info is None:
+            return None
+        data = proc.stdout.read(info[2] + 1)[:-1]  # content is followed by a newline
+        if len(data) != info[2]:
+            self._kill('--batch')
+            raise RuntimeError(f'short read from git cat-file in {self.cwd}')
+        return info, data
+
+    def stream(self, spec: str, chunk_size: int) -> Optional['BlobStream']:
+        """Start reading a blob; the returned stream releases ``lock`` when done."""
+        proc, info = self._request('--batch', spec)
+        if info is None:
+            return None
+        return BlobStream(self, proc, info, chunk_size)
+
+    def _kill(self, mode: str) -> None:
+        proc = self._procs.pop(mode, None)
+        if proc is None:
+            return
+        for pipe in (proc.stdin, proc.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+
+    def release(self) -> None:
+        """Release ``lock``; a retired worker is shut down by the last holder."""
+        self.last_used = time.monotonic()
+        self.lock.release()
+        if self.retired and self.lock.acquire(blocking=False):
+            try:
+                self.close()
+            finally:
+                self.lock.release()
+
+    def close(self) -> None:
+        for mode in list(self._procs):
+            self._kill(mode)
+
+
+class BlobStream:
+    """Iterator over one blob's bytes coming from a worker's ``--batch`` pipe.
+
+    Stopping early leaves unread bytes in the pipe, so ``close()`` then kills
+    the process (the next request starts a new one) rather than draining a
+    possibly large blob. Either way the worker's lock is released.
+    """
+
+    def __init__(self, worker: CatFileWorker, proc: subprocess.Popen, info: ObjectInfo, chunk_size: int):
+        self.worker = worker
+        self.info = info
+        self._proc = proc
+        self._remaining = info[2]
+        self._chunk_size = chunk_size
+        self._done = False
+
+    def __iter__(self) -> Iterator[bytes]:
+        return self
+
+    def __next__(self) -> bytes:
+        if self._done:
+            raise StopIteration
+        if not self._remaining:
+            self._proc.stdout.read(1)  # trailing newline
+            self._finish(clean=True)
+            raise StopIteration
+        chunk = self._proc.stdout.read(min(self._chunk_size, self._remaining))
+        if not chunk:
+            self._finish(clean=False)
+            raise RuntimeError(f'short read from git cat-file in {self.worker.cwd}')
+        self._remaining -= len(chunk)
+        return chunk
+
+    def close(self) -> None:
+        if not self._done:
+            self._finish(clean=False)
+
+    def __del__(self):
+        self.close()
+
+    def _finish(self, clean: bool) -> None:
+        self._done = True
+        if not clean:
+            self.worker._kill('--batch')
+        self.worker.release()
+
+
+class CatFilePool:
+    """Bounded set of ``CatFileWorker`` processes keyed by repository.
+
+    At most ``capacity`` workers run at a time; the least recently used idle
+    one is shut down to make room, and workers idle for ``idle_timeout``
+    seconds are shut down on the next checkout. ``checkout`` returns the
+    repository's worker with its lock held, or None when the worker stayed
+    busy for ``timeout`` seconds (None waits indefinitely), or when every
+    worker is busy and the pool is full. Callers then fall back to a one-shot git command.
+    """
+
+    def __init__(self, capacity: int = 16, idle_timeout: float = 60.0):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.idle_timeout = idle_timeout
+        self._workers: "OrderedDict[str, CatFileWorker]" = OrderedDict()
+        self._mutex = threading.Lock()
+        self.started = 0
+        self.stopped = 0
+
+    def checkout(self, cwd: str, timeout: Optional[float] = None) -> Optional[CatFileWorker]:
+        to_close = []
+        with self._mutex:
+            to_close.extend(self._expire_idle())
+            worker = self._workers.get(cwd)
+            if worker is None:
+                to_close.extend(self._make_room())
+                if len(self._workers) < self.capacity:
+                    worker = self._workers[cwd] = CatFileWorker(cwd)
+                    self.started += 1
+            if worker is not None:
+                self._workers.move_to_end(cwd)
+        self._close_all(to_close)
+        if worker is None or not worker.lock.acquire(timeout=-1 if timeout is None else timeout):
+            return None
+        if worker.retired:
+            # evicted between the lookup and here
+            worker.release()
+            return self.checkout(cwd, timeout)
+        return worker
+
+    def checkin(self, worker: CatFileWorker) -> None:
+        worker.release()
+
+    def discard(self, cwd: str) -> None:
+        """Shut down the worker for ``cwd`` (e.g. after its repository moved)."""
+        with self._mutex:
+            worker = self._workers.pop(cwd, None)
+        if worker is not None:
+            self._close_all([worker])
+
+    def close(self) -> None:
+        with self._mutex:
+            workers = list(self._workers.values())
+            self._workers.clear()
+        self._close_all(workers)
+
+    def stats(self) -> Dict[str, int]:
+        with self._mutex:
+            return {
+                'workers': len(self._workers),
+                'capacity': self.capacity,
+                'started': self.started,
+                'stopped': self.stopped,
+                'requests': sum(w.requests for w in self._workers.values()),
+            }
+
+    # -- internals (call with self._mutex held) --------------------------------
+
+    def _expire_idle(self) -> list:
+        if not self.idle_timeout:
+            return []
+        deadline = time.monotonic() - self.idle_timeout
+        expired = []
+        for key in list(self._workers):
+            worker = self._workers[key]
+            if worker.last_used <= deadline and not worker.lock.locked():
+                del self._workers[key]
+                expired.append(worker)
+        return expired
+
+    def _make_room(self) -> list:
+        evicted = []
+        for key in list(self._workers):
+            if len(self._workers) < self.capacity:
+                break
+            worker = self._workers[key]
+            if worker.lock.locked():
+                continue
+            del self._workers[key]
+            evicted.append(worker)
+        return evicted
+
+    def _close_all(self, workers) -> None:
+        for worker in workers:
+            # a worker checked out meanwhile is closed by its holder on release
+            worker.retired = True
+            if worker.lock.acquire(blocking=False):
+                try:
+                    worker.close()
+                finally:
+                    worker.lock.release()
+            self.stopped += 1
@@ -1,3 +1,18 @@
+from typing import Optional
+
+
 class Conflict(Exception):
-    """Raised when an optimistic-lock parent does not match the repository HEAD."""
-    pass
+    """Raised when a file changed since the optimistic-lock parent, or HEAD moved
+    while committing. ``head`` is the repository HEAD to retry against."""
+
+    def __init__(self, message: str, head: Optional[str] = None):
+        super().__init__(message)
+        self.head = head
+
+
+class UploadTooLarge(Exception):
+    """Raised when data passed to save() exceeds the adapter's max_file_size."""
+
+    def __init__(self, limit: int):
+        super().__init__(f"upload exceeds the maximum size of {limit} bytes")
+        self.limit = limit
@@ -1,10 +1,104 @@
+import hashlib
+import io
 import os
+import subprocess
+import tempfile
 import threading
-from typing import Optional, List, Dict
+from collections import namedtuple
+from contextlib import contextmanager, nullcontext
+from typing import BinaryIO, Optional, List, Dict, Iterator, Tuple
 from git import Repo, Actor
+from git.exc import GitCommandError
+from git.refs.symbolic import SymbolicReference
 
-from .base import StorageAdapter
-from .errors import Conflict
+from ..diffing import make_result, parse_hunks, python_diff
+from .base import StorageAdapter, Source, StreamReader, iter_chunks
+from .blob_store import BlobStore, POINTER_MAX_SIZE, make_pointer, parse_pointer
+from .catfile import CatFilePool, parse_header
+from .errors import Conflict, UploadTooLarge
+from .history_index import HistoryIndex
+from .locks import LockManager
+from .maintenance import MaintenanceScheduler
+from .repo_cache import RepoCache
+
+
+def _head_sha(repo: Repo) -> Optional[str]:
+    # read from the ref files: repo.head.commit would go through the object
+    # database, whose cat-file pipe cannot be shared between threads
+    try:
+        return SymbolicReference.dereference_recursive(repo, 'HEAD')
+    except Exception:
+        return None
+
+
+class _Repo(Repo):
+    """A Repo shared between threads through RepoCache.
+
+    GitPython reads objects through one persistent ``git cat-file`` pipe per
+    Repo, which is not thread-safe; every use of the object database (commit
+    objects, trees, ``index.commit``) must hold ``odb_lock``. Reads through
+    the adapter avoid it (HEAD comes from the ref files, content from
+    CatFilePool or one-shot git processes).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.odb_lock = threading.RLock()
+
+
+def _iter_file(f, chunk_size: int) -> Iterator[bytes]:
+    with f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _iter_process(proc: subprocess.Popen, first: bytes, chunk_size: int) -> Iterator[bytes]:
+    try:
+        chunk = first
+        while chunk:
+            yield chunk
+            chunk = proc.stdout.read(chunk_size)
+    finally:
+        # also reached when the consumer stops early (client disconnect)
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+
+
+# How long a read waits for its repo's cat-file worker (which may be serving a
+# slow download) before using a one-shot git process instead.
+_CATFILE_WAIT = 0.5
+
+
+# Passed as _commit's ``expected`` to commit on top of whatever HEAD is now.
+_CURRENT_HEAD = object()
+
+
+# One file written as part of a commit; sha256 is the digest computed while spooling.
+_Change = namedtuple('_Change', 'relative_path user_id action message sha256')
+
+
+class _Batch:
+    """Changes staged in a patient repo that will be committed together."""
+
+    def __init__(self, owner: Optional[int] = None, lock=None):
+        self.owner = owner  # thread ident for explicit batches, None for group-commit windows
+        self.lock = lock  # the patient's Held write lock, for explicit batches
+        self.base = None  # HEAD when an explicit batch began; its commit must follow it
+        self.items = []  # _Change
+        self.paths = set()
+        self.files = {}  # relative_path -> spooled file, for group-commit windows (staged at flush)
+        self.done = threading.Event()
+        self.hexsha = None
+        self.error = None
+
+    def add(self, change: _Change) -> None:
+        self.items.append(change)
+        self.paths.add(change.relative_path)
 
 
 class GitAdapter(StorageAdapter):
@@ -13,128 +107,789 @@ class GitAdapter(StorageAdapter):
     This adapter stores each patient's vault under a separate directory
     (root_dir/<patient_id>/...). Each save writes the file and creates
     a git commit with metadata in the message.
+
+    With ``shard_levels`` > 0 the repos are spread over hash-prefix fan-out
+    directories instead: root_dir/<aa>/<bb>/<patient_id> for two levels of
+    width 2, where aa, bb are the leading hex digits of sha1(patient_id).
+    Callers still pass '<patient_id>/...' paths. Repos in the flat layout
+    are found as a fallback and can be moved with ``migrate_to_shards``.
+
+    Open ``Repo`` handles are kept in a bounded LRU cache (``repo_cache_size``
+    entries, closed after ``repo_idle_timeout`` idle seconds) so hot patients
+    do not pay for re-reading git config and refs on every call.
+
+    Writes can be grouped into one commit per patient repo, either
+    explicitly (``begin_batch``/``commit_batch`` or the ``batch`` context
+    manager) or implicitly by setting ``group_commit_window``: saves without
+    a ``parent`` that arrive within that many seconds of each other share a
+    single commit, and every caller gets the shared commit hash back.
+
+    ``history()`` is served from a per-repo :class:`HistoryIndex` that is
+    appended to on every commit and rebuilt automatically if it falls
+    behind HEAD (or explicitly with ``rebuild_history_index``).
+
+    ``save`` accepts bytes, a file-like object or an iterator of chunks. The
+    data is copied in chunks into a temporary file (hashing it with SHA-256
+    and enforcing ``max_file_size`` as it goes) before the patient lock is
+    taken, then moved into the working tree.
     """
 
-    def __init__(self, root_dir: str):
+    def __init__(self, root_dir: str, repo_cache_size: int = 128, repo_idle_timeout: float = 300.0,
+                 group_commit_window: float = 0.0, max_file_size: Optional[int] = None,
+                 catfile_workers: int = 16, catfile_idle_timeout: float = 60.0, dedup: bool = False,
+                 shard_levels: int = 0, shard_width: int = 2, process_locks: bool = True):
         self.root_dir = os.path.abspath(root_dir)
         os.makedirs(self.root_dir, exist_ok=True)
-        self._locks = {}  # patient_id -> threading.Lock
+        self.shard_levels = shard_levels
+        self.shard_width = shard_width
+        self.max_file_size = max_file_size
+        # per-patient locks; with process_locks they also hold across worker processes
+        self._locks = LockManager(os.path.join(self.root_dir, '.locks') if process_locks else None)
+        self._repos = RepoCache(capacity=repo_cache_size, idle_timeout=repo_idle_timeout)
+        # long-running `git cat-file --batch` processes serving historical reads
+        self._catfile = CatFilePool(capacity=catfile_workers, idle_timeout=catfile_idle_timeout)
+        # with dedup, content goes to a shared BlobStore and repos commit pointer files
+        self.dedup = dedup
+        self._blobs = BlobStore(self.root_dir)
+        self.maintenance: Optional[MaintenanceScheduler] = None
+        self.group_commit_window = group_commit_window
+        self._batches = {}  # patient_id -> explicit _Batch
+        self._pending = {}  # patient_id -> open group-commit _Batch
 
-    def _ensure_repo(self, patient_id: str) -> Repo:
-        repo_path = os.path.join(self.root_dir, patient_id)
+    def repo_path(self, patient_id: str) -> str:
+        """Working tree directory of a patient's repository."""
+        if not self.shard_levels:
+            return self._flat_path(patient_id)
+        sharded = self._sharded_path(patient_id)
+        if not os.path.isdir(os.path.join(sharded, '.git')):
+            flat = self._flat_path(patient_id)
+            if os.path.isdir(os.path.join(flat, '.git')):
+                # not migrated yet
+                return flat
+        return sharded
+
+    def _flat_path(self, patient_id: str) -> str:
+        return os.path.join(self.root_dir, patient_id)
+
+    def _sharded_path(self, patient_id: str) -> str:
+        digest = hashlib.sha1(patient_id.encode('utf-8')).hexdigest()
+        w = self.shard_width
+        shards = [digest[i * w:(i + 1) * w] for i in range(self.shard_levels)]
+        return os.path.join(self.root_dir, *shards, patient_id)
+
+    def _is_shard_dir(self, name: str) -> bool:
+        return len(name) == self.shard_width and all(c in '0123456789abcdef' for c in name)
+
+    def _open_repo(self, patient_id: str) -> Repo:
+        repo_path = self.repo_path(patient_id)
         os.makedirs(repo_path, exist_ok=True)
         if not os.path.exists(os.path.join(repo_path, '.git')):
             Repo.init(repo_path)
-        # return a fresh Repo object to avoid long-lived file handles on Windows
-        if patient_id not in self._locks:
-            self._locks[patient_id] = threading.Lock()
-        return Repo(repo_path)
+        return _Repo(repo_path)
+
+    def _ensure_repo(self, patient_id: str) -> Repo:
+        """Return a fresh, uncached Repo for callers that manage its lifetime themselves."""
+        return self._open_repo(patient_id)
+
+    @contextmanager
+    def _repo(self, patient_id: str):
+        """Check out the cached Repo for ``patient_id`` for the duration of the
+        block, holding the patient's read lock so the repo cannot be moved."""
+        with self._locks.read(patient_id):
+            repo = self._repos.acquire(patient_id, lambda: self._open_repo(patient_id))
+            if not os.path.isdir(repo.git_dir):
+                # moved by migrate_to_shards (possibly in another process)
+                self._repos.release(repo)
+                self._repos.invalidate(patient_id)
+                repo = self._repos.acquire(patient_id, lambda: self._open_repo(patient_id))
+            try:
+                yield repo
+            finally:
+                self._repos.release(repo)
 
-    def save(self, relative_path: str, data: bytes, user_id: str, action: str, message: Optional[str] = None) -> str:
+    def patients(self) -> List[str]:
+        """Return the ids of every patient that has a repository, in either layout."""
+        result = []
+
+        def walk(directory: str, depth: int) -> None:
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if name.startswith('.'):
+                    continue
+                if os.path.isdir(os.path.join(path, '.git')):
+                    result.append(name)
+                elif depth < self.shard_levels and self._is_shard_dir(name) and os.path.isdir(path):
+                    walk(path, depth + 1)
+
+        walk(self.root_dir, 0)
+        return sorted(result)
+
+    def migrate_to_shards(self, patient_id: str) -> bool:
+        """Move a patient's repo from the flat layout into its shard directory.
+        Returns False if there is nothing to move or the repo is in the middle
+        of a batch (try again later). Safe while the app is serving: the move
+        is a rename under the patient lock, and other processes reopen the
+        repo at its new path on next use."""
+        if not self.shard_levels:
+            raise ValueError("sharding is not enabled (shard_levels=0)")
+        flat = self._flat_path(patient_id)
+        target = self._sharded_path(patient_id)
+        if not os.path.isdir(os.path.join(flat, '.git')) or os.path.exists(target):
+            return False
+        with self._locks.exclusive(patient_id):
+            if patient_id in self._batches or patient_id in self._pending:
+                return False
+            self._repos.invalidate(patient_id)
+            self._catfile.discard(flat)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            os.rename(flat, target)
+        return True
+
+    def rebuild_history_index(self, patient_id: Optional[str] = None) -> Dict[str, int]:
+        """Rebuild the history index of one patient (or all); returns commits indexed per patient."""
+        counts = {}
+        for pid in ([patient_id] if patient_id else self.patients()):
+            with self._writing(pid), self._repo(pid) as repo:
+                counts[pid] = HistoryIndex(repo.git_dir).rebuild(repo)
+        return counts
+
+    def cache_stats(self) -> Dict[str, int]:
+        """Hit/miss/eviction counters of the Repo handle cache."""
+        return self._repos.stats()
+
+    def catfile_stats(self) -> Dict[str, int]:
+        """Worker and request counters of the cat-file pool."""
+        return self._catfile.stats()
+
+    def enable_maintenance(self, **options) -> MaintenanceScheduler:
+        """Start a background MaintenanceScheduler fed by this adapter's commits;
+        ``options`` are passed to its constructor."""
+        if self.maintenance is None:
+            self.maintenance = MaintenanceScheduler(self.repo_path, **options)
+            self.maintenance.start()
+        return self.maintenance
+
+    def close(self) -> None:
+        """Stop maintenance and close every cached Repo handle and cat-file worker."""
+        if self.maintenance is not None:
+            self.maintenance.stop()
+        self._repos.clear()
+        self._catfile.close()
+
+    def _object_info(self, cwd: str, spec: str):
+        """(oid, type, size) of ``spec`` via the cat-file pool, or None if it does not exist."""
+        worker = self._catfile.checkout(cwd, timeout=_CATFILE_WAIT)
+        if worker is None:
+            out = subprocess.run(['git', 'cat-file', '--batch-check'], cwd=cwd, input=spec.encode('utf-8') + b'\n',
+                                 stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout
+            return parse_header(out)
+        try:
+            return worker.info(spec)
+        finally:
+            self._catfile.checkin(worker)
+
+    def save(self, relative_path: str, data: Source, user_id: str, action: str, message: Optional[str] = None) -> Optional[str]:
         # relative_path expected: '<patient_id>/path/to/file.ext'
         parts = relative_path.split(os.sep)
         if len(parts) < 2:
             raise ValueError("relative_path must start with '<patient_id>/...'")
-        patient_id = parts[0]
-        repo = self._ensure_repo(patient_id)
-        lock = self._locks[patient_id]
-        full_path = os.path.join(repo.working_tree_dir, *parts[1:])
-        os.makedirs(os.path.dirname(full_path), exist_ok=True)
 
         # Default save uses no parent check
         return self.save_with_parent(relative_path, data, user_id, action, parent=None, message=message)
 
-    def save_with_parent(self, relative_path: str, data: bytes, user_id: str, action: str, parent: Optional[str] = None, message: Optional[str] = None) -> str:
+    def save_with_parent(self, relative_path: str, data: Source, user_id: str, action: str, parent: Optional[str] = None, message: Optional[str] = None) -> Optional[str]:
+        """Write and commit one file. Inside an explicit batch owned by the
+        calling thread the file is only staged and None is returned; the
+        commit hash comes from ``commit_batch``. Saving a path the batch
+        already holds first commits the batch so far, so no version is lost."""
         parts = relative_path.split(os.sep)
         patient_id = parts[0]
-        repo = self._ensure_repo(patient_id)
-        lock = self._locks[patient_id]
+        with self._repo(patient_id) as repo:
+            # copy the upload to disk before taking the lock so slow clients
+            # do not hold up other writers
+            tmp_path, digest = self._spool(repo, data)
+            if self.dedup or self._looks_like_pointer(tmp_path):
+                # reads follow any committed pointer, so an upload that merely
+                # looks like one is stored as a blob too; otherwise it would
+                # name (and read back) someone else's stored file
+                tmp_path = self._store_blob(tmp_path, digest)
+            change = _Change(relative_path, user_id, action, message, digest)
+            try:
+                batch = self._batches.get(patient_id)
+                if batch is not None and batch.owner == threading.get_ident():
+                    # the batch owner already holds the patient lock
+                    if relative_path in batch.paths:
+                        # a second version of the same file needs its own commit
+                        batch.base = self._commit(repo, batch.items, expected=batch.base)
+                        batch.items, batch.paths = [], set()
+                    self._check_parent(repo, relative_path, parent)
+                    self._stage(repo, relative_path, tmp_path)
+                    batch.add(change)
+                    return None
+
+                if self.group_commit_window > 0 and parent is None:
+                    return self._save_grouped(repo, patient_id, change, tmp_path)
+
+                with self._locks.write(patient_id):
+                    self._flush_pending(repo, patient_id)
+                    head = self._check_parent(repo, relative_path, parent)
+                    self._stage(repo, relative_path, tmp_path)
+                    return self._commit(repo, [change], expected=head)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+    def _spool(self, repo: Repo, data: Source) -> Tuple[str, str]:
+        """Copy ``data`` into a temp file inside the repo's git dir; returns (path, sha256 hex)."""
+        tmp_dir = os.path.join(repo.git_dir, 'bhv-tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        digest = hashlib.sha256()
+        written = 0
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in iter_chunks(data):
+                    written += len(chunk)
+                    if self.max_file_size is not None and written > self.max_file_size:
+                        raise UploadTooLarge(self.max_file_size)
+                    digest.update(chunk)
+                    f.write(chunk)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return tmp_path, digest.hexdigest()
+
+    def _store_blob(self, tmp_path: str, digest: str) -> str:
+        """Move a spooled upload into the BlobStore; returns a temp file holding its pointer."""
+        size = os.path.getsize(tmp_path)
+        self._blobs.put_file(tmp_path, digest)
+        fd, pointer_path = tempfile.mkstemp(dir=os.path.dirname(tmp_path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(make_pointer(digest, size))
+        return pointer_path
+
+    @staticmethod
+    def _looks_like_pointer(path: str) -> bool:
+        if os.path.getsize(path) > POINTER_MAX_SIZE:
+            return False
+        with open(path, 'rb') as f:
+            return parse_pointer(f.read()) is not None
+
+    def _pointer(self, data: bytes) -> Optional[Tuple[str, int]]:
+        """(sha256, size) if ``data`` is a pointer to a stored blob, else None."""
+        found = parse_pointer(data)
+        if found is not None and self._blobs.exists(found[0]):
+            return found
+        return None
+
+    def _deref(self, data: bytes) -> bytes:
+        found = self._pointer(data)
+        if found is None:
+            return data
+        with self._blobs.open(found[0]) as f:
+            return f.read()
+
+    def _small_stream(self, data: bytes, chunk_size: int) -> Iterator[bytes]:
+        found = self._pointer(data)
+        if found is not None:
+            return _iter_file(self._blobs.open(found[0]), chunk_size)
+        return iter([data] if data else [])
+
+    def _small_reader(self, data: bytes) -> BinaryIO:
+        found = self._pointer(data)
+        if found is not None:
+            return self._blobs.open(found[0])
+        return io.BytesIO(data)
+
+    def begin_batch(self, patient_id: str) -> None:
+        """Start collecting saves to ``patient_id`` from this thread into one commit.
+
+        The patient lock is held until ``commit_batch`` or ``abort_batch``, so
+        other writers to the same patient wait for the batch to finish.
+        """
+        batch = self._batches.get(patient_id)
+        if batch is not None and batch.owner == threading.get_ident():
+            raise RuntimeError(f"a batch is already open for {patient_id}")
+        held = self._locks.acquire(patient_id, LockManager.WRITE)
+        try:
+            with self._repo(patient_id) as repo:
+                self._flush_pending(repo, patient_id)
+                base = _head_sha(repo)
+        except BaseException:
+            held.release()
+            raise
+        batch = self._batches[patient_id] = _Batch(owner=threading.get_ident(), lock=held)
+        batch.base = base
+
+    def commit_batch(self, patient_id: str, message: Optional[str] = None) -> Optional[str]:
+        """Commit everything saved since ``begin_batch`` and return the commit hash
+        (None if nothing was saved)."""
+        batch = self._owned_batch(patient_id)
+        try:
+            if not batch.items:
+                return None
+            with self._repo(patient_id) as repo:
+                return self._commit(repo, batch.items, message=message, expected=batch.base)
+        finally:
+            del self._batches[patient_id]
+            batch.lock.release()
+
+    def abort_batch(self, patient_id: str) -> None:
+        """Discard everything saved since ``begin_batch``."""
+        batch = self._owned_batch(patient_id)
+        try:
+            if batch.items:
+                with self._repo(patient_id) as repo:
+                    self._discard(repo, batch.paths)
+        finally:
+            del self._batches[patient_id]
+            batch.lock.release()
+
+    @contextmanager
+    def batch(self, patient_id: str, message: Optional[str] = None):
+        """Group the saves made inside the block into a single commit.
+
+        Yields a dict whose ``'hexsha'`` key holds the commit hash on exit.
+        """
+        result = {'hexsha': None}
+        self.begin_batch(patient_id)
+        try:
+            yield result
+        except BaseException:
+            self.abort_batch(patient_id)
+            raise
+        result['hexsha'] = self.commit_batch(patient_id, message=message)
+
+    def _writing(self, patient_id: str):
+        """The patient's write lock, or nothing if this thread's open batch already holds it
+        (the lock is not reentrant)."""
+        batch = self._batches.get(patient_id)
+        if batch is not None and batch.owner == threading.get_ident():
+            return nullcontext()
+        return self._locks.write(patient_id)
+
+    def _owned_batch(self, patient_id: str) -> _Batch:
+        batch = self._batches.get(patient_id)
+        if batch is None or batch.owner != threading.get_ident():
+            raise RuntimeError(f"no batch open for {patient_id} in this thread")
+        return batch
+
+    def _save_grouped(self, repo: Repo, patient_id: str, change: _Change, tmp_path: str) -> str:
+        with self._locks.write(patient_id):
+            batch = self._pending.get(patient_id)
+            if batch is not None and change.relative_path in batch.paths:
+                # a second version of the same file needs its own commit
+                self._flush_pending(repo, patient_id)
+                batch = None
+            leader = batch is None
+            if leader:
+                batch = self._pending[patient_id] = _Batch()
+            # staged only at flush, under the lock: anything put in the shared
+            # .git/index now would be swept into another process's commit
+            batch.files[change.relative_path] = tmp_path
+            batch.add(change)
+
+        if leader:
+            # give concurrent uploads a chance to join, unless someone flushes first
+            if not batch.done.wait(self.group_commit_window):
+                with self._locks.write(patient_id):
+                    self._flush_pending(repo, patient_id, only=batch)
+        batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.hexsha
+
+    def _flush_pending(self, repo: Repo, patient_id: str, only: Optional[_Batch] = None) -> None:
+        # caller holds the patient lock
+        batch = self._pending.get(patient_id)
+        if batch is None or (only is not None and batch is not only):
+            return
+        del self._pending[patient_id]
+        try:
+            try:
+                for change in batch.items:
+                    self._stage(repo, change.relative_path, batch.files[change.relative_path])
+            except BaseException:
+                self._discard(repo, batch.paths)
+                raise
+            batch.hexsha = self._commit(repo, batch.items)
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
+
+    def _check_parent(self, repo: Repo, relative_path: str, parent: Optional[str]) -> Optional[str]:
+        """Optimistic locking: raise Conflict unless ``parent`` is a commit that
+        already contains the last change to ``relative_path``. Changes to other
+        files since ``parent`` do not conflict. Returns the HEAD checked against;
+        caller holds the patient write lock."""
+        head = _head_sha(repo)
+        if parent is None or parent == head:
+            return head
+        info = self._object_info(repo.working_tree_dir, parent)
+        if info is None or info[1] != 'commit':
+            raise Conflict(f"Conflict: unknown parent {parent}; head is {head}", head=head)
+        rel_path = os.path.join(*relative_path.split(os.sep)[1:])
+        index = HistoryIndex(repo.git_dir)
+        if index.indexed_head() != head:
+            index.rebuild(repo)
+        changes = index.read(rel_path)
+        last = changes[-1]['hexsha'] if changes else None
+        if last is not None and last != info[0] and not repo.is_ancestor(last, info[0]):
+            raise Conflict(f"Conflict: {rel_path} was changed in {last} after parent {parent}; head is {head}",
+                           head=head)
+        return head
+
+    @staticmethod
+    def _stage(repo: Repo, relative_path: str, tmp_path: str) -> None:
+        parts = relative_path.split(os.sep)
         full_path = os.path.join(repo.working_tree_dir, *parts[1:])
         os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        # atomic: concurrent readers see either the old or the new file
+        os.replace(tmp_path, full_path)
+        with repo.odb_lock:
+            repo.index.add([os.path.relpath(full_path, repo.working_tree_dir)])
 
-        with lock:
-            # optimistic locking: if parent provided, ensure HEAD matches
+    @staticmethod
+    def _discard(repo: Repo, relative_paths) -> None:
+        """Best-effort rollback of staged, uncommitted files to HEAD."""
+        rels = [os.path.join(*p.split(os.sep)[1:]) for p in relative_paths]
+        with repo.odb_lock:
             try:
-                head = repo.head.commit.hexsha
+                head = repo.head.commit
+                tracked = {rel for rel in rels if rel.replace(os.sep, '/') in head.tree}
             except Exception:
-                head = None
-
-            if parent is not None and parent != head:
-                raise Conflict(f"Conflict: expected parent {parent} but head is {head}")
+                tracked = set()
+        for rel in rels:
+            try:
+                if rel in tracked:
+                    repo.git.checkout('HEAD', '--', rel)
+                else:
+                    repo.git.rm('--cached', '-q', '--ignore-unmatch', '--', rel)
+                    os.remove(os.path.join(repo.working_tree_dir, rel))
+            except Exception:
+                pass
 
-            with open(full_path, 'wb') as f:
-                f.write(data)
+    def _commit(self, repo: Repo, items, message: Optional[str] = None, expected=_CURRENT_HEAD) -> str:
+        """Commit the staged index, recording every (path, user, action) in the message.
 
-            repo.index.add([os.path.relpath(full_path, repo.working_tree_dir)])
-            actor = Actor("BHV System", "no-reply@example.com")
-            commit_message = message or f"{action} by user {user_id} on {relative_path}"
-            commit = repo.index.commit(commit_message, author=actor, committer=actor)
-            # Ensure HEAD points to a branch that exists. Some environments
-            # may have a mismatched HEAD symbolic ref (e.g. refs/heads/main)
-            # which can cause later repo.head access to fail. Create a
-            # 'main' branch pointing to this commit if necessary and ensure
-            # HEAD references it.
+        HEAD is moved with ``git update-ref <new> <old>``, which git applies
+        atomically only if HEAD still points at ``old``, so a commit never
+        silently replaces one made meanwhile by another process. ``expected``
+        is the HEAD the caller validated (None for an empty repo). If HEAD has
+        moved on, the staged files are rolled back and Conflict is raised.
+        """
+        lines = [c.message or f"{c.action} by user {c.user_id} on {c.relative_path}" for c in items]
+        if message is None:
+            if len(lines) == 1:
+                message = lines[0]
+            else:
+                message = f"batch of {len(lines)} changes\n\n" + "\n".join(lines)
+        elif len(lines) > 1:
+            message = message + "\n\n" + "\n".join(lines)
+        actor = Actor("BHV System", "no-reply@example.com")
+        index = HistoryIndex(repo.git_dir)
+        old = _head_sha(repo)
+        index_current = index.indexed_head() == old
+        if expected is not _CURRENT_HEAD and expected != old:
+            self._discard(repo, [c.relative_path for c in items])
+            raise Conflict(f"Conflict: head moved from {expected} to {old} while committing", head=old)
+        with repo.odb_lock:
+            commit = repo.index.commit(message, parent_commits=[repo.commit(old)] if old else [], head=False,
+                                       author=actor, committer=actor)
+        try:
+            repo.git.update_ref('-m', 'commit: ' + commit.summary, 'HEAD', commit.hexsha, old or '')
+        except GitCommandError:
+            head = _head_sha(repo)
+            self._discard(repo, [c.relative_path for c in items])
+            raise Conflict(f"Conflict: head moved from {old} to {head} while committing", head=head)
+        # Ensure HEAD points to a branch that exists. Some environments
+        # may have a mismatched HEAD symbolic ref (e.g. refs/heads/main)
+        # which can cause later repo.head access to fail. Create a
+        # 'main' branch pointing to this commit if necessary and ensure
+        # HEAD references it.
+        if _head_sha(repo) is None:
             try:
-                _ = repo.head.commit.hexsha
-            except Exception:
-                try:
+                with repo.odb_lock:
                     if 'main' not in [h.name for h in repo.heads]:
                         repo.create_head('main', commit)
                     repo.head.reference = repo.heads['main']
-                except Exception:
-                    # best-effort; if this fails, continue and return commit
-                    pass
-            return commit.hexsha
+            except Exception:
+                # best-effort; if this fails, continue and return commit
+                pass
+        if index_current:
+            # a stale index is left alone; history() rebuilds it on demand
+            index.append(commit.hexsha, [(os.path.join(*c.relative_path.split(os.sep)[1:]), c.sha256) for c in items],
+                         str(commit.author), commit.message.strip(), commit.committed_datetime.isoformat())
+        if self.maintenance is not None:
+            self.maintenance.record_write(items[0].relative_path.split(os.sep)[0], len(items))
+        return commit.hexsha
 
     def get(self, relative_path: str, version: Optional[str] = None) -> bytes:
         parts = relative_path.split(os.sep)
         if len(parts) < 2:
             raise ValueError("relative_path must start with '<patient_id>/...'")
         patient_id = parts[0]
-        repo = self._ensure_repo(patient_id)
         rel_path = os.path.join(*parts[1:])
-        if version is None:
-            # read from working tree
-            target = os.path.join(repo.working_tree_dir, rel_path)
-            with open(target, 'rb') as f:
-                return f.read()
-        else:
-            commit = repo.commit(version)
-            blob = commit.tree / rel_path
-            return blob.data_stream.read()
+        with self._repo(patient_id) as repo:
+            if version is None:
+                # read from working tree
+                target = os.path.join(repo.working_tree_dir, rel_path)
+                with open(target, 'rb') as f:
+                    return self._deref(f.read())
+            cwd = repo.working_tree_dir
+        return self._deref(self._read_blob(cwd, relative_path, rel_path, version))
+
+    def _read_blob(self, cwd: str, relative_path: str, rel_path: str, version: str) -> bytes:
+        """Raw bytes of the blob committed at ``version`` (pointer files are not resolved)."""
+        spec = f"{version}:{rel_path.replace(os.sep, '/')}"
+        worker = self._catfile.checkout(cwd, timeout=_CATFILE_WAIT)
+        if worker is None:
+            # pool exhausted: one-shot process
+            proc = subprocess.run(['git', 'cat-file', 'blob', spec], cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            if proc.returncode != 0:
+                raise FileNotFoundError(f"{relative_path} does not exist at {version}")
+            return proc.stdout
+        try:
+            found = worker.read(spec)
+        finally:
+            self._catfile.checkin(worker)
+        if found is None or found[0][1] != 'blob':
+            raise FileNotFoundError(f"{relative_path} does not exist at {version}")
+        return found[1]
+
+    def get_stream(self, relative_path: str, version: Optional[str] = None, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """Stream a file in chunks. The working tree copy is read from disk;
+        historical versions are streamed from the repo's cat-file worker (or a
+        one-shot ``git cat-file`` while that worker is busy) so neither is held
+        in memory. Raises FileNotFoundError up front if it does not exist."""
+        parts = relative_path.split(os.sep)
+        if len(parts) < 2:
+            raise ValueError("relative_path must start with '<patient_id>/...'")
+        patient_id = parts[0]
+        rel_path = os.path.join(*parts[1:])
+        with self._repo(patient_id) as repo:
+            if version is None:
+                f = open(os.path.join(repo.working_tree_dir, rel_path), 'rb')
+                if os.fstat(f.fileno()).st_size <= POINTER_MAX_SIZE:
+                    with f:
+                        return self._small_stream(f.read(), chunk_size)
+                return _iter_file(f, chunk_size)
+            cwd = repo.working_tree_dir
+        spec = f"{version}:{rel_path.replace(os.sep, '/')}"
+        # a stream holds its worker until the client has read it; never wait behind one
+        worker = self._catfile.checkout(cwd, timeout=0)
+        if worker is not None:
+            try:
+                stream = worker.stream(spec, chunk_size)
+            except BaseException:
+                self._catfile.checkin(worker)
+                raise
+            if stream is None:
+                self._catfile.checkin(worker)
+                raise FileNotFoundError(f"{relative_path} does not exist at {version}")
+            if stream.info[1] != 'blob':
+                stream.close()
+                raise FileNotFoundError(f"{relative_path} does not exist at {version}")
+            if stream.info[2] <= POINTER_MAX_SIZE:
+                return self._small_stream(b''.join(stream), chunk_size)
+            return stream
+        proc = subprocess.Popen(['git', 'cat-file', 'blob', spec], cwd=cwd,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        first = proc.stdout.read(chunk_size)
+        if not first and proc.wait() != 0:
+            proc.stdout.close()
+            raise FileNotFoundError(f"{relative_path} does not exist at {version}")
+        if len(first) <= POINTER_MAX_SIZE and len(first) < chunk_size:
+            # a short read means the whole (small) blob is in hand
+            proc.stdout.close()
+            proc.wait()
+            return self._small_stream(first, chunk_size)
+        return _iter_process(proc, first, chunk_size)
+
+    def open_reader(self, relative_path: str, version: Optional[str] = None) -> BinaryIO:
+        """Open a file for random access, e.g. to serve a byte range.
+
+        The working tree copy and stored blobs behind dedup pointers are real
+        files, so seek() is free. Other historical blobs can only be streamed
+        out of git, so seeking reads up to the offset (and closing early stops
+        the git process). Raises FileNotFoundError if the file or version does
+        not exist.
+        """
+        parts = relative_path.split(os.sep)
+        if len(parts) < 2:
+            raise ValueError("relative_path must start with '<patient_id>/...'")
+        patient_id = parts[0]
+        rel_path = os.path.join(*parts[1:])
+        with self._repo(patient_id) as repo:
+            if version is None:
+                f = open(os.path.join(repo.working_tree_dir, rel_path), 'rb')
+                if os.fstat(f.fileno()).st_size > POINTER_MAX_SIZE:
+                    return f
+                with f:
+                    return self._small_reader(f.read())
+            cwd = repo.working_tree_dir
+        info = self._object_info(cwd, f"{version}:{rel_path.replace(os.sep, '/')}")
+        if info is None or info[1] != 'blob':
+            raise FileNotFoundError(f"{relative_path} does not exist at {version}")
+        if info[2] <= POINTER_MAX_SIZE:
+            return self._small_reader(self._read_blob(cwd, relative_path, rel_path, version))
+        return StreamReader(self.get_stream(relative_path, version))
+
+    def size(self, relative_path: str, version: Optional[str] = None) -> int:
+        parts = relative_path.split(os.sep)
+        if len(parts) < 2:
+            raise ValueError("relative_path must start with '<patient_id>/...'")
+        patient_id = parts[0]
+        rel_path = os.path.join(*parts[1:])
+        with self._repo(patient_id) as repo:
+            if version is None:
+                target = os.path.join(repo.working_tree_dir, rel_path)
+                size = os.path.getsize(target)
+                if size <= POINTER_MAX_SIZE:
+                    with open(target, 'rb') as f:
+                        found = self._pointer(f.read())
+                    if found is not None:
+                        return found[1]
+                return size
+            cwd = repo.working_tree_dir
+        info = self._object_info(cwd, f"{version}:{rel_path.replace(os.sep, '/')}")
+        if info is None or info[1] != 'blob':
+            raise FileNotFoundError(f"{relative_path} does not exist at {version}")
+        if info[2] <= POINTER_MAX_SIZE:
+            found = self._pointer(self._read_blob(cwd, relative_path, rel_path, version))
+            if found is not None:
+                return found[1]
+        return info[2]
+
+    def blob_id(self, relative_path: str, version: Optional[str] = None) -> str:
+        """Git blob SHA of the file at ``version`` (or of the working tree copy).
+        Blob ids name content, so equal ids mean identical bytes."""
+        parts = relative_path.split(os.sep)
+        if len(parts) < 2:
+            raise ValueError("relative_path must start with '<patient_id>/...'")
+        patient_id = parts[0]
+        rel_path = os.path.join(*parts[1:])
+        with self._repo(patient_id) as repo:
+            if version is None:
+                full_path = os.path.join(repo.working_tree_dir, rel_path)
+                if not os.path.isfile(full_path):
+                    raise FileNotFoundError(f"{relative_path} does not exist")
+                # _stage updates the index with every file it writes, so its entry
+                # names the working tree content without hashing the file again
+                entry = repo.index.entries.get((rel_path.replace(os.sep, '/'), 0))
+                if entry is not None:
+                    return entry.hexsha
+                try:
+                    return repo.git.hash_object(full_path)
+                except Exception:
+                    raise FileNotFoundError(f"{relative_path} does not exist")
+            cwd = repo.working_tree_dir
+        info = self._object_info(cwd, f"{version}:{rel_path.replace(os.sep, '/')}")
+        if info is None or info[1] != 'blob':
+            raise FileNotFoundError(f"{relative_path} does not exist at {version}")
+        return info[0]
+
+    def diff(self, relative_path: str, a: str, b: str, stat_only: bool = False) -> Dict:
+        """Diff the file between commits a and b with git's object-level diff,
+        which compares the blobs in the two trees without checking anything out.
+        ``stat_only`` runs ``--numstat`` alone and skips producing the patch.
+        Versions stored as BlobStore pointers are diffed in Python instead."""
+        parts = relative_path.split(os.sep)
+        if len(parts) < 2:
+            raise ValueError("relative_path must start with '<patient_id>/...'")
+        patient_id = parts[0]
+        path = '/'.join(parts[1:])
+        if os.path.isdir(self._blobs.root) and any(self._is_pointer(relative_path, v) for v in (a, b)):
+            return python_diff(self, relative_path, a, b, stat_only=stat_only)
+        with self._repo(patient_id) as repo:
+            try:
+                numstat = repo.git.diff('--numstat', '--no-renames', a, b, '--', path)
+                text = '' if stat_only else repo.git.diff('--no-color', '--no-ext-diff', '--no-renames', a, b, '--', path)
+            except GitCommandError:
+                raise FileNotFoundError(f"cannot diff {relative_path} between {a} and {b}")
+        added = deleted = 0
+        binary = False
+        for line in numstat.splitlines():
+            adds, dels, _name = line.split('\t', 2)
+            if adds == '-':
+                binary = True
+            else:
+                added += int(adds)
+                deleted += int(dels)
+        if binary:
+            return make_result(binary=True)
+        lines = text.splitlines()
+        return make_result(hunks=parse_hunks(lines), text=text, additions=added, deletions=deleted)
+
+    def _is_pointer(self, relative_path: str, version: str) -> bool:
+        parts = relative_path.split(os.sep)
+        rel_path = os.path.join(*parts[1:])
+        with self._repo(parts[0]) as repo:
+            cwd = repo.working_tree_dir
+        info = self._object_info(cwd, f"{version}:{rel_path.replace(os.sep, '/')}")
+        if info is None or info[1] != 'blob' or info[2] > POINTER_MAX_SIZE:
+            return False
+        return self._pointer(self._read_blob(cwd, relative_path, rel_path, version)) is not None
 
     def history(self, relative_path: str) -> List[Dict]:
         parts = relative_path.split(os.sep)
         if len(parts) < 2:
             raise ValueError("relative_path must start with '<patient_id>/...'")
         patient_id = parts[0]
-        repo = self._ensure_repo(patient_id)
         rel_path = os.path.join(*parts[1:])
-        # Use --all to avoid relying on a valid HEAD symbolic ref which
-        # can be inconsistent in some environments (refs/heads/main vs master).
-        try:
-            commits = list(repo.iter_commits(rev='--all', paths=rel_path))
-        except Exception:
-            commits = list(repo.iter_commits(paths=rel_path))
-        # chronological (oldest first)
-        commits.reverse()
-        result = []
-        for c in commits:
-            result.append({
-                'hexsha': c.hexsha,
-                'author': str(c.author),
-                'message': c.message.strip(),
-                'datetime': c.committed_datetime.isoformat(),
-            })
-        return result
+        with self._repo(patient_id) as repo:
+            index = HistoryIndex(repo.git_dir)
+            head = _head_sha(repo)
+            if head is None:
+                return []
+            if index.indexed_head() == head:
+                # chronological (oldest first)
+                return index.read(rel_path)
+        # stale: rebuild under the write lock, taken before the read lock as writers do
+        with self._writing(patient_id), self._repo(patient_id) as repo:
+            index = HistoryIndex(repo.git_dir)
+            if index.indexed_head() != _head_sha(repo):
+                index.rebuild(repo)
+            return index.read(rel_path)
 
     def head(self, relative_path: str) -> Optional[str]:
         parts = relative_path.split(os.sep)
         if len(parts) < 2:
             raise ValueError("relative_path must start with '<patient_id>/...'")
         patient_id = parts[0]
-        repo = self._ensure_repo(patient_id)
-        try:
-            return repo.head.commit.hexsha
-        except Exception:
-            return None
+        with self._repo(patient_id) as repo:
+            return _head_sha(repo)
+
+    def list_files(self, patient_id: str, version: Optional[str] = None) -> List[str]:
+        with self._repo(patient_id) as repo:
+            version = version or _head_sha(repo)
+            if version is None:
+                return []
+            try:
+                out = repo.git.ls_tree('-r', '-z', '--name-only', version)
+            except GitCommandError:
+                raise FileNotFoundError(f"{patient_id} has no version {version}")
+        return sorted(os.path.join(patient_id, *name.split('/')) for name in out.split('\0') if name)
+
+    def file_versions(self, patient_id: str, version: Optional[str] = None) -> List[Dict]:
+        """One ``git log`` over the commits up to ``version``; cheaper than calling
+        history() for each file when every version is wanted (e.g. for an export)."""
+        with self._repo(patient_id) as repo:
+            version = version or _head_sha(repo)
+            if version is None:
+                return []
+            try:
+                out = repo.git.execute(['git', '-c', 'core.quotePath=false', 'log', '--reverse', '--no-renames',
+                                        '--diff-filter=d', '--name-only', '--format=%x1e%H%x1f%cI%x1f', version])
+            except GitCommandError:
+                raise FileNotFoundError(f"{patient_id} has no version {version}")
+        result = []
+        for record in out.split('\x1e')[1:]:
+            hexsha, date, names = record.split('\x1f')
+            for name in names.split('\n'):
+                name = name.strip()
+                if name:
+                    result.append({'path': os.path.join(patient_id, *name.split('/')),
+                                   'hexsha': hexsha, 'datetime': date})
+        return result
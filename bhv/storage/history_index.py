@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from git import Repo
+from git.refs.symbolic import SymbolicReference
+
+
+class HistoryIndex:
+    """Append-only per-path commit index stored inside a repo's ``.git`` dir.
+
+    Layout: ``.git/bhv-history/<sha1 of path>.jsonl`` holds one JSON line per
+    commit touching the path (oldest first), and ``.git/bhv-history/HEAD``
+    records the last commit the index covers. ``GitAdapter`` appends to it
+    under the patient lock on every commit, so ``history()`` reads a single
+    small file instead of walking the commit graph.
+    """
+
+    DIRNAME = 'bhv-history'
+
+    def __init__(self, git_dir: str):
+        self.path = os.path.join(git_dir, self.DIRNAME)
+
+    @staticmethod
+    def _key(rel_path: str) -> str:
+        return rel_path.replace(os.sep, '/')
+
+    def _file(self, rel_path: str) -> str:
+        name = hashlib.sha1(self._key(rel_path).encode('utf-8')).hexdigest()
+        return os.path.join(self.path, name + '.jsonl')
+
+    def indexed_head(self) -> Optional[str]:
+        try:
+            with open(os.path.join(self.path, 'HEAD'), 'r', encoding='ascii') as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def read(self, rel_path: str) -> List[Dict]:
+        result = []
+        try:
+            with open(self._file(rel_path), 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        result.append(json.loads(line))
+                    except ValueError:
+                        # a line being appended concurrently
+                        continue
+        except FileNotFoundError:
+            pass
+        return result
+
+    def append(self, hexsha: str, changes: Iterable[Tuple[str, Optional[str]]], author: str, message: str, datetime: str) -> None:
+        """Record a commit for each (rel_path, sha256) it changed. The SHA-256 of the
+        content is only known for commits made through GitAdapter, so rebuilt
+        entries do not carry it."""
+        os.makedirs(self.path, exist_ok=True)
+        for rel, sha256 in dict(changes).items():
+            entry = {'hexsha': hexsha, 'author': author, 'message': message, 'datetime': datetime}
+            if sha256:
+                entry['sha256'] = sha256
+            with open(self._file(rel), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+        self._write_head(self.path, hexsha)
+
+    def rebuild(self, repo: Repo) -> int:
+        """Re-create the index from the full commit graph; returns the number of commits indexed."""
+        parent = os.path.dirname(self.path)
+        staging = tempfile.mkdtemp(prefix=self.DIRNAME + '-', dir=parent)
+        count = 0
+        try:
+            head = None
+            try:
+                # from the ref files, without GitPython's shared object database
+                head = SymbolicReference.dereference_recursive(repo, 'HEAD')
+            except Exception:
+                pass
+            if head is not None:
+                out = repo.git.execute(['git', '-c', 'core.quotePath=false', 'log', '--all', '--reverse',
+                                        '--date-order', '--name-only', '--format=%x1e%H%x1f%an%x1f%cI%x1f%B%x1f'])
+                files = {}
+                for record in out.split('\x1e')[1:]:
+                    hexsha, author, date, body, names = record.split('\x1f')
+                    line = json.dumps({'hexsha': hexsha, 'author': author, 'message': body.strip(), 'datetime': date}) + '\n'
+                    for name in names.split('\n'):
+                        name = name.strip()
+                        if not name:
+                            continue
+                        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+                        files.setdefault(digest, []).append(line)
+                    count += 1
+                for digest, lines in files.items():
+                    with open(os.path.join(staging, digest + '.jsonl'), 'w', encoding='utf-8') as f:
+                        f.writelines(lines)
+                self._write_head(staging, head)
+            self._swap_in(staging)
+        except Exception:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return count
+
+    def _swap_in(self, staging: str) -> None:
+        # Readers never see a missing file: each one is replaced atomically,
+        # HEAD last, and only then are files of paths no longer in the graph
+        # removed. Callers hold the patient write lock, so nothing appends meanwhile.
+        try:
+            os.rename(staging, self.path)
+            return
+        except OSError:
+            pass  # an index exists
+        names = set(os.listdir(staging))
+        for name in sorted(names - {'HEAD'}):
+            os.replace(os.path.join(staging, name), os.path.join(self.path, name))
+        if 'HEAD' in names:
+            os.replace(os.path.join(staging, 'HEAD'), os.path.join(self.path, 'HEAD'))
+        for name in os.listdir(self.path):
+            if name not in names:
+                os.remove(os.path.join(self.path, name))
+        os.rmdir(staging)
+
+    @staticmethod
+    def _write_head(directory: str, hexsha: str) -> None:
+        tmp = os.path.join(directory, 'HEAD.tmp')
+        with open(tmp, 'w', encoding='ascii') as f:
+            f.write(hexsha + '\n')
+        os.replace(tmp, os.path.join(directory, 'HEAD'))
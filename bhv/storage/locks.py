@@ -0,0 +1,202 @@
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: locks are process-local only
+    fcntl = None
+
+
+class RWLock:
+    """Writer-preferring readers/writer lock.
+
+    A thread that already holds a read lock may take it again without
+    waiting, so nested reads cannot deadlock behind a queued writer. Read
+    locks must be released by the thread that took them.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers: Dict[int, int] = {}  # thread ident -> hold count
+        self._writer = False
+        self._waiting_writers = 0
+
+    def acquire_read(self) -> None:
+        me = threading.get_ident()
+        with self._cond:
+            if me not in self._readers:
+                while self._writer or self._waiting_writers:
+                    self._cond.wait()
+            self._readers[me] = self._readers.get(me, 0) + 1
+
+    def release_read(self) -> None:
+        me = threading.get_ident()
+        with self._cond:
+            count = self._readers[me] - 1
+            if count:
+                self._readers[me] = count
+            else:
+                del self._readers[me]
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def acquire_write(self) -> None:
+        with self._cond:
+            self._waiting_writers += 1
+            try:
+                while self._writer or self._readers:
+                    self._cond.wait()
+            finally:
+                self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self) -> None:
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class _Entry:
+    __slots__ = ('writer', 'rw', 'refs')
+
+    def __init__(self):
+        self.writer = threading.Lock()  # serialises commits to one repo
+        self.rw = RWLock()  # readers vs. structural changes (moving the repo)
+        self.refs = 0
+
+
+class Held:
+    """A lock taken with :meth:`LockManager.acquire`; call ``release()`` once."""
+
+    def __init__(self, manager: 'LockManager', key: str, entry: _Entry, undo: List[Callable[[], None]]):
+        self._manager = manager
+        self._key = key
+        self._entry = entry
+        self._undo = undo
+
+    def release(self) -> None:
+        undo, self._undo = self._undo, []
+        for step in reversed(undo):
+            step()
+        self._manager._checkin(self._key, self._entry)
+
+
+class LockManager:
+    """Per-key (patient) locks for GitAdapter, created race-free and reclaimed when unused.
+
+    Three modes:
+
+    - ``READ``: held while a repo is being read; never waits for commits.
+      It does not make a shared ``git.Repo`` safe to use from several
+      threads: GitAdapter guards the Repo's object database separately.
+    - ``WRITE``: a READ plus a mutex that serialises commits (and
+      history-index rebuilds) to one repo.
+    - ``EXCLUSIVE``: excludes readers and writers, for moving a repo.
+
+    Locks are released by the thread that acquired them (batches are
+    committed by the thread that began them).
+
+    Entries are reference counted and dropped as soon as nobody holds or
+    waits for them, so memory does not grow with every patient ever seen.
+    With ``lock_dir`` set (and ``fcntl`` available) each mode is mirrored by
+    a ``flock`` on files under ``lock_dir``, so several worker processes
+    sharing one uploads tree exclude each other the same way threads do.
+    Lock files are sharded like the repos and are never deleted, since
+    removing a file another process is about to lock is racy.
+    """
+
+    READ = 'read'
+    WRITE = 'write'
+    EXCLUSIVE = 'exclusive'
+
+    def __init__(self, lock_dir: Optional[str] = None):
+        self.lock_dir = lock_dir if fcntl is not None else None
+        self._entries: Dict[str, _Entry] = {}
+        self._mutex = threading.Lock()
+
+    def __len__(self) -> int:
+        with self._mutex:
+            return len(self._entries)
+
+    def acquire(self, key: str, mode: str = WRITE) -> Held:
+        """Take ``key`` in ``mode`` until the returned handle is released."""
+        if mode not in (self.READ, self.WRITE, self.EXCLUSIVE):
+            raise ValueError(f"unknown lock mode {mode!r}")
+        entry = self._checkout(key)
+        undo: List[Callable[[], None]] = []
+        try:
+            # every writer is also a reader, so EXCLUSIVE (which drains readers
+            # first) never waits on a writer that is itself waiting to read
+            if mode == self.EXCLUSIVE:
+                entry.rw.acquire_write()
+                undo.append(entry.rw.release_write)
+                self._flock(key, 'rw', False, undo)
+            else:
+                entry.rw.acquire_read()
+                undo.append(entry.rw.release_read)
+                self._flock(key, 'rw', True, undo)
+            if mode != self.READ:
+                entry.writer.acquire()
+                undo.append(entry.writer.release)
+                self._flock(key, 'lock', False, undo)
+        except BaseException:
+            for step in reversed(undo):
+                step()
+            self._checkin(key, entry)
+            raise
+        return Held(self, key, entry, undo)
+
+    @contextmanager
+    def read(self, key: str):
+        held = self.acquire(key, self.READ)
+        try:
+            yield
+        finally:
+            held.release()
+
+    @contextmanager
+    def write(self, key: str):
+        held = self.acquire(key, self.WRITE)
+        try:
+            yield
+        finally:
+            held.release()
+
+    @contextmanager
+    def exclusive(self, key: str):
+        held = self.acquire(key, self.EXCLUSIVE)
+        try:
+            yield
+        finally:
+            held.release()
+
+    def _checkout(self, key: str) -> _Entry:
+        with self._mutex:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = _Entry()
+            entry.refs += 1
+            return entry
+
+    def _checkin(self, key: str, entry: _Entry) -> None:
+        with self._mutex:
+            entry.refs -= 1
+            if entry.refs == 0 and self._entries.get(key) is entry:
+                del self._entries[key]
+
+    def _flock(self, key: str, suffix: str, shared: bool, undo: List[Callable[[], None]]) -> None:
+        if self.lock_dir is None:
+            return
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        directory = os.path.join(self.lock_dir, digest[:2])
+        os.makedirs(directory, exist_ok=True)
+        fd = os.open(os.path.join(directory, f'{digest}.{suffix}'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        except BaseException:
+            os.close(fd)
+            raise
+        undo.append(lambda: os.close(fd))  # closing drops the flock
@@ -0,0 +1,165 @@
+import os
+import shutil
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+
+class MaintenanceScheduler:
+    """Repacks patient repositories off the request path.
+
+    ``GitAdapter`` reports every commit through :meth:`record_write`. Once a
+    repo has ``write_threshold`` unmaintained commits, and was last maintained
+    more than ``min_interval`` seconds ago, the background thread runs the
+    ``STEPS`` on it: a full repack with a reachability bitmap, a commit-graph
+    with changed-path Bloom filters (which ``git log -- <path>`` uses), and a
+    prune of loose objects older than ``prune_expire``.
+
+    To keep web workers responsive, repos are maintained one at a time with
+    ``pause`` seconds between them, at lowered CPU priority (``niceness``).
+    A lock file in the git dir stops two processes maintaining one repo at
+    once. Write counts live in memory only; ``scripts/maintain_repos.py``
+    maintains every repo regardless of counts.
+    """
+
+    STEPS = (
+        ('repack', ['git', 'repack', '-a', '-d', '-q', '--write-bitmap-index']),
+        ('commit-graph', ['git', 'commit-graph', 'write', '--reachable', '--changed-paths']),
+        ('prune', ['git', 'prune', '--expire={prune_expire}']),
+    )
+    LOCK_NAME = 'bhv-maintenance.lock'
+
+    def __init__(self, repo_path: Callable[[str], str], write_threshold: int = 200, min_interval: float = 3600.0,
+                 pause: float = 5.0, poll_interval: float = 30.0, prune_expire: str = '2.weeks.ago',
+                 niceness: int = 10, step_timeout: float = 600.0):
+        self.repo_path = repo_path
+        self.write_threshold = write_threshold
+        self.min_interval = min_interval
+        self.pause = pause
+        self.poll_interval = poll_interval
+        self.prune_expire = prune_expire
+        self.niceness = niceness
+        self._nice = ['nice', '-n', str(niceness)] if niceness and shutil.which('nice') else []
+        self.step_timeout = step_timeout
+        self._writes: Dict[str, int] = {}
+        self._last_run: Dict[str, float] = {}
+        self._mutex = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.runs = 0
+        self.failures = 0
+        self.last_run_seconds = 0.0
+
+    def record_write(self, patient_id: str, count: int = 1) -> None:
+        with self._mutex:
+            self._writes[patient_id] = self._writes.get(patient_id, 0) + count
+
+    def due(self) -> List[str]:
+        """Patients whose repos need maintenance, most written first."""
+        now = time.monotonic()
+        with self._mutex:
+            ready = [pid for pid, writes in self._writes.items()
+                     if writes >= self.write_threshold
+                     and now - self._last_run.get(pid, float('-inf')) >= self.min_interval]
+            return sorted(ready, key=lambda pid: -self._writes[pid])
+
+    def run(self, patient_id: str) -> bool:
+        """Maintain one repo now. Returns False if it is missing, another
+        process is maintaining it, or a step failed."""
+        path = self.repo_path(patient_id)
+        git_dir = os.path.join(path, '.git')
+        if not os.path.isdir(git_dir):
+            return False
+        lock = os.path.join(git_dir, self.LOCK_NAME)
+        if not self._take_lock(lock):
+            return False
+        with self._mutex:
+            pending = self._writes.pop(patient_id, 0)
+            self._last_run[patient_id] = time.monotonic()
+        started = time.monotonic()
+        ok = True
+        try:
+            for _name, cmd in self.STEPS:
+                cmd = self._nice + [arg.format(prune_expire=self.prune_expire) for arg in cmd]
+                try:
+                    result = subprocess.run(cmd, cwd=path, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                            timeout=self.step_timeout)
+                    ok = ok and result.returncode == 0
+                except (OSError, subprocess.TimeoutExpired):
+                    ok = False
+        finally:
+            try:
+                os.remove(lock)
+            except OSError:
+                pass
+        with self._mutex:
+            self.runs += 1
+            self.last_run_seconds = time.monotonic() - started
+            if not ok:
+                self.failures += 1
+                # try again after min_interval
+                self._writes[patient_id] = self._writes.get(patient_id, 0) + pending
+        return ok
+
+    def run_pending(self, limit: Optional[int] = None) -> int:
+        """Maintain due repos one after another; returns how many were run."""
+        done = 0
+        for patient_id in self.due()[:limit]:
+            if self._stop.is_set():
+                break
+            if done:
+                self._stop.wait(self.pause)
+            self.run(patient_id)
+            done += 1
+        return done
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._loop, name='bhv-repo-maintenance', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def stats(self) -> Dict[str, float]:
+        with self._mutex:
+            return {
+                'tracked_repos': len(self._writes),
+                'pending_writes': sum(self._writes.values()),
+                'runs': self.runs,
+                'failures': self.failures,
+                'last_run_seconds': self.last_run_seconds,
+            }
+
+    def _loop(self) -> None:
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.run_pending()
+            except Exception as e:
+                print('Repository maintenance failed:', e)
+
+    def _take_lock(self, lock: str) -> bool:
+        try:
+            fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            # left behind by a crashed process?
+            try:
+                stale = time.time() - os.path.getmtime(lock) > self.step_timeout * len(self.STEPS)
+            except OSError:
+                stale = True
+            if not stale:
+                return False
+            try:
+                os.remove(lock)
+                fd = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError:
+                return False
+        os.write(fd, str(os.getpid()).encode('ascii'))
+        os.close(fd)
+        return True
@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict
+
+from git import Repo
+
+
+class _Entry:
+    __slots__ = ('repo', 'last_used', 'pins', 'evicted')
+
+    def __init__(self, repo: Repo):
+        self.repo = repo
+        self.last_used = time.monotonic()
+        self.pins = 0
+        self.evicted = False
+
+
+class RepoCache:
+    """Bounded LRU cache of open ``git.Repo`` handles keyed by patient id.
+
+    Handles are evicted when the cache grows past ``capacity`` or when they
+    have not been used for ``idle_timeout`` seconds. Evicted handles are
+    closed explicitly (``Repo.close()``) so their git subprocesses and file
+    handles are released. A handle that is checked out by a caller is never
+    closed underneath it; it is closed when the last caller releases it.
+    """
+
+    def __init__(self, capacity: int = 128, idle_timeout: float = 300.0):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.idle_timeout = idle_timeout
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # id(repo) -> entry, for every handle that is cached or still checked out
+        self._live: Dict[int, _Entry] = {}
+        self._mutex = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def acquire(self, key: str, factory: Callable[[], Repo]) -> Repo:
+        """Return the cached Repo for ``key`` (creating it with ``factory``) and pin it."""
+        to_close = []
+        with self._mutex:
+            to_close.extend(self._expire_idle())
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            else:
+                self.misses += 1
+                entry = _Entry(factory())
+                self._entries[key] = entry
+                self._live[id(entry.repo)] = entry
+                to_close.extend(self._evict_overflow())
+            entry.pins += 1
+            entry.last_used = time.monotonic()
+            repo = entry.repo
+        self._close_all(to_close)
+        return repo
+
+    def release(self, repo: Repo) -> None:
+        """Unpin a Repo previously returned by :meth:`acquire`."""
+        with self._mutex:
+            entry = self._live.get(id(repo))
+            if entry is None:
+                return
+            entry.pins -= 1
+            entry.last_used = time.monotonic()
+            close = entry.evicted and entry.pins == 0
+            if close:
+                del self._live[id(repo)]
+        if close:
+            self._close_all([repo])
+
+    def invalidate(self, key: str) -> None:
+        """Drop ``key`` from the cache, closing its handle once it is unpinned."""
+        with self._mutex:
+            entry = self._entries.pop(key, None)
+            to_close = self._retire(entry) if entry is not None else []
+        self._close_all(to_close)
+
+    def clear(self) -> None:
+        with self._mutex:
+            to_close = []
+            while self._entries:
+                _, entry = self._entries.popitem(last=False)
+                to_close.extend(self._retire(entry))
+        self._close_all(to_close)
+
+    def stats(self) -> Dict[str, int]:
+        with self._mutex:
+            return {
+                'size': len(self._entries),
+                'capacity': self.capacity,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    # -- internals (call with self._mutex held) --------------------------------
+
+    def _retire(self, entry: _Entry) -> list:
+        entry.evicted = True
+        self.evictions += 1
+        if entry.pins:
+            # closed by the last release()
+            return []
+        del self._live[id(entry.repo)]
+        return [entry.repo]
+
+    def _expire_idle(self) -> list:
+        if not self.idle_timeout:
+            return []
+        deadline = time.monotonic() - self.idle_timeout
+        to_close = []
+        for key in list(self._entries):
+            entry = self._entries[key]
+            if entry.pins == 0 and entry.last_used <= deadline:
+                del self._entries[key]
+                to_close.extend(self._retire(entry))
+        return to_close
+
+    def _evict_overflow(self) -> list:
+        to_close = []
+        for key in list(self._entries):
+            if len(self._entries) <= self.capacity:
+                break
+            entry = self._entries[key]
+            if entry.pins:
+                continue
+            del self._entries[key]
+            to_close.extend(self._retire(entry))
+        return to_close
+
+    @staticmethod
+    def _close_all(repos) -> None:
+        for repo in repos:
+            try:
+                repo.close()
+            except Exception:
+                pass
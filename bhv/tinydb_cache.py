@@ -0,0 +1,171 @@
+"""Write-behind caching for the TinyDB backend.
+
+TinyDB's default JSONStorage rewrites the whole document on every insert or
+update. ``WriteBehindMiddleware`` keeps the tables in memory and flushes them
+to disk from a background thread when ``flush_interval`` seconds have passed
+or ``flush_writes`` writes are pending, and on shutdown. Flushes go through
+``AtomicJSONStorage`` (temp file + rename), so a crash loses at most the
+unflushed writes and never leaves a truncated db.json behind.
+
+The cache belongs to one process: several processes would each flush their
+own copy and overwrite each other's writes. The middleware refuses to start
+when ``WEB_CONCURRENCY`` or gunicorn's ``--workers`` asks for more than one
+worker process; run a single worker with threads instead, or use SQLite.
+"""
+import atexit
+import json
+import os
+import shlex
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+from tinydb.middlewares import Middleware
+from tinydb.storages import Storage
+
+
+class AtomicJSONStorage(Storage):
+    """JSON file storage that replaces the file atomically on every write."""
+
+    def __init__(self, path: str, **kwargs):
+        self.path = path
+        self.kwargs = kwargs
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def read(self) -> Optional[Dict]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        except FileNotFoundError:
+            return None
+        return json.loads(content) if content.strip() else None
+
+    def write(self, data: Dict) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp = tempfile.mkstemp(prefix='.db-', suffix='.json', dir=directory)
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(data, f, **self.kwargs)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+
+    def close(self) -> None:
+        pass
+
+
+def configured_workers(environ=os.environ) -> int:
+    """Worker processes requested through WEB_CONCURRENCY or GUNICORN_CMD_ARGS (1 if neither says)."""
+    workers = int(environ.get('WEB_CONCURRENCY') or 1)
+    args = shlex.split(environ.get('GUNICORN_CMD_ARGS', ''))
+    for i, arg in enumerate(args):
+        if arg in ('-w', '--workers') and i + 1 < len(args):
+            workers = int(args[i + 1])
+        elif arg.startswith('--workers='):
+            workers = int(arg.split('=', 1)[1])
+        elif arg.startswith('-w') and arg[2:].isdigit():
+            workers = int(arg[2:])
+    return workers
+
+
+class WriteBehindMiddleware(Middleware):
+    """Keep TinyDB tables in memory and flush them in the background.
+
+    ``lock`` must be held by callers around every TinyDB operation (bhv.db
+    does this); the flusher takes the same lock while it snapshots the
+    tables so it never serialises a half-applied update.
+
+    Raises RuntimeError if more than one worker process is configured (see
+    the module docstring).
+    """
+
+    def __init__(self, storage_cls=AtomicJSONStorage, flush_interval: float = 1.0, flush_writes: int = 100,
+                 lock: Optional[threading.RLock] = None):
+        workers = configured_workers()
+        if workers > 1:
+            raise RuntimeError(f"TinyDB write-behind keeps db.json in one process's memory, but {workers} "
+                               f"worker processes are configured; unset BHV_TINYDB_WRITE_BEHIND or run one worker")
+        super().__init__(storage_cls)
+        self.flush_interval = flush_interval
+        self.flush_writes = flush_writes
+        self.lock = lock or threading.RLock()
+        self.cache = None
+        self._flush_lock = threading.Lock()  # keeps snapshots reaching disk in order
+        self.pending_writes = 0
+        self.flushes = 0
+        self.last_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def __call__(self, *args, **kwargs):
+        super().__call__(*args, **kwargs)
+        self._thread = threading.Thread(target=self._run, name='tinydb-write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+        return self
+
+    def read(self):
+        with self.lock:
+            if self.cache is None:
+                self.cache = self.storage.read()
+            return self.cache
+
+    def write(self, data):
+        with self.lock:
+            self.cache = data
+            self.pending_writes += 1
+            if self.pending_writes >= self.flush_writes:
+                self._wake.set()
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self.lock:
+                if not self.pending_writes:
+                    return
+                # snapshot under the lock; the disk write happens outside it
+                snapshot = json.dumps(self.cache)
+                flushed = self.pending_writes
+            started = time.monotonic()
+            self.storage.write(json.loads(snapshot))
+            elapsed = time.monotonic() - started
+            with self.lock:
+                self.pending_writes -= flushed
+                self.flushes += 1
+                self.last_flush_seconds = elapsed
+                self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            return {
+                'pending_writes': self.pending_writes,
+                'flushes': self.flushes,
+                'last_flush_seconds': self.last_flush_seconds,
+                'max_flush_seconds': self.max_flush_seconds,
+            }
+
+    def close(self) -> None:
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=max(self.flush_interval, 1.0) * 5)
+        self.flush()
+        self.storage.close()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                # keep the data cached and retry on the next tick
+                print('TinyDB write-behind flush failed:', e)
@@ -2,7 +2,8 @@
 
 Usage: python run.py
 
-It picks up `MONGO_URI` environment variable to use MongoDB; otherwise uses TinyDB.
+It picks up `MONGO_URI` environment variable to use MongoDB; otherwise uses the
+embedded SQLite database (or TinyDB with `BHV_DB_BACKEND=tinydb`).
 """
 import os
 from dotenv import load_dotenv
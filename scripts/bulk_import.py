@@ -0,0 +1,54 @@
+"""Import an existing archive of patient files into the vault.
+
+Usage: python scripts/bulk_import.py SOURCE [--root UPLOAD_FOLDER] [--jobs 4] [--batch-size 0] [--journal PATH]
+
+SOURCE is either a manifest (.csv with a header row, or .jsonl) with the
+columns patient_id, path, narrative and timestamp, or a directory laid out
+as SOURCE/<patient_id>/<files>, with optional <file>.narrative.txt sidecars.
+Each patient's files go into their repo as one commit per --batch-size files
+(0: one commit per patient), patients in parallel over --jobs processes,
+and their entries are bulk-inserted into the configured database.
+
+Progress is journalled (by default under ROOT/.imports/); if the import is
+interrupted, run the same command again and finished batches are skipped.
+Run it with the same BHV_SHARD_* / BHV_DEDUP_BLOBS settings as the app.
+"""
+import argparse
+import hashlib
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bhv import db
+from bhv.importer import read_manifest, run_import, scan_tree
+
+
+def main():
+    default_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('source', help='manifest file (.csv/.jsonl) or directory of <patient_id>/ folders')
+    parser.add_argument('--root', default=default_root, help='storage root containing patient repositories')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='worker processes committing to git')
+    parser.add_argument('--batch-size', type=int, default=0, help='files per commit (0: one commit per patient)')
+    parser.add_argument('--journal', help='progress journal (default: ROOT/.imports/<source hash>.jsonl)')
+    args = parser.parse_args()
+
+    source = os.path.abspath(args.source)
+    journal = args.journal or os.path.join(
+        args.root, '.imports', hashlib.sha1(source.encode('utf-8')).hexdigest()[:12] + '.jsonl')
+    items = scan_tree(source) if os.path.isdir(source) else read_manifest(source)
+    adapter_options = {
+        'dedup': os.environ.get('BHV_DEDUP_BLOBS', '0') == '1',
+        'shard_levels': int(os.environ.get('BHV_SHARD_LEVELS', 0)),
+        'shard_width': int(os.environ.get('BHV_SHARD_WIDTH', 2)),
+    }
+    db.init_db()
+    counts = run_import(items, args.root, journal, workers=args.jobs, batch_size=args.batch_size,
+                        adapter_options=adapter_options)
+    print(f"{counts['patients']} patients: {counts['files']} files committed and "
+          f"{counts['entries']} entries created (journal: {journal})")
+
+
+if __name__ == '__main__':
+    main()
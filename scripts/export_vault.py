@@ -0,0 +1,60 @@
+"""Export patient vaults as zip or tar archives, e.g. for backups or records requests.
+
+Usage: python scripts/export_vault.py (PATIENT_ID ... | --all) [--root UPLOAD_FOLDER] [--out DIR]
+       [--format zip|tar|tar.gz] [--history] [--metadata] [--jobs N]
+
+Writes one archive per patient to DIR/<patient_id>.<format>, patients in
+parallel over --jobs processes. Each archive holds the current files, with
+--history every stored version, and with --metadata the patient's database
+entries as entries.jsonl. Archives are streamed straight to their file
+(through a .tmp name, so an interrupted export leaves no truncated archive).
+Run it with the same BHV_SHARD_* / BHV_DEDUP_BLOBS settings as the app.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bhv.export import FORMATS, entry_records, export_all
+from bhv.storage.git_adapter import GitAdapter
+
+
+def main():
+    default_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('patients', nargs='*', help='patient ids to export')
+    parser.add_argument('--all', action='store_true', help='export every patient with a repository')
+    parser.add_argument('--root', default=default_root, help='storage root containing patient repositories')
+    parser.add_argument('--out', default='export', help='directory to write the archives to')
+    parser.add_argument('--format', choices=sorted(FORMATS), default='zip', help='archive format')
+    parser.add_argument('--history', action='store_true', help='include every stored version of each file')
+    parser.add_argument('--metadata', action='store_true', help='include database entries as entries.jsonl')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='worker processes')
+    args = parser.parse_args()
+    if bool(args.patients) == args.all:
+        parser.error('give patient ids or --all')
+
+    adapter_options = {
+        'dedup': os.environ.get('BHV_DEDUP_BLOBS', '0') == '1',
+        'shard_levels': int(os.environ.get('BHV_SHARD_LEVELS', 0)),
+        'shard_width': int(os.environ.get('BHV_SHARD_WIDTH', 2)),
+    }
+    patients = args.patients
+    if args.all:
+        adapter = GitAdapter(args.root, **adapter_options)
+        patients = sorted(adapter.patients())
+        adapter.close()
+    entries = None
+    if args.metadata:
+        # read here so the workers never open the database
+        from bhv import db
+        db.init_db()
+        entries = {pid: entry_records(db.list_entries_for_patient(pid)) for pid in patients}
+    paths = export_all(args.root, args.out, patients, fmt=args.format, history=args.history, entries=entries,
+                       workers=args.jobs, adapter_options=adapter_options)
+    print(f"{len(paths)} archives written to {os.path.abspath(args.out)}")
+
+
+if __name__ == '__main__':
+    main()
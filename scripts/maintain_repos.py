@@ -0,0 +1,46 @@
+"""Repack, write commit-graphs and prune patient repositories now.
+
+Usage: python scripts/maintain_repos.py [--root UPLOAD_FOLDER] [--pause SECONDS] [patient_id ...]
+
+The web app only maintains repos it has written to since it started (see
+BHV_MAINTENANCE); run this from cron, e.g. nightly, to cover every repo.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bhv.storage.git_adapter import GitAdapter
+from bhv.storage.maintenance import MaintenanceScheduler
+
+
+def main():
+    default_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--root', default=default_root, help='storage root containing patient repositories')
+    parser.add_argument('--shard-levels', type=int, default=int(os.environ.get('BHV_SHARD_LEVELS', 0)),
+                        help='fan-out directory levels of the storage layout (default: $BHV_SHARD_LEVELS or 0)')
+    parser.add_argument('--pause', type=float, default=1.0, help='seconds to wait between repositories')
+    parser.add_argument('--prune-expire', default='2.weeks.ago', help='only prune loose objects older than this')
+    parser.add_argument('patients', nargs='*', help='patient ids to maintain (default: all)')
+    args = parser.parse_args()
+
+    adapter = GitAdapter(args.root, shard_levels=args.shard_levels,
+                         shard_width=int(os.environ.get('BHV_SHARD_WIDTH', 2)))
+    scheduler = MaintenanceScheduler(adapter.repo_path, prune_expire=args.prune_expire)
+    failed = 0
+    for i, pid in enumerate(args.patients or adapter.patients()):
+        if i:
+            time.sleep(args.pause)
+        started = time.monotonic()
+        ok = scheduler.run(pid)
+        failed += not ok
+        print(f"{pid}: {'ok' if ok else 'FAILED or locked'} ({time.monotonic() - started:.1f}s)")
+    adapter.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+"""Copy users and entries from the TinyDB store (data/db.json) into SQLite.
+
+Usage: python scripts/migrate_tinydb_to_sqlite.py [path/to/db.json]
+
+The SQLite backend already imports data/db.json once on first start; use
+this to import another file or to re-run the import (existing rows are
+skipped). The target is BHV_SQLITE_PATH (default data/bhv.sqlite3).
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+os.environ.pop('MONGO_URI', None)
+os.environ['BHV_DB_BACKEND'] = 'sqlite'
+
+from bhv import db
+
+
+def main():
+    source = sys.argv[1] if len(sys.argv) > 1 else db.TINYDB_PATH
+    db.init_db()
+    counts = db.migrate_from_tinydb(source)
+    print(f"Imported {counts['users']} users and {counts['entries']} entries from {source} into {db.DB_PATH}")
+
+
+if __name__ == '__main__':
+    main()
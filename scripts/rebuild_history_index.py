@@ -0,0 +1,35 @@
+"""Rebuild the per-file history index of existing patient repositories.
+
+Usage: python scripts/rebuild_history_index.py [--root UPLOAD_FOLDER] [patient_id ...]
+
+Repositories created before the index existed are indexed lazily on their
+first history view; run this once after upgrading to do it up front.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bhv.storage.git_adapter import GitAdapter
+
+
+def main():
+    default_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--root', default=default_root, help='storage root containing patient repositories')
+    parser.add_argument('--shard-levels', type=int, default=int(os.environ.get('BHV_SHARD_LEVELS', 0)),
+                        help='fan-out directory levels of the storage layout (default: $BHV_SHARD_LEVELS or 0)')
+    parser.add_argument('patients', nargs='*', help='patient ids to rebuild (default: all)')
+    args = parser.parse_args()
+
+    adapter = GitAdapter(args.root, shard_levels=args.shard_levels,
+                         shard_width=int(os.environ.get('BHV_SHARD_WIDTH', 2)))
+    for pid in args.patients or adapter.patients():
+        counts = adapter.rebuild_history_index(pid)
+        print(f"{pid}: {counts[pid]} commits indexed")
+    adapter.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+"""Move patient repositories from the flat uploads layout into hash-prefix shards.
+
+Usage: python scripts/shard_uploads.py [--root UPLOAD_FOLDER] [--levels 2] [--width 2] [--dry-run]
+
+Safe to run while the app is serving, provided the app is configured with
+the same BHV_SHARD_LEVELS / BHV_SHARD_WIDTH: each repo is renamed under its
+patient lock and the app finds unmigrated repos in the flat layout until
+then. Repos that are busy with a batch are skipped; run the script again.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from bhv.storage.git_adapter import GitAdapter
+
+
+def main():
+    default_root = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--root', default=default_root, help='storage root containing patient repositories')
+    parser.add_argument('--levels', type=int, default=int(os.environ.get('BHV_SHARD_LEVELS') or 2), help='number of fan-out directory levels')
+    parser.add_argument('--width', type=int, default=int(os.environ.get('BHV_SHARD_WIDTH', 2)), help='hex digits per fan-out directory')
+    parser.add_argument('--dry-run', action='store_true', help='only list the repos that would move')
+    args = parser.parse_args()
+
+    adapter = GitAdapter(args.root, shard_levels=args.levels, shard_width=args.width)
+    moved = skipped = 0
+    for pid in adapter.patients():
+        flat = adapter._flat_path(pid)
+        if adapter.repo_path(pid) != flat:
+            continue
+        if args.dry_run:
+            print(f"{pid}: {flat} -> {adapter._sharded_path(pid)}")
+            continue
+        if adapter.migrate_to_shards(pid):
+            moved += 1
+        else:
+            skipped += 1
+            print(f"{pid}: skipped (busy or target exists)")
+    adapter.close()
+    if not args.dry_run:
+        print(f"{moved} repositories moved, {skipped} skipped")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,15 @@
-"""One-shot script: overwrite alaska.css with the full redesigned stylesheet."""
+"""Stylesheet and static asset tooling.
+
+Usage:
+  python scripts/write_css.py            overwrite alaska.css with the redesigned stylesheet below
+  python scripts/write_css.py --build    build fingerprinted, minified and precompressed
+                                         assets from static/ into static/dist/ (see bhv/assets.py)
+"""
+import argparse
 import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 CSS = r"""/* ==========================================================================
    Haven Health — Design System
@@ -1266,8 +1276,39 @@ select { cursor: pointer; }
 }
 """
 
-target = os.path.join(os.path.dirname(__file__), '..', 'static', 'css', 'alaska.css')
-target = os.path.abspath(target)
-with open(target, 'w', encoding='utf-8') as f:
-    f.write(CSS)
-print(f"Wrote {len(CSS):,} chars to {target}")
+STATIC_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'static'))
+
+
+def write_css():
+    target = os.path.join(STATIC_DIR, 'css', 'alaska.css')
+    with open(target, 'w', encoding='utf-8') as f:
+        f.write(CSS)
+    print(f"Wrote {len(CSS):,} chars to {target}")
+
+
+def build_assets(static_dir, out_dir):
+    from bhv.assets import brotli, Image, build
+    manifest = build(static_dir, out_dir)
+    out_dir = out_dir or os.path.join(static_dir, 'dist')
+    print(f"Built {len(manifest['files'])} assets and {sum(len(v) for v in manifest['srcset'].values())} "
+          f"image renditions into {out_dir}")
+    if brotli is None:
+        print("brotli is not installed: only gzip variants were written")
+    if Image is None:
+        print("Pillow is not installed: images were not resized")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--build', action='store_true', help='build static/dist instead of rewriting alaska.css')
+    parser.add_argument('--static', default=STATIC_DIR, help='static directory to build from')
+    parser.add_argument('--out', default=None, help='output directory (default: <static>/dist)')
+    args = parser.parse_args()
+    if args.build:
+        build_assets(args.static, args.out)
+    else:
+        write_css()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+"""Keep the embedded database used by the test-suite out of data/."""
+import os
+import tempfile
+
+os.environ.setdefault('BHV_SQLITE_PATH', os.path.join(tempfile.mkdtemp(), 'bhv-test.sqlite3'))
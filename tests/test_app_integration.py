@@ -75,3 +75,138 @@ def test_upload_conflict_returns_409():
         'file': (io.BytesIO(b'b'), 'file.txt')
     }, content_type='multipart/form-data')
     assert resp2.status_code == 409
+    # the current head is returned so the client can retry against it
+    assert resp2.get_json()['head'] == resp.get_json()['head']
+
+
+def test_download_streams_historical_version():
+    tmp = tempfile.mkdtemp()
+    _setup_storage(tmp)
+    client = app.test_client()
+
+    resp = client.post('/upload', data={
+        'patient_id': 'p3',
+        'user_id': 'u',
+        'action': 'create',
+        'file': (io.BytesIO(b'old bytes'), 'scan.txt')
+    }, content_type='multipart/form-data')
+    first = resp.get_json()['commit']
+    client.post('/upload', data={
+        'patient_id': 'p3',
+        'user_id': 'u',
+        'action': 'edit',
+        'file': (io.BytesIO(b'new'), 'scan.txt')
+    }, content_type='multipart/form-data')
+
+    old = client.get(f'/file/p3/scan.txt?version={first}')
+    assert old.status_code == 200
+    assert old.data == b'old bytes'
+    assert old.headers['Content-Length'] == str(len(b'old bytes'))
+    assert client.get('/file/p3/scan.txt').data == b'new'
+    assert client.get('/file/p3/missing.txt').status_code == 404
+
+
+def test_downloads_use_blob_etags_and_conditional_requests():
+    tmp = tempfile.mkdtemp()
+    _setup_storage(tmp)
+    client = app.test_client()
+
+    first = client.post('/upload', data={
+        'patient_id': 'p4',
+        'user_id': 'u',
+        'action': 'create',
+        'file': (io.BytesIO(b'version one'), 'scan.txt')
+    }, content_type='multipart/form-data').get_json()['commit']
+
+    pinned = client.get(f'/file/p4/scan.txt?version={first}')
+    etag = pinned.headers['ETag']
+    assert 'immutable' in pinned.headers['Cache-Control']
+    again = client.get(f'/file/p4/scan.txt?version={first}', headers={'If-None-Match': etag})
+    assert again.status_code == 304 and again.data == b''
+
+    # the working tree copy has the same content, hence the same ETag, but must be revalidated
+    current = client.get('/file/p4/scan.txt', headers={'If-None-Match': etag})
+    assert current.status_code == 304
+    assert current.headers['Cache-Control'] == 'private, no-cache'
+
+    client.post('/upload', data={
+        'patient_id': 'p4',
+        'user_id': 'u',
+        'action': 'edit',
+        'file': (io.BytesIO(b'version two'), 'scan.txt')
+    }, content_type='multipart/form-data')
+    changed = client.get('/file/p4/scan.txt', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.data == b'version two'
+    assert changed.headers['ETag'] != etag
+
+
+def test_upload_over_limit_returns_413():
+    tmp = tempfile.mkdtemp()
+    adapter = _setup_storage(tmp)
+    adapter.max_file_size = 4
+    client = app.test_client()
+
+    resp = client.post('/upload', data={
+        'patient_id': 'p4',
+        'user_id': 'u',
+        'action': 'create',
+        'file': (io.BytesIO(b'too large'), 'big.txt')
+    }, content_type='multipart/form-data')
+    assert resp.status_code == 413
+    assert adapter.history(os.path.join('p4', 'big.txt')) == []
+
+
+def test_diff_endpoint_text_and_stats():
+    tmp = tempfile.mkdtemp()
+    adapter = _setup_storage(tmp)
+    rel = os.path.join('patientDiff', 'notes.txt')
+    a = adapter.save(rel, b'one\ntwo\n', user_id='u', action='create')
+    adapter.save(rel, b'one\nthree\n', user_id='u', action='edit')
+    client = app.test_client()
+
+    resp = client.get('/diff/patientDiff/notes.txt', query_string={'a': a})
+    assert resp.status_code == 200
+    assert '-two' in resp.get_data(as_text=True) and '+three' in resp.get_data(as_text=True)
+
+    resp = client.get('/diff/patientDiff/notes.txt', query_string={'a': a, 'stat': '1'})
+    assert resp.get_json()['stats'] == {'additions': 1, 'deletions': 1}
+
+
+def test_range_requests_return_partial_content():
+    tmp = tempfile.mkdtemp()
+    _setup_storage(tmp)
+    client = app.test_client()
+    data = bytes(range(256)) * 400
+    first = client.post('/upload', data={
+        'patient_id': 'p5',
+        'user_id': 'u',
+        'action': 'create',
+        'file': (io.BytesIO(data), 'scan.bin')
+    }, content_type='multipart/form-data').get_json()['commit']
+    client.post('/upload', data={
+        'patient_id': 'p5',
+        'user_id': 'u',
+        'action': 'edit',
+        'file': (io.BytesIO(b'replaced'), 'scan.bin')
+    }, content_type='multipart/form-data')
+
+    url = f'/file/p5/scan.bin?version={first}'
+    part = client.get(url, headers={'Range': 'bytes=1000-1999'})
+    assert part.status_code == 206
+    assert part.data == data[1000:2000]
+    assert part.headers['Content-Range'] == f'bytes 1000-1999/{len(data)}'
+    assert part.headers['Content-Length'] == '1000'
+
+    tail = client.get('/file/p5/scan.bin', headers={'Range': 'bytes=-4'})
+    assert tail.status_code == 206 and tail.data == b'aced'
+
+    etag = part.headers['ETag']
+    resumed = client.get(url, headers={'Range': 'bytes=100000-', 'If-Range': etag})
+    assert resumed.status_code == 206 and resumed.data == data[100000:]
+    # If-Range for content that has changed sends the whole current file
+    stale = client.get('/file/p5/scan.bin', headers={'Range': 'bytes=0-1', 'If-Range': etag})
+    assert stale.status_code == 200 and stale.data == b'replaced'
+
+    unsatisfiable = client.get(url, headers={'Range': f'bytes={len(data)}-'})
+    assert unsatisfiable.status_code == 416
+    assert unsatisfiable.headers['Content-Range'] == f'bytes */{len(data)}'
@@ -0,0 +1,61 @@
+import gzip
+import io
+import json
+import os
+import tempfile
+
+from bhv.assets import AssetManifest, build, minify_css, minify_js
+
+
+def _static_tree():
+    root = tempfile.mkdtemp()
+    os.makedirs(os.path.join(root, 'css'))
+    os.makedirs(os.path.join(root, 'js'))
+    with open(os.path.join(root, 'css', 'site.css'), 'w') as f:
+        f.write('/* theme */\n.card  >  a:hover {\n  color: red;\n  width: calc(100% - 2px);\n}\n')
+    with open(os.path.join(root, 'js', 'app.js'), 'w') as f:
+        f.write('/* header\n   comment */\n(function(){\n  // setup\n  var url = "http://x";\n})();\n')
+    return root
+
+
+def test_minifiers_keep_meaningful_whitespace():
+    assert minify_css('a :hover , b { margin: 0 auto ; width: calc(1px + 2%); }') == \
+        'a :hover,b{margin:0 auto;width:calc(1px + 2%)}'
+    assert minify_js('  // c\n  var a = "//not a comment";\n\n') == 'var a = "//not a comment";\n'
+
+
+def test_build_fingerprints_and_compresses():
+    root = _static_tree()
+    manifest = build(root)
+    dist = os.path.join(root, 'dist')
+    css = manifest['files']['css/site.css']
+    assert css.startswith('css/site.') and css.endswith('.css')
+    with open(os.path.join(dist, css), 'rb') as f:
+        built = f.read()
+    assert built == b'.card>a:hover{color:red;width:calc(100% - 2px)}'
+    with gzip.open(os.path.join(dist, css + '.gz')) as f:
+        assert f.read() == built
+    assert 'http://x' in open(os.path.join(dist, manifest['files']['js/app.js'])).read()
+
+    assets = AssetManifest(dist)
+    assert assets.lookup('css/site.css') == css
+    assert assets.lookup('missing.css') is None
+    # rebuilding unchanged sources gives the same names
+    assert build(root)['files'] == manifest['files']
+    with open(os.path.join(dist, 'manifest.json')) as f:
+        assert json.load(f)['files'] == manifest['files']
+
+
+def test_responsive_image_renditions():
+    import pytest
+    Image = pytest.importorskip('PIL.Image')
+    root = _static_tree()
+    os.makedirs(os.path.join(root, 'img'))
+    Image.new('RGB', (1200, 600), (1, 2, 3)).save(os.path.join(root, 'img', 'hero.png'))
+    build(root)
+    assets = AssetManifest(os.path.join(root, 'dist'))
+    assert [w for w, _ in assets.srcset('img/hero.png')] == [480, 960, 1200]
+    assert assets.lookup('img/hero.png', width=500).startswith('img/hero-960.')
+    assert assets.lookup('img/hero.png', width=4000).startswith('img/hero-1200.')
+    with Image.open(os.path.join(root, 'dist', assets.lookup('img/hero.png', width=1))) as img:
+        assert img.format == 'WEBP' and img.size == (480, 240)
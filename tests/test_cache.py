@@ -0,0 +1,37 @@
+import time
+
+from bhv.cache import TTLCache
+
+
+def test_hits_misses_and_expiry():
+    cache = TTLCache(maxsize=10, ttl=0.05)
+    calls = []
+    load = lambda: calls.append(1) or {'email': 'a@x'}
+    assert cache.get_or_load('a@x', load) == {'email': 'a@x'}
+    assert cache.get_or_load('a@x', load) == {'email': 'a@x'}
+    assert len(calls) == 1
+    time.sleep(0.06)
+    cache.get_or_load('a@x', load)
+    assert len(calls) == 2
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (1, 2)
+    assert abs(stats['hit_rate'] - 1 / 3) < 1e-9
+
+
+def test_none_is_not_cached_and_invalidate():
+    cache = TTLCache()
+    assert cache.get_or_load('a@x', lambda: None) is None
+    assert cache.stats()['size'] == 0
+    cache.set('a@x', 1)
+    cache.invalidate('a@x')
+    assert cache.get('a@x') is None
+
+
+def test_lru_bound_and_disabled():
+    cache = TTLCache(maxsize=2)
+    for key in 'abc':
+        cache.set(key, key)
+    assert cache.get('a') is None and cache.get('c') == 'c'
+    off = TTLCache(ttl=0)
+    off.set('a', 1)
+    assert off.get('a') is None
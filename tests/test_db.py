@@ -0,0 +1,104 @@
+import json
+import os
+import tempfile
+import uuid
+
+import pytest
+
+from bhv import db
+
+pytestmark = pytest.mark.skipif(db.DB_BACKEND != 'sqlite', reason='SQLite backend not selected')
+
+
+def test_sqlite_users_and_entries():
+    db.init_db()
+    email = f'{uuid.uuid4().hex}@example.com'
+    uid = db.create_user(email, 'hash', role='admin')
+    user = db.get_user_by_email(email)
+    assert user['_id'] == uid and user['role'] == 'admin'
+    assert db.get_user_by_email('nobody-' + email) is None
+
+    eid = db.create_entry(email, 'a.png', 'first')
+    db.create_entry(email, 'b.png', 'second')
+    entries = db.list_entries_for_patient(email)
+    assert [e['filename'] for e in entries] == ['a.png', 'b.png']
+
+    db.update_entry(eid, narrative='edited', mood='calm')
+    entry = db.get_entry(str(eid))
+    assert entry['narrative'] == 'edited' and entry['mood'] == 'calm'
+
+    db.delete_entry(str(eid))
+    assert db.get_entry(eid) is None
+    assert len(db.list_entries_for_patient(email)) == 1
+
+
+def test_migrate_from_tinydb_keeps_ids_and_skips_existing():
+    db.init_db()
+    email = f'{uuid.uuid4().hex}@example.com'
+    entry_id = 10_000_000 + uuid.uuid4().int % 1_000_000
+    path = os.path.join(tempfile.mkdtemp(), 'db.json')
+    with open(path, 'w') as f:
+        json.dump({
+            'users': {str(entry_id): {'email': email, 'password': 'h', 'role': 'patient'}},
+            'entries': {str(entry_id): {'patient_id': email, 'filename': 'x.png', 'narrative': 'n',
+                                        'timestamp': '2024-01-01T00:00:00'}},
+        }, f)
+    assert db.migrate_from_tinydb(path) == {'users': 1, 'entries': 1}
+    assert db.get_entry(entry_id)['filename'] == 'x.png'
+    assert db.get_user_by_email(email)['_id'] == entry_id
+    assert db.migrate_from_tinydb(path) == {'users': 0, 'entries': 0}
+
+
+def test_list_entries_keyset_pagination():
+    from datetime import datetime, timedelta
+    db.init_db()
+    patient = f'{uuid.uuid4().hex}@example.com'
+    base = datetime(2024, 1, 1)
+    for i in range(5):
+        db.create_entry(patient, f'{i}.png', '', timestamp=base + timedelta(days=i))
+    # same timestamp as the newest entry: the id breaks the tie
+    db.create_entry(patient, 'tie.png', '', timestamp=base + timedelta(days=4))
+
+    seen, cursor = [], None
+    while True:
+        page, cursor = db.list_entries(patient, limit=2, cursor=cursor)
+        seen.extend(e['filename'] for e in page)
+        if cursor is None:
+            break
+    assert seen == ['tie.png', '4.png', '3.png', '2.png', '1.png', '0.png']
+
+    page, cursor = db.list_entries(patient, limit=4, sort='timestamp asc')
+    assert [e['filename'] for e in page] == ['0.png', '1.png', '2.png', '3.png']
+    page, _ = db.list_entries(patient, limit=4, cursor=cursor, sort='timestamp asc')
+    assert [e['filename'] for e in page] == ['4.png', 'tie.png']
+
+    page, _ = db.list_entries(patient, limit=2, offset=4)
+    assert [e['filename'] for e in page] == ['1.png', '0.png']
+    assert db.count_entries(patient) == 6
+    with pytest.raises(ValueError):
+        db.list_entries(patient, sort='filename')
+    with pytest.raises(ValueError):
+        db.list_entries(patient, cursor='not-a-cursor')
+    with pytest.raises(ValueError):
+        db.list_entries(patient, offset=-1)
+
+
+def test_user_cache_invalidated_on_role_change():
+    email = f'{uuid.uuid4().hex}@example.com'
+    db.create_user(email, 'x', role='patient')
+    assert db.get_user_by_email(email)['role'] == 'patient'
+    hits = db.user_cache_stats()['hits']
+    assert db.get_user_by_email(email)['role'] == 'patient'
+    assert db.user_cache_stats()['hits'] == hits + 1
+    assert db.set_user_role(email, 'admin')
+    assert db.get_user_by_email(email)['role'] == 'admin'
+    assert not db.set_user_role('nobody@example.com', 'admin')
+
+
+def test_create_entries_bulk_insert():
+    db.init_db()
+    pid = f'bulk-{uuid.uuid4().hex}@example.com'
+    ids = db.create_entries([(pid, 'a.png', 'alpha note', None), (pid, 'b.png', 'beta note', None)])
+    assert len(ids) == 2
+    assert [e['filename'] for e in db.list_entries_for_patient(pid)] == ['a.png', 'b.png']
+    assert db.get_entry(str(ids[1]))['narrative'] == 'beta note'
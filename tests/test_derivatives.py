@@ -0,0 +1,57 @@
+import io
+import os
+import tempfile
+
+import pytest
+
+from bhv.derivatives import DerivativeStore
+from bhv.storage.git_adapter import GitAdapter
+
+Image = pytest.importorskip('PIL.Image')
+
+
+def _png(size=(1600, 1200), color=(200, 30, 30)):
+    out = io.BytesIO()
+    Image.new('RGB', size, color).save(out, 'PNG')
+    return out.getvalue()
+
+
+def test_renditions_are_cached_by_blob_and_shared_across_versions():
+    tmp = tempfile.mkdtemp()
+    storage = GitAdapter(os.path.join(tmp, 'uploads'))
+    store = DerivativeStore(os.path.join(tmp, 'derivatives'), workers=0)
+    rel = os.path.join('p1', 'scan.png')
+    first = storage.save(rel, _png(), user_id='u', action='upload')
+    store.submit(storage, rel)
+    blob = storage.blob_id(rel, 'HEAD')
+    thumb = store.path(storage, 'thumb', rel, blob)
+    with Image.open(thumb) as img:
+        assert img.format == 'JPEG' and max(img.size) == 320
+    with Image.open(store.path(storage, 'preview', rel, blob)) as img:
+        assert img.size == (1280, 960)
+    assert store.stats()['generated'] == 2
+
+    # a new version gets its own renditions; the old version's are reused
+    storage.save(rel, _png(color=(0, 0, 200)), user_id='u', action='edit')
+    assert store.path(storage, 'thumb', rel, blob) is None  # no longer HEAD
+    assert store.path(storage, 'thumb', rel, blob, version=first) == thumb
+    assert store.stats()['generated'] == 2
+    # same bytes under another patient share the cached files
+    other = os.path.join('p2', 'copy.png')
+    storage.save(other, _png(), user_id='u', action='upload')
+    assert store.path(storage, 'thumb', other, blob) == thumb
+    storage.close()
+
+
+def test_non_images_and_bad_blob_ids_are_rejected():
+    tmp = tempfile.mkdtemp()
+    storage = GitAdapter(os.path.join(tmp, 'uploads'))
+    store = DerivativeStore(os.path.join(tmp, 'derivatives'), workers=0)
+    rel = os.path.join('p1', 'broken.png')
+    storage.save(rel, b'not really a png', user_id='u', action='upload')
+    blob = storage.blob_id(rel, 'HEAD')
+    assert store.path(storage, 'thumb', rel, blob) is None
+    assert store.stats()['failed'] == 1
+    assert store.path(storage, 'thumb', rel, '../../etc/passwd') is None
+    assert store.path(storage, 'huge', rel, blob) is None
+    storage.close()
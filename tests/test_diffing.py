@@ -0,0 +1,102 @@
+import difflib
+import os
+import tempfile
+
+from bhv.diffing import DiffCache, fast_unified_diff, python_diff, render_diff
+from bhv.storage.git_adapter import GitAdapter
+
+
+def _two_versions(old, new, name='notes.txt'):
+    adapter = GitAdapter(tempfile.mkdtemp())
+    rel = os.path.join('patientD', name)
+    a = adapter.save(rel, old, user_id='u1', action='create')
+    b = adapter.save(rel, new, user_id='u1', action='edit')
+    return adapter, rel, a, b
+
+
+def test_git_diff_structure_and_stat_only():
+    adapter, rel, a, b = _two_versions(b'one\ntwo\nthree\n', b'one\n2\nthree\nfour\n')
+    result = adapter.diff(rel, a, b)
+    assert not result['binary']
+    assert result['stats'] == {'additions': 2, 'deletions': 1}
+    assert len(result['hunks']) == 1
+    assert result['hunks'][0]['lines'] == [' one', '-two', '+2', ' three', '+four']
+    assert '+++ b/notes.txt' in result['text']
+    stat = adapter.diff(rel, a, b, stat_only=True)
+    assert stat['stats'] == result['stats'] and stat['hunks'] == [] and stat['text'] == ''
+
+
+def test_render_diff_is_cached_by_blob_ids():
+    adapter, rel, a, b = _two_versions(b'one\n', b'two\n')
+    assert adapter.blob_id(rel, a) != adapter.blob_id(rel, b)
+    cache = DiffCache()
+    first = render_diff(adapter, rel, a, b, cache=cache)
+    assert render_diff(adapter, rel, a, b, cache=cache) is first
+    assert cache.stats()['hits'] == 1
+    assert render_diff(adapter, rel, a, a)['text'] == ''
+
+
+def test_render_diff_cache_is_per_file():
+    adapter, rel, a, b = _two_versions(b'one\n', b'two\n')
+    other = os.path.join('patientE', 'private.txt')
+    c = adapter.save(other, b'one\n', user_id='u2', action='create')
+    d = adapter.save(other, b'two\n', user_id='u2', action='edit')
+    assert adapter.blob_id(other, c) == adapter.blob_id(rel, a)
+    cache = DiffCache()
+    render_diff(adapter, rel, a, b, cache=cache)
+    text = render_diff(adapter, other, c, d, cache=cache)['text']
+    assert 'private.txt' in text and 'notes.txt' not in text
+
+
+def test_cached_diffs_name_the_commits_asked_for():
+    adapter, rel, a, b = _two_versions(b'\x89PNG\x00' + b'x' * 10, b'\x89PNG\x00' + b'y' * 20, name='img.png')
+    c = adapter.save(rel, b'\x89PNG\x00' + b'x' * 10, user_id='u1', action='revert')
+    d = adapter.save(rel, b'\x89PNG\x00' + b'y' * 20, user_id='u1', action='edit')
+    cache = DiffCache()
+    assert a in render_diff(adapter, rel, a, b, cache=cache)['text']
+    text = render_diff(adapter, rel, c, d, cache=cache)['text']
+    assert cache.stats()['hits'] == 1
+    assert c in text and d in text and a not in text
+
+
+def test_python_diff_does_not_load_oversized_files():
+    adapter, rel, a, b = _two_versions(b'one\n' * 100, b'two\n' * 100)
+
+    def get(*args):
+        raise AssertionError('loaded an oversized file')
+
+    adapter.get = get
+    result = python_diff(adapter, rel, a, b, max_load_bytes=100)
+    assert result['stats'] is None and 'too large' in result['text']
+
+
+def test_binary_files_are_summarised():
+    adapter, rel, a, b = _two_versions(b'\x89PNG\x00' + b'x' * 100, b'\x89PNG\x00' + b'y' * 50, name='img.png')
+    assert adapter.diff(rel, a, b)['binary']
+    text = render_diff(adapter, rel, a, b)['text']
+    assert text.startswith('Binary files differ')
+    assert '(105 bytes' in text and '(55 bytes' in text
+    assert python_diff(adapter, rel, a, b)['binary']
+
+
+def test_python_diff_matches_difflib():
+    adapter, rel, a, b = _two_versions(b'one\ntwo\nthree\n', b'one\n2\nthree\n')
+    result = python_diff(adapter, rel, a, b)
+    expected = '\n'.join(difflib.unified_diff(['one', 'two', 'three'], ['one', '2', 'three'], fromfile='a/notes.txt', tofile='b/notes.txt', lineterm=''))
+    assert result['text'] == expected
+    assert result['stats'] == {'additions': 1, 'deletions': 1}
+
+
+def test_python_diff_large_text_uses_linear_fallback():
+    old = b''.join(b'line %d\n' % i for i in range(1000))
+    new = old.replace(b'line 500\n', b'changed\n')
+    adapter, rel, a, b = _two_versions(old, new)
+    result = python_diff(adapter, rel, a, b, max_bytes=100)
+    assert '-line 500' in result['text'] and '+changed' in result['text']
+    assert result['hunks'][0]['header'] == '@@ -498,7 +498,7 @@'
+
+
+def test_fast_unified_diff_edge_cases():
+    assert list(fast_unified_diff(['a'], ['a'])) == []
+    lines = list(fast_unified_diff([], ['x'], 'old', 'new'))
+    assert lines == ['--- old', '+++ new', '@@ -0,0 +1,1 @@', '+x']
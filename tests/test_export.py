@@ -0,0 +1,68 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from bhv.export import export_all, patient_members, stream_archive
+from bhv.storage.git_adapter import GitAdapter
+
+
+def _vault(root):
+    adapter = GitAdapter(root)
+    adapter.save(os.path.join('p1', 'notes.txt'), b'old', user_id='u', action='upload')
+    adapter.save(os.path.join('p1', 'notes.txt'), b'new', user_id='u', action='edit')
+    adapter.save(os.path.join('p1', 'scan.png'), os.urandom(200 * 1024), user_id='u', action='upload')
+    return adapter
+
+
+def test_archives_stream_in_bounded_chunks(tmp_path):
+    adapter = _vault(str(tmp_path))
+    try:
+        entries = [{'id': '1', 'filename': 'notes.txt', 'narrative': 'hello'}]
+        for fmt in ('zip', 'tar', 'tar.gz'):
+            chunks = list(stream_archive(patient_members(adapter, 'p1', history=True, entries=entries), fmt))
+            assert max(len(c) for c in chunks) < 128 * 1024
+            data = io.BytesIO(b''.join(chunks))
+            if fmt == 'zip':
+                archive = zipfile.ZipFile(data)
+                names, read = archive.namelist(), archive.read
+            else:
+                archive = tarfile.open(fileobj=data)
+                names, read = archive.getnames(), lambda n: archive.extractfile(n).read()
+            assert read('p1/files/notes.txt') == b'new'
+            assert read('p1/files/scan.png') == b''.join(adapter.get_stream(os.path.join('p1', 'scan.png')))
+            history = sorted(read(n) for n in names if n.startswith('p1/history/') and n.endswith('notes.txt'))
+            assert history == [b'new', b'old']
+            assert b'"narrative": "hello"' in read('p1/entries.jsonl')
+    finally:
+        adapter.close()
+
+
+def test_export_pins_head_and_rejects_unknown_formats(tmp_path):
+    adapter = _vault(str(tmp_path))
+    try:
+        members = patient_members(adapter, 'p1')
+        first = next(members)
+        # a commit made mid-export is not part of it
+        adapter.save(os.path.join('p1', 'notes.txt'), b'newer', user_id='u', action='edit')
+        assert b''.join(first.chunks()) == b'new'
+        with pytest.raises(ValueError):
+            stream_archive([], 'rar')
+    finally:
+        adapter.close()
+
+
+def test_export_all_writes_one_archive_per_patient(tmp_path):
+    root = str(tmp_path / 'uploads')
+    _vault(root).close()
+    adapter = GitAdapter(root)
+    adapter.save(os.path.join('p2', 'a.txt'), b'a', user_id='u', action='upload')
+    adapter.close()
+    out = str(tmp_path / 'backup')
+    paths = export_all(root, out, ['p1', 'p2'], fmt='tar.gz', workers=2, log=lambda msg: None)
+    assert paths == [os.path.join(out, 'p1.tar.gz'), os.path.join(out, 'p2.tar.gz')]
+    with tarfile.open(paths[1]) as archive:
+        assert archive.extractfile('p2/files/a.txt').read() == b'a'
+    assert sorted(os.listdir(out)) == ['p1.tar.gz', 'p2.tar.gz']
@@ -1,6 +1,8 @@
 """Integration tests for the full app flow: signup, login, upload, history."""
+import io
 import os
 import tempfile
+import re
 import shutil
 import pytest
 from bhv.full_app import create_app
@@ -113,6 +115,33 @@ def test_download_specific_version(client):
     assert resp.status_code == 200
 
 
+def test_download_streams_file(client):
+    """Test that the download route streams the stored bytes with a length."""
+    client.post('/signup', data={
+        'email': 'stream@example.com',
+        'password': 'password123',
+        'role': 'patient'
+    })
+    client.post('/login', data={'email':'stream@example.com','password':'password123'}, follow_redirects=True)
+
+    client.post('/upload', data={
+        'file': (io.BytesIO(b'streamed content'), 'scan.txt'),
+        'narrative': 'Scan'
+    })
+
+    resp = client.get('/file/stream@example.com/scan.txt')
+    assert resp.status_code == 200
+    assert resp.data == b'streamed content'
+    assert resp.headers['Content-Length'] == str(len(b'streamed content'))
+    assert client.get('/file/stream@example.com/missing.txt').status_code == 404
+
+    resp = client.get('/uploads/stream@example.com/scan.txt')
+    assert resp.status_code == 200 and resp.data == b'streamed content'
+    assert client.get('/uploads/stream@example.com/.git/config').status_code == 404
+    cached = client.get('/uploads/stream@example.com/scan.txt', headers={'If-None-Match': resp.headers['ETag']})
+    assert cached.status_code == 304
+
+
 def test_admin_sees_all_entries(client):
     """Test that admin can see all entries."""
     # Signup admin
@@ -128,6 +157,26 @@ def test_admin_sees_all_entries(client):
     assert resp.status_code == 200
 
 
+def test_admin_listing_is_paginated(client):
+    """Test that /admin pages through entries with limit and cursor."""
+    from bhv.db import create_entry
+    create_entry('paged@example.com', 'one.png', 'first')
+    create_entry('paged@example.com', 'two.png', 'second')
+    client.post('/signup', data={
+        'email': 'pager-admin@example.com',
+        'password': 'password123',
+        'role': 'admin'
+    })
+    client.post('/login', data={'email':'pager-admin@example.com','password':'password123'}, follow_redirects=True)
+
+    resp = client.get('/admin?limit=1')
+    assert resp.status_code == 200
+    assert b'two.png' in resp.data and b'one.png' not in resp.data
+    assert b'Next page' in resp.data
+    assert client.get('/admin?cursor=garbage').status_code == 400
+    assert client.get('/admin?offset=-1').status_code == 400
+
+
 def test_patient_cannot_access_other_entries(client):
     """Test that patients cannot access other patients' entries."""
     # Signup patient 1
@@ -158,5 +207,122 @@ def test_patient_cannot_access_other_entries(client):
     assert resp.status_code in [200, 302, 403]
 
 
+def test_export_streams_the_patient_vault(client):
+    """The export endpoint returns a zip of the vault; other patients get 404."""
+    import zipfile
+    client.post('/signup', data={'email': 'export@example.com', 'password': 'password123', 'role': 'patient'})
+    client.post('/login', data={'email': 'export@example.com', 'password': 'password123'}, follow_redirects=True)
+    client.post('/upload', data={'file': (io.BytesIO(b'v1'), 'notes.txt'), 'narrative': 'first'})
+    client.post('/upload', data={'file': (io.BytesIO(b'v2'), 'notes.txt'), 'narrative': 'second'})
+
+    resp = client.get('/export/export@example.com?history=1&metadata=1')
+    assert resp.status_code == 200 and resp.mimetype == 'application/zip'
+    assert 'attachment' in resp.headers['Content-Disposition']
+    archive = zipfile.ZipFile(io.BytesIO(resp.data))
+    assert archive.read('export@example.com/files/notes.txt') == b'v2'
+    versions = [n for n in archive.namelist() if n.startswith('export@example.com/history/')]
+    assert sorted(archive.read(n) for n in versions) == [b'v1', b'v2']
+    assert b'second' in archive.read('export@example.com/entries.jsonl')
+
+    assert client.get('/export/export@example.com?format=rar').status_code == 400
+    assert client.get('/export/someone-else@example.com').status_code == 404
+
+
+def test_async_upload_returns_job_and_commits_in_background(monkeypatch):
+    """Test that async uploads return a job and are committed by the worker."""
+    monkeypatch.setenv('BHV_ASYNC_UPLOADS', '1')
+    root = tempfile.mkdtemp()
+    app = create_app(testing=True, upload_folder=os.path.join(root, 'uploads'))
+    jobs = app.extensions['bhv_jobs']
+    with app.test_client() as cli:
+        cli.post('/signup', data={'email': 'async@example.com', 'password': 'password123', 'role': 'patient'})
+        cli.post('/login', data={'email': 'async@example.com', 'password': 'password123'})
+        resp = cli.post('/upload', data={'file': (io.BytesIO(b'queued'), 'later.txt'), 'narrative': 'async'},
+                        headers={'Accept': 'application/json'})
+        assert resp.status_code == 202
+        status_url = resp.get_json()['status_url']
+        assert cli.get(status_url).get_json()['status'] == 'pending'
+
+        assert jobs.run_pending() == 1
+        job = cli.get(status_url).get_json()
+        assert job['status'] == 'done' and job['result']['commit']
+        assert cli.get('/uploads/async@example.com/later.txt').data == b'queued'
+
+        cli.post('/signup', data={'email': 'other@example.com', 'password': 'password123', 'role': 'patient'})
+        cli.post('/login', data={'email': 'other@example.com', 'password': 'password123'})
+        assert cli.get(status_url).status_code == 404
+    shutil.rmtree(root, ignore_errors=True)
+
+
+def test_oversized_request_is_rejected_before_it_is_spooled(monkeypatch):
+    """Test that a request over MAX_CONTENT_LENGTH gets a 413 and stores nothing."""
+    monkeypatch.setenv('BHV_MAX_UPLOAD_SIZE', '1000')
+    root = tempfile.mkdtemp()
+    app = create_app(testing=True, upload_folder=os.path.join(root, 'uploads'))
+    assert app.config['MAX_CONTENT_LENGTH'] > 1000
+    with app.test_client() as cli:
+        cli.post('/signup', data={'email': 'big@example.com', 'password': 'password123', 'role': 'patient'})
+        cli.post('/login', data={'email': 'big@example.com', 'password': 'password123'})
+        resp = cli.post('/upload', data={'file': (io.BytesIO(b'x' * 200 * 1024), 'big.txt'), 'narrative': ''})
+        assert resp.status_code == 413
+        assert cli.get('/uploads/big@example.com/big.txt').status_code == 404
+    shutil.rmtree(root, ignore_errors=True)
+
+
+def test_list_pages_link_cacheable_thumbnails(client):
+    """Test that list pages link thumbnails by blob id without starting git processes."""
+    pytest.importorskip('PIL')
+    from PIL import Image
+    image = io.BytesIO()
+    Image.new('RGB', (800, 600), (10, 120, 40)).save(image, 'PNG')
+    client.post('/signup', data={'email': 'thumbs@example.com', 'password': 'password123', 'role': 'patient'})
+    client.post('/login', data={'email': 'thumbs@example.com', 'password': 'password123'})
+    client.post('/upload', data={'file': (io.BytesIO(image.getvalue()), 'photo.png'), 'narrative': 'walk'})
+    storage = client.application.extensions['bhv_storage']
+    before = storage.catfile_stats()
+    page = client.get('/my').get_data(as_text=True)
+    # the blob id comes from the git index: rendering the list starts no git process
+    assert storage.catfile_stats()['started'] == before['started']
+    assert storage.catfile_stats()['requests'] == before['requests']
+    src = re.search(r'class="entry-card__thumb" src="([^"]+)"', page).group(1).replace('&amp;', '&')
+    resp = client.get(src)
+    assert resp.status_code == 200 and resp.mimetype == 'image/jpeg'
+    assert 'immutable' in resp.headers['Cache-Control']
+    assert len(resp.data) < len(image.getvalue())
+    assert client.get(src.replace('v=', 'v=0')).status_code == 404
+
+
+def test_built_assets_are_fingerprinted_and_precompressed(monkeypatch):
+    """Test that built assets are linked by fingerprint and served precompressed."""
+    from bhv.assets import build
+    static = tempfile.mkdtemp()
+    os.makedirs(os.path.join(static, 'css'))
+    with open(os.path.join(static, 'css', 'alaska.css'), 'w') as f:
+        f.write('body {\n  color: black;\n}\n' * 50)
+    manifest = build(static)
+    monkeypatch.setenv('BHV_ASSET_DIR', os.path.join(static, 'dist'))
+    root = tempfile.mkdtemp()
+    app = create_app(testing=True, upload_folder=os.path.join(root, 'uploads'))
+    with app.test_client() as cli:
+        page = cli.get('/').get_data(as_text=True)
+        url = '/assets/' + manifest['files']['css/alaska.css']
+        assert url in page
+        # not built: falls back to /static
+        assert '/static/js/app.js' in page
+
+        resp = cli.get(url, headers={'Accept-Encoding': 'gzip, deflate'})
+        assert resp.status_code == 200
+        assert resp.headers['Content-Encoding'] == 'gzip'
+        assert resp.headers['Cache-Control'] == 'public, max-age=31536000, immutable'
+        assert 'Accept-Encoding' in resp.headers['Vary']
+        assert resp.mimetype == 'text/css'
+        plain = cli.get(url)
+        assert 'Content-Encoding' not in plain.headers and plain.data.startswith(b'body{color:black}')
+        assert cli.get(url + '.gz').status_code == 404
+        assert cli.get('/assets/../css/alaska.css').status_code == 404
+    shutil.rmtree(static, ignore_errors=True)
+    shutil.rmtree(root, ignore_errors=True)
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
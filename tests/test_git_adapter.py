@@ -39,3 +39,502 @@ def test_save_with_parent_conflict():
         assert False, "Expected conflict"
     except Conflict:
         pass
+
+
+def test_repo_handles_are_cached():
+    tmp = tempfile.mkdtemp()
+    adapter = GitAdapter(tmp)
+    rel = os.path.join('patientC', 'notes.txt')
+    adapter.save(rel, b'one', user_id='u1', action='create')
+    adapter.get(rel)
+    adapter.history(rel)
+    stats = adapter.cache_stats()
+    assert stats['misses'] == 1
+    assert stats['hits'] >= 2
+    assert stats['size'] == 1
+
+
+def test_repo_cache_evicts_least_recently_used():
+    tmp = tempfile.mkdtemp()
+    adapter = GitAdapter(tmp, repo_cache_size=2)
+    for pid in ('p1', 'p2', 'p3'):
+        adapter.save(os.path.join(pid, 'a.txt'), pid.encode(), user_id='u', action='create')
+    stats = adapter.cache_stats()
+    assert stats['size'] == 2
+    assert stats['evictions'] == 1
+    # the evicted repo is transparently reopened
+    assert adapter.get(os.path.join('p1', 'a.txt')) == b'p1'
+    adapter.close()
+    assert adapter.cache_stats()['size'] == 0
+
+
+def test_explicit_batch_makes_one_commit():
+    tmp = tempfile.mkdtemp()
+    adapter = GitAdapter(tmp)
+    with adapter.batch('patientD') as result:
+        assert adapter.save(os.path.join('patientD', 'a.png'), b'a', user_id='sw1', action='upload') is None
+        adapter.save(os.path.join('patientD', 'b.png'), b'b', user_id='sw1', action='upload')
+    sha = result['hexsha']
+    hist_a = adapter.history(os.path.join('patientD', 'a.png'))
+    hist_b = adapter.history(os.path.join('patientD', 'b.png'))
+    assert [h['hexsha'] for h in hist_a] == [sha]
+    assert [h['hexsha'] for h in hist_b] == [sha]
+    assert 'upload by user sw1 on patientD/a.png' in hist_a[0]['message']
+    assert 'upload by user sw1 on patientD/b.png' in hist_a[0]['message']
+
+
+def test_batch_keeps_every_version_of_a_path():
+    tmp = tempfile.mkdtemp()
+    adapter = GitAdapter(tmp)
+    rel = os.path.join('patientD2', 'a.txt')
+    with adapter.batch('patientD2') as result:
+        adapter.save(rel, b'v1', user_id='sw1', action='upload')
+        adapter.save(os.path.join('patientD2', 'b.txt'), b'b', user_id='sw1', action='upload')
+        adapter.save(rel, b'v2', user_id='sw1', action='edit')
+    hist = adapter.history(rel)
+    assert len(hist) == 2 and hist[-1]['hexsha'] == result['hexsha']
+    assert adapter.get(rel, hist[0]['hexsha']) == b'v1'
+    assert adapter.get(rel) == b'v2'
+
+
+def test_history_inside_batch_rebuilds_stale_index():
+    import shutil
+    import threading
+    tmp = tempfile.mkdtemp()
+    adapter = GitAdapter(tmp)
+    rel = os.path.join('patientD3', 'a.txt')
+    sha = adapter.save(rel, b'v1', user_id='sw1', action='upload')
+    shutil.rmtree(os.path.join(tmp, 'patientD3', '.git', 'bhv-history'))
+    result = {}
+
+    def run():
+        with adapter.batch('patientD3'):
+            result['history'] = adapter.history(rel)
+            adapter.rebuild_history_index('patientD3')
+
+    # the batch owner already holds the write lock; taking it again would hang
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert [h['hexsha'] for h in result['history']] == [sha]
+    adapter.close()
+
+
+def test_concurrent_reads_share_a_cached_repo():
+    import threading
+    tmp = tempfile.mkdtemp()
+    adapter = GitAdapter(tmp)
+    rel = os.path.join('patientD4', 'notes.txt')
+    adapter.save(rel, b'v0', user_id='u1', action='create')
+    errors = []
+
+    def read():
+        try:
+            for _ in range(300):
+                adapter.head(rel)
+                adapter.history(rel)
+        except Exception as e:
+            errors.append(e)
+
+    def write():
+        for i in range(20):
+            adapter.save(rel, b'v%d' % (i + 1), user_id='u1', action='edit')
+
+    # every thread uses the same cached Repo; its cat-file pipe used to wedge
+    threads = [threading.Thread(target=read, daemon=True) for _ in range(8)]
+    threads.append(threading.Thread(target=write, daemon=True))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(timeout=60)
+    assert not any(t.is_alive() for t in threads)
+    assert not errors
+    assert len(adapter.history(rel)) == 21
+    adapter.close()
+
+
+def test_group_commit_window_shares_commit():
+    import threading
+    tmp = tempfile.mkdtemp()
+    adapter = GitAdapter(tmp, group_commit_window=0.5)
+    results = {}
+
+    def upload(name):
+        results[name] = adapter.save(os.path.join('patientE', name), name.encode(), user_id='sw', action='upload')
+
+    threads = [threading.Thread(target=upload, args=(f'scan{i}.png',)) for i in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(results.values())) == 1
+    assert len(adapter.history(os.path.join('patientE', 'scan0.png'))) == 1
+
+
+def test_group_commit_window_is_not_swept_into_another_process_commit():
+    import threading
+    import time
+    from git import Repo
+    tmp = tempfile.mkdtemp()
+    # two adapters with process locks on one tree stand in for two worker processes
+    alice = GitAdapter(tmp, group_commit_window=1.0)
+    bob = GitAdapter(tmp)
+    results = {}
+    thread = threading.Thread(target=lambda: results.setdefault('a', alice.save(
+        os.path.join('p', 'from_a.txt'), b'a', user_id='alice', action='upload')))
+    thread.start()
+    while 'p' not in alice._pending:
+        time.sleep(0.01)
+    results['b'] = bob.save(os.path.join('p', 'from_b.txt'), b'b', user_id='bob', action='upload')
+    thread.join()
+    repo = Repo(alice.repo_path('p'))
+
+    def changed(sha):
+        return repo.git.show('--name-only', '--format=', sha).split()
+
+    assert changed(results['b']) == ['from_b.txt']
+    assert changed(results['a']) == ['from_a.txt']
+    assert [h['hexsha'] for h in alice.history(os.path.join('p', 'from_a.txt'))] == [results['a']]
+    alice.close()
+    bob.close()
+
+
+def test_history_index_matches_and_rebuilds():
+    import shutil
+    tmp = tempfile.mkdtemp()
+    adapter = GitAdapter(tmp)
+    rel = os.path.join('patientF', 'notes.txt')
+    other = os.path.join('patientF', 'other.txt')
+    adapter.save(rel, b'one', user_id='u1', action='create')
+    adapter.save(other, b'x', user_id='u1', action='create')
+    adapter.save(rel, b'two', user_id='u2', action='edit')
+    hist = adapter.history(rel)
+    assert [h['message'] for h in hist] == [
+        'create by user u1 on patientF/notes.txt',
+        'edit by user u2 on patientF/notes.txt',
+    ]
+
+    import hashlib
+    assert hist[1]['sha256'] == hashlib.sha256(b'two').hexdigest()
+
+    # a repo without an index (e.g. created before it existed) is rebuilt on demand
+    shutil.rmtree(os.path.join(tmp, 'patientF', '.git', 'bhv-history'))
+    rebuilt = adapter.history(rel)
+    assert rebuilt == [{k: v for k, v in h.items() if k != 'sha256'} for h in hist]
+    assert adapter.rebuild_history_index('patientF') == {'patientF': 3}
+    assert adapter.history(other)[0]['author'] == 'BHV System'
+
+
+def test_history_index_rebuild_never_hides_entries(monkeypatch):
+    from bhv.storage import history_index
+    from bhv.storage.history_index import HistoryIndex
+    tmp = tempfile.mkdtemp()
+    adapter = GitAdapter(tmp)
+    rel = os.path.join('patientF2', 'notes.txt')
+    adapter.save(rel, b'one', user_id='u1', action='create')
+    adapter.save(rel, b'two', user_id='u1', action='edit')
+    index = HistoryIndex(os.path.join(tmp, 'patientF2', '.git'))
+    real_replace = os.replace
+    seen = []
+
+    def replace(src, dst):
+        # what a concurrent reader would get at each step of the swap
+        seen.append(len(index.read('notes.txt')))
+        real_replace(src, dst)
+
+    monkeypatch.setattr(history_index.os, 'replace', replace)
+    index.rebuild(adapter._ensure_repo('patientF2'))
+    monkeypatch.undo()
+    assert seen and min(seen) == 2
+    assert len(index.read('notes.txt')) == 2
+    # the staging directory is gone
+    assert not [n for n in os.listdir(os.path.join(tmp, 'patientF2', '.git')) if n.startswith('bhv-history-')]
+
+
+def test_get_stream_reads_in_chunks():
+    tmp = tempfile.mkdtemp()
+    adapter = GitAdapter(tmp)
+    rel = os.path.join('patientG', 'scan.bin')
+    first = bytes(range(256)) * 1000
+    c1 = adapter.save(rel, first, user_id='u', action='create')
+    adapter.save(rel, b'small', user_id='u', action='edit')
+
+    chunks = list(adapter.get_stream(rel, version=c1, chunk_size=4096))
+    assert max(len(c) for c in chunks) <= 4096
+    assert b''.join(chunks) == first
+    assert adapter.size(rel, version=c1) == len(first)
+    assert b''.join(adapter.get_stream(rel)) == b'small'
+    assert adapter.size(rel) == 5
+
+    import pytest
+    with pytest.raises(FileNotFoundError):
+        adapter.get_stream(os.path.join('patientG', 'missing.bin'), version=c1)
+
+
+def test_save_streams_file_like_and_enforces_limit():
+    import io
+    import pytest
+    from bhv.storage.errors import UploadTooLarge
+    tmp = tempfile.mkdtemp()
+    adapter = GitAdapter(tmp, max_file_size=10)
+    rel = os.path.join('patientH', 'scan.png')
+    adapter.save(rel, io.BytesIO(b'0123456789'), user_id='u', action='upload')
+    adapter.save(rel, iter([b'abc', b'def']), user_id='u', action='edit')
+    assert adapter.get(rel) == b'abcdef'
+
+    with pytest.raises(UploadTooLarge):
+        adapter.save(rel, io.BytesIO(b'x' * 11), user_id='u', action='edit')
+    assert adapter.get(rel) == b'abcdef'
+    assert len(adapter.history(rel)) == 2
+    assert os.listdir(os.path.join(tmp, 'patientH', '.git', 'bhv-tmp')) == []
+
+
+def test_historical_reads_share_one_catfile_worker():
+    adapter = GitAdapter(tempfile.mkdtemp())
+    rel = os.path.join('patientCF', 'notes.txt')
+    first = adapter.save(rel, b'v1' * 1000, user_id='u', action='create')
+    second = adapter.save(rel, b'v2', user_id='u', action='edit')
+    for _ in range(3):
+        assert adapter.get(rel, first) == b'v1' * 1000
+        assert adapter.get(rel, second) == b'v2'
+    assert adapter.size(rel, first) == 2000
+    stats = adapter.catfile_stats()
+    assert stats['started'] == 1 and stats['requests'] >= 7
+
+    # a stream abandoned half way must not poison the worker
+    stream = adapter.get_stream(rel, first, chunk_size=10)
+    assert next(iter(stream)) == b'v1' * 5
+    stream.close()
+    assert adapter.get(rel, second) == b'v2'
+    assert b''.join(adapter.get_stream(rel, first, chunk_size=64)) == b'v1' * 1000
+
+    import pytest
+    with pytest.raises(FileNotFoundError):
+        adapter.get(rel, 'deadbeef')
+    with pytest.raises(FileNotFoundError):
+        adapter.get_stream(os.path.join('patientCF', 'missing.txt'), first)
+    adapter.close()
+
+
+def test_catfile_pool_is_bounded_and_falls_back_when_busy():
+    adapter = GitAdapter(tempfile.mkdtemp(), catfile_workers=1)
+    a = adapter.save(os.path.join('pA', 'f.txt'), b'a', user_id='u', action='create')
+    b = adapter.save(os.path.join('pB', 'f.txt'), b'b', user_id='u', action='create')
+    assert adapter.get(os.path.join('pA', 'f.txt'), a) == b'a'
+    assert adapter.get(os.path.join('pB', 'f.txt'), b) == b'b'
+    stats = adapter.catfile_stats()
+    assert stats['workers'] == 1 and stats['stopped'] == 1
+
+    # pB's worker is held by an open stream: other reads use one-shot processes
+    held = adapter.get_stream(os.path.join('pB', 'f.txt'), b)
+    assert b''.join(adapter.get_stream(os.path.join('pB', 'f.txt'), b)) == b'b'
+    assert adapter.get(os.path.join('pB', 'f.txt'), b) == b'b'
+    assert adapter.get(os.path.join('pA', 'f.txt'), a) == b'a'
+    assert b''.join(held) == b'b'
+    adapter.close()
+
+
+def test_missing_path_with_spaces_is_not_found():
+    import pytest
+    adapter = GitAdapter(tempfile.mkdtemp(), catfile_workers=1)
+    adapter.save(os.path.join('pS', 'other file.txt'), b'x' * 200000, user_id='u', action='create')
+    missing = os.path.join('pS', 'my file.txt')
+    with pytest.raises(FileNotFoundError):
+        adapter.size(missing, 'HEAD')
+    # and through the one-shot fallback while the repo's worker is busy
+    held = adapter.get_stream(os.path.join('pS', 'other file.txt'), 'HEAD')
+    with pytest.raises(FileNotFoundError):
+        adapter.blob_id(missing, 'HEAD')
+    held.close()
+    adapter.close()
+
+
+def test_dedup_stores_identical_content_once():
+    tmp = tempfile.mkdtemp()
+    adapter = GitAdapter(tmp, dedup=True)
+    form = b'consent form ' * 1000
+    first = adapter.save(os.path.join('p1', 'consent.pdf'), form, user_id='u', action='create')
+    adapter.save(os.path.join('p2', 'consent.pdf'), form, user_id='u', action='create')
+    assert adapter._blobs.stats() == {'stored': 1, 'deduplicated': 1}
+    objects = [f for _, _, files in os.walk(os.path.join(tmp, '.objects')) for f in files]
+    assert len(objects) == 1
+    # the repo holds only a pointer
+    assert os.path.getsize(os.path.join(tmp, 'p1', 'consent.pdf')) < 128
+
+    rel = os.path.join('p1', 'consent.pdf')
+    second = adapter.save(rel, b'revised', user_id='u', action='edit')
+    assert adapter.get(rel) == b'revised'
+    assert adapter.get(rel, first) == form
+    assert b''.join(adapter.get_stream(rel, first)) == form
+    assert b''.join(adapter.get_stream(os.path.join('p2', 'consent.pdf'))) == form
+    assert adapter.size(rel, first) == len(form) and adapter.size(os.path.join('p2', 'consent.pdf')) == len(form)
+    assert [h['hexsha'] for h in adapter.history(rel)] == [first, second]
+    diff = adapter.diff(rel, first, second)
+    assert '+revised' in diff['text']
+    adapter.close()
+
+
+def test_uploads_that_look_like_pointers_do_not_read_other_blobs():
+    import hashlib
+    tmp = tempfile.mkdtemp()
+    note = b'alice private note'
+    alice = GitAdapter(tmp, dedup=True)
+    alice.save(os.path.join('alice', 'note.txt'), note, user_id='alice', action='create')
+    forged = b'bhv-blob v1 sha256:%s size:%d\n' % (hashlib.sha256(note).hexdigest().encode(), len(note))
+    for dedup in (False, True):
+        bob = GitAdapter(tmp, dedup=dedup)
+        rel = os.path.join('bob', f'x{int(dedup)}.txt')
+        sha = bob.save(rel, forged, user_id='bob', action='create')
+        assert bob.get(rel) == forged and bob.get(rel, sha) == forged
+        assert b''.join(bob.get_stream(rel, sha)) == forged and bob.size(rel) == len(forged)
+        bob.close()
+    alice.close()
+
+
+def test_maintenance_repacks_after_write_threshold():
+    tmp = tempfile.mkdtemp()
+    adapter = GitAdapter(tmp)
+    scheduler = adapter.enable_maintenance(write_threshold=3, min_interval=0, poll_interval=3600)
+    rel = os.path.join('patientM', 'notes.txt')
+    for i in range(2):
+        adapter.save(rel, b'v%d' % i, user_id='u', action='edit')
+    assert scheduler.due() == []
+    last = adapter.save(rel, b'final', user_id='u', action='edit')
+    assert scheduler.due() == ['patientM']
+
+    assert scheduler.run_pending() == 1
+    git_dir = os.path.join(tmp, 'patientM', '.git')
+    packs = os.listdir(os.path.join(git_dir, 'objects', 'pack'))
+    assert any(p.endswith('.bitmap') for p in packs)
+    assert os.path.exists(os.path.join(git_dir, 'objects', 'info', 'commit-graph'))
+    assert scheduler.due() == [] and scheduler.stats()['runs'] == 1
+    assert adapter.get(rel) == b'final' and adapter.get(rel, last) == b'final'
+    assert len(adapter.history(rel)) == 3
+    adapter.close()
+
+
+def test_sharded_layout_and_online_migration():
+    tmp = tempfile.mkdtemp()
+    flat = GitAdapter(tmp)
+    rel = os.path.join('legacy@example.com', 'notes.txt')
+    first = flat.save(rel, b'old layout', user_id='u', action='create')
+
+    adapter = GitAdapter(tmp, shard_levels=2)
+    new_rel = os.path.join('new@example.com', 'notes.txt')
+    adapter.save(new_rel, b'sharded', user_id='u', action='create')
+    new_path = adapter.repo_path('new@example.com')
+    assert os.path.relpath(new_path, tmp).count(os.sep) == 2
+    # unmigrated repos are still found in the flat layout
+    assert adapter.repo_path('legacy@example.com') == os.path.join(tmp, 'legacy@example.com')
+    assert adapter.get(rel) == b'old layout'
+    assert adapter.patients() == ['legacy@example.com', 'new@example.com']
+    other = GitAdapter(tmp, shard_levels=2)
+    assert other.get(rel) == b'old layout'
+
+    assert adapter.migrate_to_shards('legacy@example.com')
+    assert not adapter.migrate_to_shards('legacy@example.com')
+    assert not os.path.exists(os.path.join(tmp, 'legacy@example.com'))
+    assert adapter.get(rel, first) == b'old layout'
+    second = adapter.save(rel, b'after move', user_id='u', action='edit')
+    assert [h['hexsha'] for h in adapter.history(rel)] == [first, second]
+    assert adapter.patients() == ['legacy@example.com', 'new@example.com']
+
+    # an adapter that cached the repo at its old path reopens it
+    assert other.get(rel) == b'after move'
+    assert other.get(rel, first) == b'old layout'
+    adapter.close()
+    other.close()
+    flat.close()
+
+
+def test_patient_locks_are_reclaimed():
+    tmp = tempfile.mkdtemp()
+    adapter = GitAdapter(tmp)
+    for i in range(5):
+        rel = os.path.join(f'patient{i}', 'notes.txt')
+        adapter.save(rel, b'x', user_id='u', action='create')
+        adapter.history(rel)
+    with adapter.batch('patient0'):
+        adapter.save(os.path.join('patient0', 'more.txt'), b'y', user_id='u', action='create')
+        assert len(adapter._locks) == 1
+    assert len(adapter._locks) == 0
+    assert 'patient0' in adapter.patients() and '.locks' not in adapter.patients()
+    adapter.close()
+
+
+def test_parent_conflicts_are_per_path():
+    import pytest
+    from bhv.storage.errors import Conflict
+    tmp = tempfile.mkdtemp()
+    adapter = GitAdapter(tmp)
+    a = os.path.join('patientP', 'a.txt')
+    b = os.path.join('patientP', 'b.txt')
+    base = adapter.save(a, b'a1', user_id='u', action='create')
+    adapter.save(b, b'b1', user_id='u', action='create')
+    # b changed after base, a did not
+    assert adapter.save_with_parent(a, b'a2', user_id='u', action='edit', parent=base)
+    with pytest.raises(Conflict) as exc:
+        adapter.save_with_parent(b, b'b2', user_id='u', action='edit', parent=base)
+    head = adapter.head(b)
+    assert exc.value.head == head
+    assert adapter.save_with_parent(b, b'b2', user_id='u', action='edit', parent=exc.value.head)
+    assert adapter.get(b) == b'b2'
+    adapter.close()
+
+
+def test_commit_fails_if_head_moves_underneath():
+    import pytest
+    from bhv.storage.errors import Conflict
+    tmp = tempfile.mkdtemp()
+    # two adapters on one tree without shared locks stand in for two processes
+    mine = GitAdapter(tmp, process_locks=False)
+    theirs = GitAdapter(tmp, process_locks=False)
+    rel = os.path.join('patientR', 'notes.txt')
+    base = mine.save(rel, b'one', user_id='u', action='create')
+
+    stage = mine._stage
+
+    def racing_stage(repo, relative_path, tmp_path):
+        theirs.save(relative_path, b'theirs', user_id='other', action='edit')
+        stage(repo, relative_path, tmp_path)
+
+    mine._stage = racing_stage
+    with pytest.raises(Conflict) as exc:
+        mine.save_with_parent(rel, b'mine', user_id='u', action='edit', parent=base)
+    assert exc.value.head == theirs.head(rel) != base
+    # the losing write was rolled back; the other writer's commit stands
+    assert mine.get(rel) == b'theirs'
+    assert [h['hexsha'] for h in mine.history(rel)][-1] == exc.value.head
+    mine.close()
+    theirs.close()
+
+
+def test_open_reader_seeks_in_current_and_historical_versions():
+    from bhv.storage.base import StreamReader
+    tmp = tempfile.mkdtemp()
+    adapter = GitAdapter(tmp)
+    rel = os.path.join('patientS', 'scan.bin')
+    old = bytes(range(256)) * 1000
+    first = adapter.save(rel, old, user_id='u', action='create')
+    adapter.save(rel, b'new' * 1000, user_id='u', action='edit')
+
+    with adapter.open_reader(rel) as f:
+        assert not isinstance(f, StreamReader)
+        f.seek(2997)
+        assert f.read(10) == b'new'
+    with adapter.open_reader(rel, version=first) as f:
+        f.seek(1000)
+        assert f.read(5) == old[1000:1005]
+        assert f.tell() == 1005
+
+    dedup = GitAdapter(tempfile.mkdtemp(), dedup=True)
+    commit = dedup.save(rel, old, user_id='u', action='create')
+    dedup.save(rel, b'other', user_id='u', action='edit')
+    with dedup.open_reader(rel, version=commit) as f:
+        # the stored blob behind a pointer is a real file
+        assert not isinstance(f, StreamReader)
+        f.seek(len(old) - 3)
+        assert f.read() == old[-3:]
+    adapter.close()
+    dedup.close()
@@ -0,0 +1,113 @@
+import json
+import os
+import uuid
+
+import git
+import pytest
+
+from bhv import db
+from bhv.importer import Journal, group_batches, read_manifest, run_import, scan_tree
+from bhv.storage.git_adapter import GitAdapter
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def test_scan_tree_and_manifest(tmp_path):
+    src = tmp_path / 'archive'
+    _write(str(src / 'p1' / 'scan one.png'), b'one')
+    _write(str(src / 'p1' / 'scan one.png.narrative.txt'), b'first visit\n')
+    _write(str(src / 'p2' / 'notes.txt'), b'two')
+    items = list(scan_tree(str(src)))
+    assert [(i.patient_id, i.filename, i.narrative) for i in items] == [
+        ('p1', 'scan_one.png', 'first visit'), ('p2', 'notes.txt', '')]
+
+    manifest = tmp_path / 'manifest.csv'
+    manifest.write_text('patient_id,path,narrative,timestamp\n'
+                        'p1,archive/p1/scan one.png,hello,2020-01-02T03:04:05\n')
+    (item,) = read_manifest(str(manifest))
+    assert item.path == str(src / 'p1' / 'scan one.png') and item.timestamp == '2020-01-02T03:04:05'
+
+    jsonl = tmp_path / 'manifest.jsonl'
+    jsonl.write_text(json.dumps({'patient_id': 'p2', 'path': 'archive/p2/notes.txt'}) + '\n')
+    assert [i.filename for i in read_manifest(str(jsonl))] == ['notes.txt']
+
+    batches = group_batches(items * 3, batch_size=2)
+    assert [len(b) for b in batches['p1']] == [2, 1] and [len(b) for b in batches['p2']] == [2, 1]
+
+
+def test_import_commits_once_per_batch_and_resumes(tmp_path):
+    db.init_db()
+    pid = f'import-{uuid.uuid4().hex}@example.com'
+    src = tmp_path / 'archive'
+    for i in range(5):
+        _write(str(src / pid / f'f{i}.txt'), b'data %d' % i)
+    root = str(tmp_path / 'uploads')
+    journal = str(tmp_path / 'journal.jsonl')
+    items = list(scan_tree(str(src)))
+
+    counts = run_import(items, root, journal, workers=1, batch_size=2, log=lambda msg: None)
+    assert counts == {'patients': 1, 'files': 5, 'entries': 5}
+    adapter = GitAdapter(root)
+    try:
+        assert int(git.Repo(adapter.repo_path(pid)).git.rev_list('--count', 'HEAD')) == 3
+        assert b''.join(adapter.get_stream(os.path.join(pid, 'f4.txt'))) == b'data 4'
+    finally:
+        adapter.close()
+    assert sorted(e['filename'] for e in db.list_entries_for_patient(pid)) == [f'f{i}.txt' for i in range(5)]
+
+    # a finished import does nothing when run again
+    assert run_import(items, root, journal, workers=1, batch_size=2, log=lambda msg: None)['entries'] == 0
+
+    def crash_during_last_insert():
+        # the journal as left by a crash during the last batch's insert
+        with open(journal) as f:
+            lines = f.readlines()
+        with open(journal, 'w') as f:
+            f.writelines(line for line in lines if not ('"db"' in line and '"batch": 2' in line))
+
+    # the rows had all been written: nothing is inserted twice
+    crash_during_last_insert()
+    committed, started, inserted = Journal(journal).load()
+    assert (pid, 2) in committed and (pid, 2) in started and (pid, 2) not in inserted
+    counts = run_import(items, root, journal, workers=1, batch_size=2, log=lambda msg: None)
+    assert counts == {'patients': 1, 'files': 0, 'entries': 0}
+    assert len(db.list_entries_for_patient(pid)) == 5
+
+    # the row had not been written yet: it is inserted
+    crash_during_last_insert()
+    for entry in db.list_entries_for_patient(pid):
+        if entry['filename'] == 'f4.txt':
+            db.delete_entry(str(db.entry_id_of(entry)))
+    counts = run_import(items, root, journal, workers=1, batch_size=2, log=lambda msg: None)
+    assert counts == {'patients': 1, 'files': 0, 'entries': 1}
+    assert len(db.list_entries_for_patient(pid)) == 5
+
+def test_import_checks_every_file_before_writing(tmp_path):
+    src = tmp_path / 'archive'
+    _write(str(src / 'p1' / 'a.txt'), b'a')
+    items = list(scan_tree(str(src)))
+    os.remove(str(src / 'p1' / 'a.txt'))
+    with pytest.raises(FileNotFoundError):
+        run_import(items, str(tmp_path / 'uploads'), str(tmp_path / 'j.jsonl'), workers=1, log=lambda msg: None)
+    assert not os.path.exists(str(tmp_path / 'uploads' / 'p1'))
+
+
+
+def test_import_rejects_name_collisions_and_stores_utc(tmp_path):
+    from datetime import datetime
+    from bhv.importer import _timestamp
+    src = tmp_path / 'archive'
+    _write(str(src / 'p1' / 'a' / 'scan.pdf'), b'a')
+    _write(str(src / 'p1' / 'b' / 'scan.pdf'), b'b')
+    with pytest.raises(ValueError, match='scan.pdf'):
+        run_import(scan_tree(str(src)), str(tmp_path / 'uploads'), str(tmp_path / 'j.jsonl'), workers=1,
+                   log=lambda msg: None)
+    assert not os.path.exists(str(tmp_path / 'uploads' / 'p1'))
+
+    assert _timestamp('2020-01-02T03:04:05+02:00') == datetime(2020, 1, 2, 1, 4, 5)
+    assert _timestamp('2020-01-02T03:04:05Z') == datetime(2020, 1, 2, 3, 4, 5)
+    assert _timestamp('2020-01-02T03:04:05') == datetime(2020, 1, 2, 3, 4, 5)
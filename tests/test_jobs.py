@@ -0,0 +1,97 @@
+import os
+import tempfile
+
+from bhv.jobs import JobQueue
+
+
+def test_job_runs_once_and_cleans_up_staging():
+    root = tempfile.mkdtemp()
+    seen = []
+
+    def handler(payload, data_path, progress):
+        with open(data_path, 'rb') as f:
+            seen.append((payload['name'], f.read()))
+        return {'ok': True}
+
+    queue = JobQueue(root, handler)
+    job_id = queue.submit({'name': 'a'}, iter([b'hello ', b'world']))
+    assert queue.status(job_id)['status'] == 'pending'
+    assert queue.run_pending() == 1
+    assert queue.run_pending() == 0
+    assert seen == [('a', b'hello world')]
+    job = queue.status(job_id)
+    assert job['status'] == 'done' and job['result'] == {'ok': True} and job['attempts'] == 1
+    assert not os.path.exists(queue.data_path(job_id))
+    assert queue.status('../../etc/passwd') is None
+
+
+def test_failed_job_is_retried_then_dead_lettered():
+    root = tempfile.mkdtemp()
+    calls = []
+
+    def handler(payload, data_path, progress):
+        calls.append(dict(progress))
+        progress['step1'] = True
+        raise RuntimeError('git is down')
+
+    queue = JobQueue(root, handler, max_attempts=3, retry_delay=0)
+    job_id = queue.submit({}, b'data')
+    assert queue.run_pending() == 3
+    # progress recorded by earlier attempts is handed to the retries
+    assert calls == [{}, {'step1': True}, {'step1': True}]
+    job = queue.status(job_id)
+    assert job['status'] == 'dead' and job['attempts'] == 3
+    assert 'git is down' in job['error']
+    assert os.path.exists(queue.data_path(job_id))  # kept for inspection
+    assert queue.counts() == {'pending': 0, 'running': 0, 'done': 0, 'dead': 1}
+
+
+def test_retry_waits_for_backoff_and_stale_running_jobs_are_requeued():
+    root = tempfile.mkdtemp()
+    attempts = []
+
+    def handler(payload, data_path, progress):
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError('transient')
+
+    queue = JobQueue(root, handler, retry_delay=3600, lease_timeout=0)
+    job_id = queue.submit({})
+    assert queue.run_pending() == 1
+    assert queue.status(job_id)['status'] == 'pending'
+    assert queue.run_pending() == 0  # not due yet
+
+    # a worker that died mid-job leaves it in running/
+    os.rename(queue._path('pending', job_id), queue._path('running', job_id))
+    os.utime(queue._path('running', job_id), (0, 0))
+    queue.sweep()
+    assert queue.run_pending() == 1
+    assert queue.status(job_id)['status'] == 'done'
+
+
+def test_progress_survives_a_worker_that_dies_mid_job():
+    import pytest
+    root = tempfile.mkdtemp()
+    commits = []
+
+    class WorkerDied(BaseException):
+        pass
+
+    def handler(payload, data_path, progress):
+        if 'commit' not in progress:
+            commits.append(1)
+            progress['commit'] = 'abc'
+            if len(commits) == 1:
+                raise WorkerDied()  # the process is gone before the handler returns
+        return {'commit': progress['commit']}
+
+    queue = JobQueue(root, handler, lease_timeout=0)
+    job_id = queue.submit({})
+    with pytest.raises(WorkerDied):
+        queue.run_pending()
+    assert queue.status(job_id)['progress'] == {'commit': 'abc'}
+    os.utime(queue._path('running', job_id), (0, 0))
+    queue.sweep()
+    assert queue.run_pending() == 1
+    assert commits == [1]
+    assert queue.status(job_id)['result'] == {'commit': 'abc'}
@@ -0,0 +1,79 @@
+import tempfile
+import threading
+import time
+
+import pytest
+
+from bhv.storage.locks import LockManager, fcntl
+
+
+def _blocks(fn, timeout=0.2):
+    """Run fn in a thread; return (thread, done event) after giving it ``timeout`` to finish."""
+    done = threading.Event()
+    t = threading.Thread(target=lambda: (fn(), done.set()), daemon=True)
+    t.start()
+    done.wait(timeout)
+    return t, done
+
+
+def test_entries_are_reclaimed_when_released():
+    locks = LockManager()
+    with locks.write('a'), locks.read('b'):
+        assert len(locks) == 2
+    assert len(locks) == 0
+
+
+def test_readers_do_not_wait_for_writers_but_exclusive_waits_for_both():
+    locks = LockManager()
+    writer = locks.acquire('p', LockManager.WRITE)
+    _, read_done = _blocks(lambda: locks.acquire('p', LockManager.READ).release())
+    assert read_done.is_set()  # reading alongside a commit
+    _, second_writer = _blocks(lambda: locks.acquire('p', LockManager.WRITE).release())
+    assert not second_writer.is_set()
+    writer.release()
+    second_writer.wait(1)
+    assert second_writer.is_set()
+
+    held_read = threading.Event()
+    release_read = threading.Event()
+
+    def reader():
+        with locks.read('p'):
+            held_read.set()
+            release_read.wait()
+
+    threading.Thread(target=reader, daemon=True).start()
+    held_read.wait()
+    t, exclusive = _blocks(lambda: locks.acquire('p', LockManager.EXCLUSIVE).release())
+    assert not exclusive.is_set()
+    release_read.set()
+    t.join(1)
+    assert exclusive.is_set()
+    assert len(locks) == 0
+
+
+def test_nested_reads_do_not_deadlock_behind_a_waiting_exclusive():
+    locks = LockManager()
+    with locks.read('p'):
+        t, exclusive = _blocks(lambda: locks.acquire('p', LockManager.EXCLUSIVE).release(), timeout=0.05)
+        with locks.read('p'):
+            pass
+        assert not exclusive.is_set()
+    t.join(1)
+    assert exclusive.is_set()
+
+
+@pytest.mark.skipif(fcntl is None, reason='file locks need fcntl')
+def test_file_locks_exclude_other_processes():
+    lock_dir = tempfile.mkdtemp()
+    # two managers stand in for two worker processes: their flocks use separate open files
+    first, second = LockManager(lock_dir), LockManager(lock_dir)
+    held = first.acquire('patient@example.com', LockManager.WRITE)
+    _, read_done = _blocks(lambda: second.acquire('patient@example.com', LockManager.READ).release())
+    assert read_done.is_set()
+    t, write_done = _blocks(lambda: second.acquire('patient@example.com', LockManager.WRITE).release())
+    assert not write_done.is_set()
+    time.sleep(0.05)
+    held.release()
+    t.join(1)
+    assert write_done.is_set()
@@ -0,0 +1,83 @@
+import pytest
+
+from bhv import db
+from bhv.search import SearchIndex, tokenize
+
+
+def _index(*docs):
+    index = SearchIndex()
+    index.build(docs)
+    return index
+
+
+def test_tokenize_lowercases_and_splits():
+    assert tokenize('Feeling ANXIOUS, day-3.txt') == ['feeling', 'anxious', 'day', '3', 'txt']
+    assert tokenize(None) == []
+
+
+def test_bm25_ranks_more_relevant_entries_first():
+    index = _index(
+        ('1', 'p@x', 'anxiety anxiety anxiety today', 'a.txt'),
+        ('2', 'p@x', 'a long walk and some anxiety at the end of a long day', 'b.txt'),
+        ('3', 'p@x', 'a calm day', 'c.txt'),
+    )
+    hits = index.search('anxiety')
+    assert [doc_id for doc_id, _ in hits] == ['1', '2']
+    assert hits[0][1] > hits[1][1]
+
+
+def test_prefix_match_and_top_k():
+    index = _index(*[(str(i), 'p@x', 'anxious morning', f'{i}.txt') for i in range(30)])
+    assert len(index.search('anx', k=5)) == 5
+    assert index.search('zebra') == []
+
+
+def test_patient_scope():
+    index = _index(('1', 'a@x', 'therapy notes', None), ('2', 'b@x', 'therapy plan', None))
+    assert [d for d, _ in index.search('therapy', patient_id='a@x')] == ['1']
+    assert {d for d, _ in index.search('therapy')} == {'1', '2'}
+    assert index.search('therapy', patient_id='nobody@x') == []
+
+
+def test_add_and_remove_keep_index_current():
+    index = _index(('1', 'a@x', 'first', None))
+    index.add(2, 'a@x', 'second entry', None)
+    assert [d for d, _ in index.search('second')] == ['2']
+    index.add(2, 'a@x', 'renamed', None)
+    assert index.search('second') == []
+    index.remove(2)
+    assert index.search('renamed') == []
+    assert len(index) == 1
+
+
+def test_add_before_build_is_ignored():
+    index = SearchIndex()
+    index.add('1', 'a@x', 'text', None)
+    assert not index.built and len(index) == 0
+
+
+@pytest.mark.skipif(db.DB_BACKEND != 'sqlite', reason='uses the embedded SQLite backend')
+def test_search_entries_follows_writes():
+    pid = 'search-test@example.com'
+    entry_id = db.create_entry(pid, 'x.txt', 'insomnia again')
+    try:
+        assert [db.entry_id_of(e) for e in db.search_entries('insomnia', patient_id=pid)] == [str(entry_id)]
+        db.update_entry(entry_id, narrative='slept well')
+        assert db.search_entries('insomnia', patient_id=pid) == []
+        assert len(db.search_entries('slept', patient_id=pid)) == 1
+    finally:
+        db.delete_entry(entry_id)
+    assert db.search_entries('slept', patient_id=pid) == []
+
+
+def test_ensure_built_rebuilds_when_the_count_differs():
+    docs = [('1', 'a@x', 'insomnia', None)]
+    index = SearchIndex()
+    index.ensure_built(lambda: list(docs), lambda: len(docs))
+    # another process adds an entry: the count no longer matches
+    docs.append(('2', 'a@x', 'insomnia again', None))
+    index.ensure_built(lambda: list(docs), lambda: len(docs))
+    assert len(index.search('insomnia')) == 2
+    builds = []
+    index.ensure_built(lambda: builds.append(1) or docs, lambda: len(docs))
+    assert builds == []
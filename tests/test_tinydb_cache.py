@@ -0,0 +1,64 @@
+import json
+import os
+import tempfile
+import time
+
+from tinydb import TinyDB
+
+from bhv.tinydb_cache import AtomicJSONStorage, WriteBehindMiddleware
+
+
+def test_write_behind_flushes_on_threshold_and_close():
+    path = os.path.join(tempfile.mkdtemp(), 'db.json')
+    middleware = WriteBehindMiddleware(AtomicJSONStorage, flush_interval=3600, flush_writes=1000)
+    db = TinyDB(path, storage=middleware)
+    table = db.table('entries')
+    table.insert({'patient_id': 'p', 'filename': 'a.png'})
+    table.insert({'patient_id': 'p', 'filename': 'b.png'})
+
+    # nothing on disk yet, but reads see the cached writes
+    assert not os.path.exists(path)
+    assert len(table.all()) == 2
+    assert middleware.stats()['pending_writes'] == 2
+
+    middleware.flush()
+    assert middleware.stats()['pending_writes'] == 0
+    assert middleware.stats()['flushes'] == 1
+    with open(path) as f:
+        assert len(json.load(f)['entries']) == 2
+
+    table.insert({'patient_id': 'p', 'filename': 'c.png'})
+    db.close()
+    with open(path) as f:
+        assert len(json.load(f)['entries']) == 3
+    # no temp files left behind by the atomic writes
+    assert os.listdir(os.path.dirname(path)) == ['db.json']
+
+
+def test_write_behind_background_flush():
+    path = os.path.join(tempfile.mkdtemp(), 'db.json')
+    middleware = WriteBehindMiddleware(AtomicJSONStorage, flush_interval=3600, flush_writes=2)
+    db = TinyDB(path, storage=middleware)
+    db.table('users').insert({'email': 'a@example.com'})
+    db.table('users').insert({'email': 'b@example.com'})
+    # hitting the write threshold wakes the flusher thread
+    for _ in range(100):
+        if middleware.stats()['flushes']:
+            break
+        time.sleep(0.02)
+    assert middleware.stats()['flushes'] == 1
+    db.close()
+
+
+def test_write_behind_refuses_several_worker_processes(monkeypatch):
+    import pytest
+    from bhv.tinydb_cache import configured_workers
+    assert configured_workers({}) == 1
+    assert configured_workers({'WEB_CONCURRENCY': '4'}) == 4
+    assert configured_workers({'GUNICORN_CMD_ARGS': '--bind :80 -w 3'}) == 3
+    assert configured_workers({'GUNICORN_CMD_ARGS': '--workers=2 --threads 8'}) == 2
+    monkeypatch.setenv('WEB_CONCURRENCY', '2')
+    with pytest.raises(RuntimeError, match='2 worker processes'):
+        WriteBehindMiddleware(AtomicJSONStorage)
+    monkeypatch.setenv('WEB_CONCURRENCY', '1')
+    WriteBehindMiddleware(AtomicJSONStorage)